@@ -0,0 +1,100 @@
+import hardware
+import liberty
+import synth
+from structures import composedCells, structureOf
+
+''' Area estimates.
+The synthesis flow in ../synth reports the area of a design after a full yosys and ABC run. estimateArea gives an
+estimate from the hardware representation, fast enough to sweep over many parameterizations of a design:
+    - An AreaModel counts the gates of the structure of each leaf Component at the width of its ports (see
+      structures.py, which timing.py uses too), eg an n-bit Register is n DFFs and an n-bit adder is a
+      parallel-prefix adder of n bits.
+    - Each gate is costed with the area of the cell of the same name in a Liberty library. Gates missing from the
+      library are built from the parts listed in structures.composedCells, eg AND2 is NAND2 and INV in basic.lib.
+    - The area of a leaf is counted once, at the leaf. The AreaReport gives the area of the subtree of each Module
+      and of each source line: the area of a leaf is split evenly among the lines of its source tokens, so that the
+      lines add up to the total. Leaves without source tokens are counted under the line None.
+Constants, concatenations, constant slices and other wiring take no area. Logic which ABC would share between
+leaves, or remove as redundant, is counted in full, so the estimate is an upper bound for designs with a lot of
+constant or duplicated logic.
+'''
+
+class AreaModel:
+    ''' Maps each leaf Component to the gates it needs, by width. The area of a Component is its number of gates
+    unless a subclass costs the gates. '''
+    __slots__ = ()
+    def gates(self, component: 'hardware.Component') -> 'dict[str, float]':
+        ''' The number of gates of each kind in component, which are the gates of its structure. '''
+        return structureOf(component).gates
+    def area(self, component: 'hardware.Component') -> 'float':
+        ''' The area of component. The default is its number of gates. '''
+        return sum(self.gates(component).values())
+
+class LibertyAreaModel(AreaModel):
+    ''' Costs the gates of each leaf with the cell areas of a Liberty library, in the area unit of the library
+    (square microns for the bundled libraries). '''
+    __slots__ = 'cellAreas'
+    def __init__(self, library: 'liberty.Library|None' = None):
+        if library == None:
+            library = liberty.bundledLibrary()
+        self.cellAreas: 'dict[str, float]' = {name: cell.area for name, cell in library.cells.items()}
+        for name, parts, path in composedCells:
+            if name not in self.cellAreas:
+                self.cellAreas[name] = sum(count * self.cellAreas[part] for part, count in parts.items())
+    def area(self, component: 'hardware.Component') -> 'float':
+        return sum(count * self.cellAreas[gate] for gate, count in self.gates(component).items())
+
+class AreaReport:
+    ''' The estimated area of a design, see the note above. '''
+    __slots__ = 'total', 'byComponent', 'byModule', 'byLine'
+    def __init__(self):
+        self.total: 'float' = 0.0
+        self.byComponent: 'dict[hardware.Component, float]' = {}  # the area of each leaf
+        self.byModule: 'dict[hardware.Module, float]' = {}  # the area of the subtree of each Module other than a Register
+        self.byLine: 'dict[tuple[str, int]|None, float]' = {}  # the area of each (filename, line), lines counted from 1
+    def __str__(self):
+        lines = [f"area {self.total:.2f}", "  by module:"]
+        for module, area in sorted(self.byModule.items(), key=lambda item: -item[1]):
+            lines.append(f"    {module._name}: {area:.2f}")
+        lines.append("  by source line:")
+        for line, area in sorted(self.byLine.items(), key=lambda item: -item[1]):
+            if area > 0:
+                lines.append(f"    {'<unknown>' if line == None else (line[0] or '<unknown>') + ':' + str(line[1])}: {area:.2f}")
+        return "\n".join(lines)
+
+def tokenLines(text: 'str') -> 'list[int]':
+    ''' The line of each token of text, counted from 1, indexed like source tokens. '''
+    lines, line = [], 1
+    for token in synth.tokensAndWhitespace(text):
+        lines.append(line)
+        line += token.count('\n')
+    return lines
+
+def estimateArea(root: 'hardware.Component', model: 'AreaModel|None' = None, sources: 'dict[str, str]|None' = None) -> 'AreaReport':
+    ''' Estimates the area of the design root. sources maps the filename of each source file to its text, and is
+    needed to report the area by line. Run setWireTypes and inferWidths first, so that widths are known. '''
+    if model == None:
+        model = LibertyAreaModel()
+    lines = {filename: tokenLines(text) for filename, text in (sources or {}).items()}
+    report = AreaReport()
+    components = [root]
+    for component in components:  # grows as we go
+        components.extend(component._children)
+    subtreeAreas: 'dict[hardware.Component, float]' = {}
+    for component in reversed(components):  # children first
+        if len(component._children) > 0:
+            subtreeAreas[component] = sum(subtreeAreas[child] for child in component._children)
+            if hardware.isModule(component):
+                report.byModule[component] = subtreeAreas[component]
+            continue
+        area = model.area(component)
+        subtreeAreas[component] = report.byComponent[component] = area
+        report.total += area
+        componentLines = []
+        for filename, token in component.getSourceTokens():
+            line = (filename, lines[filename][token]) if filename in lines and token < len(lines[filename]) else None
+            if line not in componentLines:
+                componentLines.append(line)
+        for line in componentLines or [None]:
+            report.byLine[line] = report.byLine.get(line, 0.0) + area / max(len(componentLines), 1)
+    return report
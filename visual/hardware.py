@@ -1,7 +1,9 @@
 
 import mtypes
 import synth
-from typing import Any
+import contextvars
+import hashlib
+from typing import Any, Iterator
 
 print('synth', synth)
 
@@ -27,15 +29,73 @@ Garbage collection. We have two variations of hardware garbage collection.
 Version 1 uses a graph search to recursively find and remove unused nodes and their associated wires+components
 Version 2 uses mark-and-sweep as described below:
     - A Node is in use if
-        - it is an output Node of the root Component
+        - it is an output Node of the root Component or of a Component whose `_persistent` flag is set
+        - it is an input Node of a Component which is in use (so the input of a Register whose value is used is in use)
+        - it is the source of a Wire which is in use
     - A Wire is in use if
         - its destination Node is in use
     - A Component is in use if
+        - it is the root Component or its `_persistent` flag is set
         - any output Node of the Component is in use
-    - Any Node, Wire, or Component which is not in use is be removed.
+    - Any Node, Wire, or Component which is not in use is be removed. The ancestors of a Component in use are kept
+      so that the tree stays connected, and only the unused methods of Modules are removed from Components which
+      are kept. Functions, Muxes etc. keep their ports, so a kept Function is in use (and so are its inputs and
+      the hardware driving them) even if its output is not: no input of a kept Function is left without a driver.
+Both phases are iterative (see garbageCollection2), so deep hierarchies and long chains of logic do not run into
+the recursion limit.
 '''
 
 
+''' Designs.
+All state that used to be process-wide lives on a Design object instead:
+    - the id counters for Nodes, Wires, and Components,
+    - the type conflicts found by setWireTypes,
+    - the set of names synth.py has warned about as assumed built-ins/imports,
+    - flags controlling synthesis such as foldingConstantsThroughFunctionDefs,
+    - the builtins registered with synth.registerBuiltinValue and synth.registerBuiltinFunction.
+The current Design is held in a context variable. Each thread (and each asyncio task) starts out with its own
+default Design, and `with design:` makes a given Design current for the duration of the block. parseAndSynth
+runs each synthesis under a fresh Design unless one is passed in, so concurrent syntheses in one process do not
+share any mutable state, and ids start from 0 for each design (so are small and deterministic).
+Each Component remembers the Design it was created under; post-synthesis passes which create hardware or merge
+types (eg getELK, setWireTypes) reactivate the Design of the root they are given.
+'''
+
+class Design:
+    ''' Per-design state. Use as a context manager to make the design current. '''
+    __slots__ = 'numNodesCreated', 'numWiresCreated', 'numComponentsCreated', 'foldingConstantsThroughFunctionDefs', \
+                'assumedBuiltinOrImport', 'typeConflicts', 'typeConflictMessages', 'builtinValues', 'builtinFunctions', '_tokens'
+    def __init__(self, foldingConstantsThroughFunctionDefs: 'bool' = False):
+        self.numNodesCreated: 'int' = 0  # one for each node created
+        self.numWiresCreated: 'int' = 0  # one for each Wire created
+        self.numComponentsCreated: 'int' = 0  # one for each component created, so each component has a unique id
+        self.foldingConstantsThroughFunctionDefs: 'bool' = foldingConstantsThroughFunctionDefs
+        self.assumedBuiltinOrImport: 'set[str]' = set()  # the set of function names for which we have issued warning messages
+        self.typeConflicts: 'list[TypeConflict]' = []  # every type conflict found by setWireTypes
+        self.typeConflictMessages: 'set[str]' = set()  # the conflicts which have been reported
+        self.builtinValues: 'dict[str, Callable]' = {}  # builtins registered on this design, over synth.defaultBuiltinValues
+        self.builtinFunctions: 'dict[str, synth.BuiltinFunction]' = {}  # over synth.defaultBuiltinFunctions
+        self._tokens: 'list[contextvars.Token]' = []  # one for each (possibly nested) `with` block on this design
+    def __enter__(self) -> 'Design':
+        self._tokens.append(_currentDesign.set(self))
+        return self
+    def __exit__(self, *exc):
+        _currentDesign.reset(self._tokens.pop())
+        return False
+    def __repr__(self):
+        return f"Design({self.numComponentsCreated} components, {self.numNodesCreated} nodes, {self.numWiresCreated} wires)"
+
+_currentDesign: 'contextvars.ContextVar[Design|None]' = contextvars.ContextVar('currentDesign', default=None)
+
+def currentDesign() -> 'Design':
+    ''' Returns the Design of the current context, creating a default one if there is none yet. '''
+    design = _currentDesign.get()
+    if design == None:
+        design = Design()
+        _currentDesign.set(design)
+    return design
+
+
 ''' Private methods/fields begin with a single underscore. Type help(property) in python3 for details
 of setters/getters. Slots are used to enforce which fields may be set. '''
 
@@ -48,21 +108,21 @@ class Node:
     parent: the Component with this Node as an input or output.
     isInput: true if the parent Component has this Node as an input, false otherwise.
     label: the label of the Node in its parent Component. '''
-    _num_nodes_created = 0  # one for each node created
     __slots__ = '_name', '_mtype', '_id', '_inWires', '_outWires', '_parent', '_isInput', '_label'
     def __init__(self, name: 'str' = "", mtype: 'mtypes.MType' = mtypes.Any):
         self._name = name
         assert mtype.__class__ == mtypes.MType, f"Expected a type, not {mtype}"
         self._mtype = mtype
-        self._id = Node._num_nodes_created
-        Node._num_nodes_created += 1
+        design = currentDesign()
+        self._id = design.numNodesCreated
+        design.numNodesCreated += 1
         self._inWires: 'set[Wire]' = set()
         self._outWires: 'set[Wire]' = set()
         self._parent: 'Component' = None
         self._isInput: bool = None
         self._label = None
     def __hash__(self):
-        return hash('n' + str(self._id))
+        return self._id  # ids are unique within a design, and hashing an int is much cheaper than building a string
     def __repr__(self):
         return "Node(" + str(self._id) + ": " + str(self._mtype) + ")"
     def __str__(self):
@@ -70,6 +130,10 @@ class Node:
     def setMType(self, value):
         self._mtype = value
     @property
+    def width(self) -> 'int|None':
+        ''' The number of bits of the Node, or None if its type has no packed width. See inferWidths. '''
+        return self._mtype.packedWidth()
+    @property
     def inWires(self) -> 'set[Wire]':
         ''' The set of Wires with this Node as their dst. Mutable. '''
         return self._inWires
@@ -106,7 +170,6 @@ def isNodeOrMLiteral(value):
 class Wire:
     ''' src and dst are Nodes.
     Adds itself to the hardware data structure when initialized. '''
-    _num_wires_created = 0  # one for each Wire created
     __slots__ = '_id', '_src', '_dst', '_tokensSourcedFrom', '_mtype'
     def __init__(self, src: 'Node|synth.MValue', dst: 'Node'):
         if src.__class__ == synth.MValue:
@@ -118,16 +181,18 @@ class Wire:
         assert isNode(dst), f"Must be a node, not {dst} which is {dst.__class__}"
         assert src._parent != None, "Can only put Wire on Node in Component"
         assert dst._parent != None, "Can only put Wire on Node in Component"
-        self._id = Wire._num_wires_created
-        Wire._num_wires_created += 1
+        design = currentDesign()
+        self._id = design.numWiresCreated
+        design.numWiresCreated += 1
         self._src = src
         src.addOutWire(self)
+        src._parent._updateStatistics(0, 0, 1)
         self._dst = dst
         dst.addInWire(self)
         self._tokensSourcedFrom: 'list[list[tuple[str, int]]]' = tokensSourcedFrom
         self._mtype: 'mtypes.MType' = mtypes.Any
     def __hash__(self):
-        return hash('w' + str(self._id))
+        return self._id
     @property
     def src(self):
         '''The source node of the wire'''
@@ -142,6 +207,10 @@ class Wire:
     @dst.setter
     def dst(self, dst: 'Node'):
         raise Exception("Can't directly modify this property")
+    @property
+    def width(self) -> 'int|None':
+        ''' The number of bits of the Wire, or None if its type has no packed width. See inferWidths. '''
+        return self._mtype.packedWidth()
     def __repr__(self):
         return "Wire(" + self.src.__repr__() + ", " + self.dst.__repr__() + ")"
     def __str__(self):
@@ -165,9 +234,29 @@ class Wire:
         ''' Returns an estimate of how large a Component is. '''
         return 1
 
+def removeWire(wire: 'Wire'):
+    ''' Removes wire from the hardware, keeping the subtree statistics up to date. '''
+    wire._src._outWires.remove(wire)
+    wire._src._parent._updateStatistics(0, 0, -1)
+    wire._dst._inWires.remove(wire)
+
+''' Subtree statistics.
+Each Component caches statistics about the subtree of the component tree rooted at it:
+    - weight: the number of Components in the subtree,
+    - numNodes: the number of Nodes of Components in the subtree,
+    - numWires: the number of Wires whose src is a Node of a Component in the subtree,
+    - subtreeDepth: the number of levels of the subtree below the Component (0 for a Component without children).
+The counts are kept up to date as hardware is built and removed: adding a Node or Wire, addChild, removeChild,
+and garbage collection add the change to the Component and each of its ancestors, so each update costs O(depth)
+and reading a statistic is O(1). The depth can only shrink when a child is removed, in which case the depths of
+the ancestors are invalidated (set to None) and recomputed the next time they are read.
+Code which changes the tree must go through addChild/removeChild rather than editing _children directly, and code
+which removes a Wire must go through removeWire.
+'''
+
 class Component:
-    _num_components_created = 0  #one for each component created, so each component has a unique id
-    __slots__ = '_id', '_name', '_children', '_inputs', '_outputs', '_parent', '_tokensSourcedFrom', '_persistent'
+    __slots__ = '_id', '_name', '_children', '_inputs', '_outputs', '_parent', '_tokensSourcedFrom', '_persistent', '_design', \
+                '_weight', '_numNodes', '_numWires', '_depth'
     def __init__(self, name: 'str', inputs: 'dict[Any, Node]', outputs: 'dict[Any, Node]', parent: 'Component|None', children: 'set[Component]'):
         # type assertions
         assert name.__class__ == str, f'Component name must be a string, not {name.__class__}'
@@ -181,9 +270,11 @@ class Component:
         assert children.__class__ == set, f'Component children must be a set, not {name.__class__}'
         for child in children:
             assert isinstance(child, Component), f'Component children must be Components, not {name.__class__}'
-        # give each component a unique _id
-        self._id = Component._num_components_created
-        Component._num_components_created += 1
+        # give each component an _id which is unique within its design
+        design = currentDesign()
+        self._design: 'Design' = design
+        self._id = design.numComponentsCreated
+        design.numComponentsCreated += 1
         self._name: 'str' = name
         self._children: 'set[Component]' = children
         for child in self._children:
@@ -199,10 +290,15 @@ class Component:
         self._parent: 'Component|None' = parent
         self._tokensSourcedFrom: 'list[list[tuple[str, int]]]' = []
         self._persistent: 'bool' = False
+        # subtree statistics, see the note above
+        self._weight: 'int' = 1 + sum(child._weight for child in children)
+        self._numNodes: 'int' = len(inputs) + len(outputs) + sum(child._numNodes for child in children)
+        self._numWires: 'int' = sum(child._numWires for child in children)
+        self._depth: 'int|None' = 1 + max((child.subtreeDepth() for child in children), default=-1)
     def __repr__(self):
         return "Component(" + self._name + ", " + self._children.__repr__() + ", " + self._inputs.__repr__() + ", " + self._outputs.__repr__() + ")"
     def __hash__(self):
-        return hash('c' + str(self._id))
+        return self._id
     @property
     def name(self):
         ''' The name of the component, eg 'f' or 'combine#(1,1)' or '*'. '''
@@ -211,6 +307,10 @@ class Component:
     def name(self, name: 'str'):
         self._name = name
     @property
+    def design(self) -> 'Design':
+        ''' The Design the Component was created under. '''
+        return self._design
+    @property
     def children(self):
         ''' The child Components of the Component '''
         return self._children
@@ -220,12 +320,14 @@ class Component:
         assert inputKey not in self._inputs, f"Can't overwrite existing input {inputKey}"
         inputNode.setParent(self, True, inputKey)
         self._inputs[inputKey] = inputNode
+        self._updateStatistics(0, 1, 0)
     def addOutput(self, outputNode: 'Node', outputKey: 'Any'):
         '''Add the output with the given key'''
         assert outputNode.__class__ == Node, f"Outputs must be a Node, not {outputNode.__class__}"
         assert outputKey not in self._outputs, f"Can't overwrite existing output {outputKey}"
         outputNode.setParent(self, False, outputKey)
         self._outputs[outputKey] = outputNode
+        self._updateStatistics(0, 1, 0)
     @property
     def inputs(self) -> 'dict[Any, Node]':
         ''' A copy of the inputs of the Component '''
@@ -244,15 +346,33 @@ class Component:
     def parent(self) -> 'Component|None':
         ''' The parent of the component. '''
         return self._parent
-    def updateTypes(self) -> 'set[Node]':
-        ''' Updates the types of self via inference. Returns the set of nodes whose types changed. '''
-        return set()
+    def addTypeConstraints(self, unifier: 'TypeUnifier'):
+        ''' Adds the type constraints self places on its nodes to unifier. See setWireTypes. '''
+        pass
+    def transferWidths(self, widths: 'dict[int, int|None]'):
+        ''' Sets the widths of the outputs of self (a leaf component) from the widths of its inputs, once all
+        of the inputs have been visited. widths maps id(node) to the width of node. See inferWidths. '''
+        pass
     def match(self, other: 'Component|None') -> bool:
         ''' Returns true if self and other represent the same hardware. '''
         assert self != other, "cannot compare a component to itself"
         assert self._parent == None, "can only compare hardware structures at the root Component"
         assert other._parent == None, "can only compare hardware structures at the root Component"
-
+        selfForm, otherForm = canonicalForm(self), canonicalForm(other)
+        if selfForm.invariant != otherForm.invariant:
+            # most failing comparison tests should fail here.
+            return False
+        if selfForm.digest == otherForm.digest and selfForm.structure == otherForm.structure:
+            # the canonical orders map self onto other
+            return True
+        if selfForm.exact and otherForm.exact:
+            # the canonical orders are the only candidate map, and it failed
+            return False
+        return self.matchBySearch(other)
+    def matchBySearch(self, other: 'Component') -> bool:
+        ''' Returns true if self and other represent the same hardware, by searching the orderings of the children
+        of each Component. Exponential in the worst case; match only falls back to it when the canonical forms of
+        self and other are not exact. '''
         # we give each component a signature corresponding to the Component tree with the component as its root.
         # isomorphic trees have the same signature.
         selfSignatures: 'dict[Component, int]' = {}
@@ -439,6 +559,32 @@ class Component:
         assert component != self, "A Component cannot be its own child"
         self._children.add(component)
         component._parent = self
+        self._updateStatistics(component._weight, component._numNodes, component._numWires)
+        # the depths of the ancestors can only grow
+        depth, ancestor = component.subtreeDepth() + 1, self
+        while ancestor != None and ancestor._depth != None and ancestor._depth < depth:
+            ancestor._depth = depth
+            depth, ancestor = depth + 1, ancestor._parent
+    def removeChild(self, component: 'Component'):
+        ''' Detaches component (and its subtree) from self. '''
+        assert component in self._children, "Can only remove a child of the Component"
+        self._children.remove(component)
+        component._parent = None
+        self._updateStatistics(-component._weight, -component._numNodes, -component._numWires)
+        if self._depth != None and component.subtreeDepth() + 1 == self._depth:
+            # the depth may shrink, so recompute it when it is next read
+            ancestor = self
+            while ancestor != None and ancestor._depth != None:
+                ancestor._depth = None
+                ancestor = ancestor._parent
+    def _updateStatistics(self, weight: 'int', numNodes: 'int', numWires: 'int'):
+        ''' Adds the given changes to the subtree statistics of self and its ancestors. '''
+        component = self
+        while component != None:
+            component._weight += weight
+            component._numNodes += numNodes
+            component._numWires += numWires
+            component = component._parent
     def addSourceTokens(self, tokens: 'list[tuple[str, int]]'):
         ''' Given a list of tuples (filename, token), adds the list to the collection of sources of the component. '''
         self._tokensSourcedFrom.append(tokens)
@@ -455,23 +601,157 @@ class Component:
     def getAllWires(self) -> 'set[Wire]':
         ''' Returns the set of all wires in the data structure. '''
         wires = set()
-        for child in self._children:
-            for wire in child.getAllWires():
-                wires.add(wire)
-        for nodeKey in self._inputs:
-            for wire in self._inputs[nodeKey].outWires:
-                wires.add(wire)
-        for nodeKey in self._outputs:
-            for wire in self._outputs[nodeKey].outWires:
-                wires.add(wire)
+        toVisit = [self]
+        while len(toVisit) > 0:
+            component = toVisit.pop()
+            for node in component._inputs.values():
+                wires.update(node._outWires)
+            for node in component._outputs.values():
+                wires.update(node._outWires)
+            toVisit.extend(component._children)
         return wires
     def weight(self):
-        ''' Returns an estimate of how large a Component is. '''
-        return 1 + sum([c.weight() for c in self._children])
+        ''' Returns an estimate of how large a Component is: the number of Components in its subtree. '''
+        return self._weight
+    def numNodes(self) -> 'int':
+        ''' The number of Nodes of the Components in the subtree of self. '''
+        return self._numNodes
+    def numWires(self) -> 'int':
+        ''' The number of Wires whose src is a Node of a Component in the subtree of self. '''
+        return self._numWires
+    def subtreeDepth(self) -> 'int':
+        ''' The number of levels of the subtree below self. '''
+        if self._depth == None:
+            # recompute the invalidated depths in the subtree, children first
+            order, toVisit = [], [self]
+            while len(toVisit) > 0:
+                component = toVisit.pop()
+                order.append(component)
+                toVisit.extend(child for child in component._children if child._depth == None)
+            for component in reversed(order):
+                component._depth = 1 + max((child._depth for child in component._children), default=-1)
+        return self._depth
+
+''' Canonical forms.
+canonicalForm computes a description of a hardware tree and graph which does not depend on the order of the
+children of each Component (an unordered tree, see the hardware rep note) or on ids, so that two Components which
+`match` have the same canonical form. It works on a graph with a vertex for each Component and each Node, with
+edges from each Component to its parent and to its Nodes and an edge for each Wire within the tree:
+    1. Color refinement (1-dimensional Weisfeiler-Lehman). Each Component starts out colored by its name and each
+       Node by its side and label. In each round, every vertex is recolored by its color and the multiset of the
+       kinds and colors of its neighbors, until the number of colors stops growing. The multiset of the final
+       colors is the invariant: Components which match have the same invariant.
+    2. Individualization. While some vertices share a color, one vertex of the smallest such color class is
+       given a new color and the colors are refined again. The vertex chosen is the first of its class, which
+       depends on the order of the children of each Component, so the result is only guaranteed to be canonical
+       if no choice was needed (exact) or the vertices of each class were symmetric. Each individualization reruns
+       refinement on the whole graph, so a design with many symmetric parts (eg a vector of identical modules)
+       costs O(V*E*rounds) rather than O(E*rounds).
+    3. The canonical order sorts vertices by color. The structure lists the Components, Nodes and Wires by their
+       canonical positions, and the digest is a sha256 hash of the structure.
+Initial colors are hashed with hashlib and later colors with python's hash of tuples of ints, so digests are the
+same in every process. Equal digests mean equal structures, hence Components which match, but when the forms are
+not exact two Components which match can have different digests: a cache keyed by digests never returns the
+entry of different hardware, but can miss entries of hardware which matches.
+Component.match compares invariants, then the structures in canonical order (a fast verification), and only
+falls back to searching over orderings of children (matchBySearch) if the canonical forms were not exact.
+'''
+
+class CanonicalForm:
+    ''' The canonical form of a Component, see the note above.
+    digest: a hex string which is the same for Components with the same structure. It is only canonical (the same
+        for every Component which matches) if exact is true or the vertices which shared a color were symmetric,
+        since individualization picks the first vertex of a class, which depends on the order of the children.
+    invariant: the sorted colors after refinement. Components which match have the same invariant.
+    structure: the tree and graph with vertices numbered in canonical order.
+    exact: true if refinement alone gave every vertex its own color.
+    components, nodes: the Components and Nodes of the tree in canonical order. '''
+    __slots__ = 'digest', 'invariant', 'structure', 'exact', 'components', 'nodes'
+    def __init__(self, digest: 'str', invariant: 'tuple[int, ...]', structure: 'tuple', exact: 'bool', components: 'list[Component]', nodes: 'list[Node]'):
+        self.digest = digest
+        self.invariant = invariant
+        self.structure = structure
+        self.exact = exact
+        self.components = components
+        self.nodes = nodes
+    def __repr__(self):
+        return f"CanonicalForm({self.digest[:16]}, {len(self.components)} components, {len(self.nodes)} nodes{', exact' if self.exact else ''})"
+
+def stableHash(value: 'str') -> 'int':
+    ''' A 64-bit hash of value which is the same in every process. '''
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'little', signed=True)
+
+def refineColors(colors: 'list[int]', neighbors: 'list[list[tuple[int, int]]]') -> 'list[int]':
+    ''' Recolors each vertex by its color and the multiset of (edge kind, color) of its neighbors until the number
+    of distinct colors stops growing, and returns the stable colors. '''
+    numColors = len(set(colors))
+    while True:
+        colors = [hash((colors[v], tuple(sorted([(kind, colors[u]) for kind, u in neighbors[v]])))) for v in range(len(colors))]
+        newNumColors = len(set(colors))
+        if newNumColors == numColors:
+            return colors
+        numColors = newNumColors
+
+def canonicalForm(root: 'Component') -> 'CanonicalForm':
+    ''' Returns the canonical form of the hardware tree rooted at root, see the note above. '''
+    components: 'list[Component]' = [root]
+    for component in components:  # grows as we go
+        components.extend(component._children)
+    componentIndex = {component: i for i, component in enumerate(components)}
+    nodes: 'list[Node]' = [node for component in components for node in list(component._inputs.values()) + list(component._outputs.values())]
+    numComponents = len(components)
+    nodeIndex = {node: numComponents + i for i, node in enumerate(nodes)}
+    # edge kinds: 0 to the parent Component, 1 to a child Component, 2 to a Node, 3 to the parent of a Node,
+    # 4 along a Wire to its dst, 5 back along a Wire to its src.
+    neighbors: 'list[list[tuple[int, int]]]' = [[] for i in range(numComponents + len(nodes))]
+    colors: 'list[int]' = []
+    for i, component in enumerate(components):
+        colors.append(stableHash('c' + component._name))
+        if component._parent != None and i > 0:
+            parent = componentIndex[component._parent]
+            neighbors[i].append((0, parent))
+            neighbors[parent].append((1, i))
+    wires: 'list[tuple[int, int]]' = []
+    for node in nodes:
+        v, parent = nodeIndex[node], componentIndex[node._parent]
+        colors.append(stableHash(('i' if node._isInput else 'o') + repr(node._label)))
+        neighbors[parent].append((2, v))
+        neighbors[v].append((3, parent))
+        for wire in node._outWires:
+            if wire._dst in nodeIndex:  # wires leaving root are not part of the structure
+                u = nodeIndex[wire._dst]
+                neighbors[v].append((4, u))
+                neighbors[u].append((5, v))
+                wires.append((v, u))
+    colors = refineColors(colors, neighbors)
+    invariant = tuple(sorted(colors))
+    exact = len(set(colors)) == len(colors)
+    while len(set(colors)) < len(colors):
+        # individualize a vertex of the smallest class of vertices which share a color
+        classes: 'dict[int, list[int]]' = {}
+        for v, color in enumerate(colors):
+            classes.setdefault(color, []).append(v)
+        size, color = min((len(members), color) for color, members in classes.items() if len(members) > 1)
+        colors = colors.copy()
+        colors[classes[color][0]] = hash((color, -1))  # only ints, whose hashes are the same in every process
+        colors = refineColors(colors, neighbors)
+    order = sorted(range(len(colors)), key=lambda v: colors[v])
+    position = [0] * len(order)
+    for i, v in enumerate(order):
+        position[v] = i
+    orderedComponents = [components[v] for v in order if v < numComponents]
+    orderedNodes = [nodes[v - numComponents] for v in order if v >= numComponents]
+    structure = (tuple((component._name, position[componentIndex[component._parent]] if component is not root else -1) for component in orderedComponents),
+                 tuple((position[componentIndex[node._parent]], node._isInput, repr(node._label)) for node in orderedNodes),
+                 tuple(sorted((position[v], position[u]) for v, u in wires)))
+    digest = hashlib.sha256(repr(structure).encode()).hexdigest()
+    return CanonicalForm(digest, invariant, structure, exact, orderedComponents, orderedNodes)
+
 
 class Function(Component):
-    __slots__ = 'inputNames'
-    def __init__(self, name: 'str', inputs: 'list[Node]' = None, output: 'Node' = None, children: 'set[Component]' = None):
+    ''' builtin is the synth.BuiltinFunction the component is a call of, or None if it is not a builtin call. '''
+    __slots__ = 'inputNames', 'builtin'
+    def __init__(self, name: 'str', inputs: 'list[Node]' = None, output: 'Node' = None, children: 'set[Component]' = None, builtin: 'synth.BuiltinFunction|None' = None):
         if inputs == None:
             inputs = []
         if output == None:
@@ -481,22 +761,56 @@ class Function(Component):
             children = set()
         Component.__init__(self, name, {i : inputs[i] for i in range(len(inputs))}, {0: output}, None, children)
         self.inputNames = []
+        self.builtin = builtin
     @property
     def inputs(self):
         '''Returns a copy of the list of input Nodes to this function'''
         return [self._inputs[i] for i in range(len(self._inputs))]
-    def updateTypes(self):
-        nodesUpdated = set()
-        if self.name == 'fromMaybe':
-            assert len(self.inputs) == 2, "Expected two inputs"
+    def addTypeConstraints(self, unifier: 'TypeUnifier'):
+        builtin = self.builtin
+        if builtin != None:
+            # use the type-inference rule of the builtin
+            assert len(self.inputs) == builtin.numArgs, f"Expected {builtin.numArgs} inputs"
+            unifier.addRule(self.inputs, self.output, builtin.inferOutputType)
         elif self.name == '&&' or self.name == '||':
             assert len(self.inputs) == 2, "Expected two inputs"
             for node in self.inputs + [self.output]:
-                correctType = mtypes.mergeEqualTypes(mtypes.Bool, node._mtype)
-                if node._mtype != correctType:
-                    nodesUpdated.add(node)
-                    node._mtype = correctType
-        return nodesUpdated
+                unifier.constrain(node, mtypes.Bool)
+    def transferWidths(self, widths: 'dict[int, int|None]'):
+        inputs, output, name = self.inputs, self.output, self.name
+        inputWidths = [widths[id(node)] for node in inputs]
+        outputWidth = None
+        if len(inputs) == 1 and name in reductionOperators:
+            outputWidth = 1
+        elif (len(inputs) == 1 and name in ('~', '-', '+')) or (len(inputs) == 2 and name in sameWidthOperators):
+            matchWidths(inputs + [output], widths)
+        elif len(inputs) == 2 and name in ('<<', '>>'):
+            outputWidth = inputWidths[0]
+        elif len(inputs) == 2 and name in comparisonOperators:
+            matchWidths(inputs, widths)
+            outputWidth = 1
+        elif name == '{}':
+            if all(width != None for width in inputWidths):
+                outputWidth = sum(inputWidths)
+        elif name.startswith('[') and len(inputs) > 0:
+            outputWidth = sliceWidth(name, inputs[0]._mtype)
+        elif name.startswith('.') and len(inputs) == 1:
+            structType = inputs[0]._mtype.untypedef()
+            if structType._constructor == mtypes.Struct and name[1:] in structType._fields:
+                outputWidth = structType._fields[name[1:]].packedWidth()
+        else:
+            builtin = self.builtin
+            if builtin != None and len(inputs) == builtin.numArgs:
+                inputTypes = [node._mtype if width == None or node._mtype.packedWidth() != None else mtypes.Bit(mtypes.IntegerLiteral(width))
+                              for node, width in zip(inputs, inputWidths)]
+                outputWidth = builtin.inferOutputType(inputTypes).packedWidth()
+                if name in ('min', 'max', 'fromMaybe'):
+                    # the operands of min and max and the default value of fromMaybe have the width of the output
+                    if widths[id(output)] == None:
+                        widths[id(output)] = outputWidth
+                    matchWidths((inputs[:1] if name == 'fromMaybe' else inputs) + [output], widths)
+        if widths[id(output)] == None:
+            widths[id(output)] = outputWidth
 
 class Mux(Component):
     __slots__ = '_control', '_inputNames'
@@ -525,17 +839,11 @@ class Mux(Component):
     def inputNames(self, inputNames: 'list[str]'):
         assert(len(inputNames) == len(self._inputs) - 1), f"Wrong number of mux input labels--expected {len(self._inputs) - 1}, got {len(inputNames)}"
         self._inputNames = inputNames
-    def updateTypes(self):
-        nodesUpdated = set()
-        nodesThatShouldMatch = set(self.inputs + [self.output])
-        typeToUse = mtypes.Any
-        for node in nodesThatShouldMatch:
-            typeToUse = mtypes.mergeEqualTypes(node._mtype, typeToUse)
-        for node in nodesThatShouldMatch:
-            if node._mtype != typeToUse:
-                node._mtype = typeToUse
-                nodesUpdated.add(node)
-        return nodesUpdated
+    def addTypeConstraints(self, unifier: 'TypeUnifier'):
+        for node in self.inputs:
+            unifier.union(node, self.output)
+    def transferWidths(self, widths: 'dict[int, int|None]'):
+        matchWidths(self.inputs + [self.output], widths)
 
 class Constant(Component):
     __slots__ = '_value'
@@ -587,18 +895,8 @@ class Register(Module):
     @value.setter
     def value(self, value: 'Node'):
         raise Exception("Can't directly modify this property")
-    def updateTypes(self):
-        updatedNodes = set()
-        myType = mtypes.Any
-        myType = mtypes.mergeEqualTypes(self.input._mtype, myType)
-        myType = mtypes.mergeEqualTypes(self.value._mtype, myType)
-        if myType != self.input._mtype:
-            self.input._mtype = myType
-            updatedNodes.add(self.input)
-        if myType != self.value._mtype:
-            self.value._mtype = myType
-            updatedNodes.add(self.value)
-        return updatedNodes
+    def addTypeConstraints(self, unifier: 'TypeUnifier'):
+        unifier.union(self.input, self.value)
 
 class VectorModule(Module):
     __slots__ = 'numberedSubmodules'
@@ -624,7 +922,7 @@ class VectorModule(Module):
 
 class Inserter(Function):
     ''' Represents inserting into part of a value. '''
-    __slots__ = 'varName'
+    __slots__ = 'varName', 'withValue'
     def __init__(self, withValue: 'bool', varName: 'str'):
         ''' withValue: whether or not the value has been initialized
         varName: the name of the value being changed '''
@@ -633,6 +931,7 @@ class Inserter(Function):
         else:
             Function.__init__(self, "", [])
         self.varName = varName
+        self.withValue = withValue
     def addText(self, text: 'str'):
         self._name += text
     def addSelector(self, selectionText: 'str'):
@@ -644,6 +943,9 @@ class Inserter(Function):
         value = Node()
         self.addInput(value, len(self.inputs))
         return value
+    def transferWidths(self, widths: 'dict[int, int|None]'):
+        if self.withValue:
+            matchWidths([self.inputs[0], self.output], widths)
 
 
 class Demux(Component):
@@ -688,8 +990,7 @@ def gc1component(component: 'Component'):
         assert len(node.outWires) == 0, "Cannot garbage collect a Component with Nodes which are sources"
     assert len(component.children) == 0, "Cannot garbage collect a Component with children"
     assert component.parent != None, "Cannot remove the root Component"
-    component.parent.children.remove(component)
-    component._parent = None
+    component.parent.removeChild(component)
     for nodeKey, node in component._inputs.copy().items():
         gc1node(node)
     for nodeKey, node in component._outputs.copy().items():
@@ -697,7 +998,7 @@ def gc1component(component: 'Component'):
 
 def gc1wire(wire: 'Wire'):
     node = wire.src
-    node.outWires.remove(wire)
+    removeWire(wire)
     if len(node.outWires) == 0:
         if not node._isInput:
             gc1node(node)
@@ -708,7 +1009,8 @@ def gc1node(node: 'Node'):
         del node.parent._inputs[node._label]
     else:
         del node.parent._outputs[node._label]
-    for wire in node.inWires:
+    node.parent._updateStatistics(0, -1, 0)
+    for wire in list(node.inWires):
         gc1wire(wire)
     component = node.parent
     if component.parent != None:
@@ -717,95 +1019,551 @@ def gc1node(node: 'Node'):
                 if len(component.children) == 0:
                     gc1component(component)
 
+def isModule(component: 'Component') -> 'bool':
+    ''' Returns whether component is a Module, a Register or a VectorModule. '''
+    return component.__class__ == Module or component.__class__ == Register or component.__class__ == VectorModule
+
+def garbageCollection2(root: 'Component') -> 'dict[type, int]':
+    ''' Garbage collection version 2: removes all unused hardware by mark-and-sweep, see the note at the top.
+    Returns the number of Components removed by class, along with the number of Nodes and Wires removed
+    (keyed by Node and Wire). '''
+    # mark
+    liveNodes: 'set[Node]' = set()
+    liveComponents: 'set[Component]' = set()
+    newlyLive: 'list[Component]' = []
+    toMark: 'list[Node]' = []
+    def markComponent(component: 'Component'):
+        if component not in liveComponents:
+            liveComponents.add(component)
+            newlyLive.append(component)
+            toMark.extend(component._inputs.values())
+    markComponent(root)
+    toMark.extend(root._outputs.values())
+    allComponents: 'list[Component]' = [root]
+    for component in allComponents:  # grows as we go
+        if component._persistent:
+            markComponent(component)
+            toMark.extend(component._outputs.values())
+        allComponents.extend(component._children)
+    keptComponents: 'set[Component]' = set()
+    while len(toMark) > 0 or len(newlyLive) > 0:
+        while len(toMark) > 0:
+            node = toMark.pop()
+            if node in liveNodes:
+                continue
+            liveNodes.add(node)
+            for wire in node._inWires:
+                toMark.append(wire._src)
+            if not node._isInput:
+                markComponent(node._parent)
+        while len(newlyLive) > 0:
+            component = newlyLive.pop()
+            while component != None and component not in keptComponents:
+                keptComponents.add(component)
+                if not isModule(component):
+                    markComponent(component)  # a kept Function, Mux etc. keeps its inputs driven
+                component = component._parent
+    # sweep
+    removed: 'dict[type, int]' = {Node: 0, Wire: 0}
+    for component in allComponents:
+        for node in list(component._inputs.values()) + list(component._outputs.values()):
+            if node in liveNodes:
+                continue
+            for wire in list(node._inWires):
+                removeWire(wire)
+                removed[Wire] += 1
+            if component in keptComponents and isModule(component) and not node._isInput and component is not root:
+                del component._outputs[node._label]
+                component._updateStatistics(0, -1, 0)
+                removed[Node] += 1
+    for component in allComponents:
+        if component not in keptComponents:
+            if component._parent in keptComponents:
+                component._parent.removeChild(component)
+            removed[component.__class__] = removed.get(component.__class__, 0) + 1
+            removed[Node] += len(component._inputs) + len(component._outputs)
+    return removed
+
+
+'''
+Combinational cycles and levels.
+The combinational graph has a vertex for each Node. Each Wire is an edge from its src to its dst, and each
+input of a combinational leaf (a Component without children which is not a Module, eg a builtin Function, a Mux
+or a Constant) has an edge to each output of the leaf. A Module without children (a Register, or a module which
+is only known by name) holds state, so its inputs have no edges to its outputs: registers are the cut points of
+the graph. Components with children only pass values through to and from their children by Wires.
+    levelize finds the strongly connected components of the combinational graph with Tarjan's algorithm, using
+an explicit stack so that it runs in linear time without recursion on large designs. A strongly connected
+component with more than one Node (or a Node with a Wire to itself) is a combinational cycle, reported as a
+CombinationalCycle with the Components and Wires on it and their source tokens.
+    Tarjan's algorithm finds the strongly connected components in reverse topological order, so the same pass
+gives each combinational leaf a level: 0 if no combinational leaf drives its inputs, and otherwise one more than
+the largest level of the leaves which do. Leaves with the same level do not depend on each other, so the levels
+are a schedule for simulation or timing. The levels are kept in the returned Levelization; the levels of leaves
+on a cycle are computed as if the cycle were cut at an arbitrary point.
+'''
+
+class CombinationalCycle:
+    ''' A strongly connected set of Nodes in the combinational graph. '''
+    __slots__ = 'nodes', 'components', 'wires'
+    def __init__(self, nodes: 'list[Node]'):
+        self.nodes: 'list[Node]' = nodes
+        nodeSet = set(nodes)
+        self.components: 'list[Component]' = []  # the combinational leaves on the cycle
+        for node in nodes:
+            if not node._isInput and node._parent not in self.components:
+                if len(node._parent._children) == 0 and not isinstance(node._parent, Module):
+                    self.components.append(node._parent)
+        self.wires: 'list[Wire]' = [wire for node in nodes for wire in node._outWires if wire._dst in nodeSet]
+    def getSourceTokens(self) -> 'list[tuple[str, int]]':
+        ''' Returns the source tokens of the Components and Wires on the cycle, without duplicates. '''
+        tokens = []
+        for item in self.components + self.wires:
+            tokens.extend(token for token in item.getSourceTokens() if token not in tokens)
+        return tokens
+    def __str__(self):
+        return "combinational cycle through " + ", ".join(component._name for component in self.components) + \
+            " (source tokens " + ", ".join(f"{filename or '<unknown>'}:{token}" for filename, token in self.getSourceTokens()) + ")"
+
+class Levelization:
+    ''' The combinational cycles and the levels of the combinational leaves of a design, see the note above. '''
+    __slots__ = 'levels', 'cycles'
+    def __init__(self, levels: 'dict[Component, int]', cycles: 'list[CombinationalCycle]'):
+        self.levels: 'dict[Component, int]' = levels
+        self.cycles: 'list[CombinationalCycle]' = cycles
+    def level(self, component: 'Component') -> 'int':
+        return self.levels[component]
+    def depth(self) -> 'int':
+        ''' The number of levels. '''
+        return 1 + max(self.levels.values(), default=-1)
+    def schedule(self) -> 'list[list[Component]]':
+        ''' The combinational leaves grouped by level, lowest level first. '''
+        schedule = [[] for i in range(self.depth())]
+        for component, level in self.levels.items():
+            schedule[level].append(component)
+        return schedule
+
+def isCombinationalLeaf(component: 'Component') -> 'bool':
+    return len(component._children) == 0 and not isinstance(component, Module)
+
+def combinationalSuccessors(node: 'Node') -> 'list[Node]':
+    ''' The Nodes with an edge from node in the combinational graph. '''
+    successors = [wire._dst for wire in node._outWires]
+    if node._isInput and isCombinationalLeaf(node._parent):
+        successors.extend(node._parent._outputs.values())
+    return successors
+
+def levelize(root: 'Component') -> 'Levelization':
+    ''' Finds the combinational cycles in the tree of root and the level of each combinational leaf. '''
+    nodes: 'list[Node]' = []
+    components: 'list[Component]' = [root]
+    for component in components:  # grows as we go
+        nodes.extend(component._inputs.values())
+        nodes.extend(component._outputs.values())
+        components.extend(component._children)
+    # Tarjan's algorithm
+    index: 'dict[Node, int]' = {}
+    lowlink: 'dict[Node, int]' = {}
+    onStack: 'set[Node]' = set()
+    stack: 'list[Node]' = []
+    stronglyConnected: 'list[list[Node]]' = []  # in reverse topological order
+    for start in nodes:
+        if start in index:
+            continue
+        index[start] = lowlink[start] = len(index)
+        stack.append(start)
+        onStack.add(start)
+        work: 'list[tuple[Node, Iterator[Node]]]' = [(start, iter(combinationalSuccessors(start)))]
+        while len(work) > 0:
+            node, successors = work[-1]
+            for successor in successors:
+                if successor not in index:
+                    index[successor] = lowlink[successor] = len(index)
+                    stack.append(successor)
+                    onStack.add(successor)
+                    work.append((successor, iter(combinationalSuccessors(successor))))
+                    break
+                if successor in onStack and index[successor] < lowlink[node]:
+                    lowlink[node] = index[successor]
+            else:
+                # every successor of node has been visited
+                work.pop()
+                if len(work) > 0 and lowlink[node] < lowlink[work[-1][0]]:
+                    lowlink[work[-1][0]] = lowlink[node]
+                if lowlink[node] == index[node]:
+                    members = []
+                    while True:
+                        member = stack.pop()
+                        onStack.remove(member)
+                        members.append(member)
+                        if member is node:
+                            break
+                    stronglyConnected.append(members)
+    # cycles and levels
+    cycles: 'list[CombinationalCycle]' = []
+    levels: 'dict[Component, int]' = {}
+    driverLevels: 'dict[Node, int]' = {}  # the level of the combinational leaf driving each Node, or -1
+    for members in reversed(stronglyConnected):
+        if len(members) > 1 or any(wire._dst is members[0] for wire in members[0]._outWires):
+            cycles.append(CombinationalCycle(members))
+        for node in members:
+            parent = node._parent
+            if not node._isInput and isCombinationalLeaf(parent):
+                if parent not in levels:
+                    levels[parent] = 1 + max((driverLevels.get(input, -1) for input in parent._inputs.values()), default=-1)
+                driverLevels[node] = levels[parent]
+            else:
+                driverLevels[node] = max((driverLevels.get(wire._src, -1) for wire in node._inWires), default=-1)
+    for component in components:
+        if isCombinationalLeaf(component) and component not in levels:  # a leaf without outputs
+            levels[component] = 1 + max((driverLevels.get(input, -1) for input in component._inputs.values()), default=-1)
+    return Levelization(levels, cycles)
 
 '''
 Wire type determination.
-We run a depth-first search through the graph from each node with type and assign Wire types as we go.
+Every Node and Wire is given a type. Nodes joined by a Wire always have the same type, as do the Nodes which
+a Component constrains to be equal (the inputs and output of a Mux, the input and value of a Register), so
+setWireTypes partitions the Nodes into classes with a union-find (TypeUnifier) and gives each class a type.
+Types are ordered by mtypes.joinTypes: unknown types and don't-cares are below every type, Integer is below
+every Bit#(n), and Maybe and Vector types are ordered by their element types. Components whose output type
+is computed from their input types (builtin functions) add a rule, which is reevaluated from a worklist each
+time the type of the class of one of its inputs rises. Since a type can only rise a few times, each rule is
+evaluated a near-constant number of times.
+Two types with no common upper bound are a type conflict. The class keeps the type it had, and the conflict
+is recorded on the Design (Design.typeConflicts) and reported once.
+'''
+
+def setWireTypes(comp: 'Component') -> 'list[TypeConflict]':
+    ''' Sets the types of the nodes and wires of comp. Returns the type conflicts found. '''
+    with comp.design:
+        return _setWireTypes(comp)
+
+def _setWireTypes(comp: 'Component') -> 'list[TypeConflict]':
+    unifier = TypeUnifier()
+    nodes: 'list[Node]' = []
+    components: 'list[Component]' = [comp]
+    while len(components) > 0:
+        component = components.pop()
+        for nodeKey, node in component._inputs.items():
+            nodes.append(node)
+            unifier.add(node)
+        for nodeKey, node in component._outputs.items():
+            nodes.append(node)
+            unifier.add(node)
+        components.extend(component._children)
+    for node in nodes:
+        for wire in node._outWires:
+            if wire._dst in unifier:  # wires leaving comp are not typed
+                unifier.union(wire._src, wire._dst)
+                unifier.constrain(wire._src, wire._mtype)
+    components = [comp]
+    while len(components) > 0:
+        component = components.pop()
+        component.addTypeConstraints(unifier)
+        components.extend(component._children)
+    unifier.solve()
+    for node in nodes:
+        node._mtype = unifier.typeOf(node)
+        for wire in node._outWires:
+            wire._mtype = node._mtype
+    return unifier.conflicts
+
+class TypeConflict:
+    ''' Two types which were required to be the same type but are not, found at node. '''
+    __slots__ = 'type1', 'type2', 'node'
+    def __init__(self, type1: 'mtypes.MType', type2: 'mtypes.MType', node: 'Node'):
+        self.type1 = type1
+        self.type2 = type2
+        self.node = node
+    def __str__(self):
+        return f"type conflict between {self.type1} and {self.type2}"
+    def __repr__(self):
+        return f"TypeConflict({self.type1}, {self.type2}, {self.node})"
+
+class TypeUnifier:
+    ''' A union-find over Nodes, each class having a type. See the notes on wire type determination.
+    Nodes are keyed by id(node) since hashing a Node is comparatively slow. '''
+    __slots__ = '_nodes', '_parent', '_size', '_mtype', '_rules', 'conflicts'
+    def __init__(self):
+        self._nodes: 'dict[int, Node]' = {}
+        self._parent: 'dict[int, int]' = {}
+        self._size: 'dict[int, int]' = {}  # only kept for roots
+        self._mtype: 'dict[int, mtypes.MType]' = {}  # only kept for roots
+        self._rules: 'list[tuple[list[Node], Node, Callable[[list[mtypes.MType]], mtypes.MType]]]' = []
+        self.conflicts: 'list[TypeConflict]' = []
+    def __contains__(self, node: 'Node') -> 'bool':
+        return id(node) in self._parent
+    def add(self, node: 'Node'):
+        ''' Adds node as a class of its own, with the type of node. '''
+        key = id(node)
+        self._nodes[key] = node
+        self._parent[key] = key
+        self._size[key] = 1
+        self._mtype[key] = node._mtype
+    def _find(self, key: 'int') -> 'int':
+        parent = self._parent
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]  # path halving
+            key = parent[key]
+        return key
+    def find(self, node: 'Node') -> 'Node':
+        ''' Returns the representative of the class of node. '''
+        return self._nodes[self._find(id(node))]
+    def typeOf(self, node: 'Node') -> 'mtypes.MType':
+        return self._mtype[self._find(id(node))]
+    def _join(self, root: 'int', mtype: 'mtypes.MType') -> 'bool':
+        ''' Raises the type of the class of root to include mtype. Returns whether the type changed. '''
+        currentType = self._mtype[root]
+        joinedType = mtypes.joinTypes(currentType, mtype)
+        if joinedType == None:
+            self.reportConflict(TypeConflict(currentType, mtype, self._nodes[root]))
+            return False
+        if joinedType is currentType:
+            return False
+        self._mtype[root] = joinedType
+        return True
+    def union(self, node1: 'Node', node2: 'Node'):
+        ''' Requires node1 and node2 to have the same type. '''
+        root1, root2 = self._find(id(node1)), self._find(id(node2))
+        if root1 == root2:
+            return
+        if self._size[root1] < self._size[root2]:
+            root1, root2 = root2, root1
+        self._parent[root2] = root1
+        self._size[root1] += self._size.pop(root2)
+        self._join(root1, self._mtype.pop(root2))
+    def constrain(self, node: 'Node', mtype: 'mtypes.MType') -> 'bool':
+        ''' Requires node to have (at least) the type mtype. Returns whether the type of the class of node changed. '''
+        return self._join(self._find(id(node)), mtype)
+    def addRule(self, inputs: 'list[Node]', output: 'Node', rule: 'Callable[[list[mtypes.MType]], mtypes.MType]'):
+        ''' Requires output to have the type rule(types of inputs). Rules are evaluated by solve. '''
+        self._rules.append((inputs, output, rule))
+    def reportConflict(self, conflict: 'TypeConflict'):
+        self.conflicts.append(conflict)
+        design = currentDesign()
+        design.typeConflicts.append(conflict)
+        message = str(conflict)
+        if message not in design.typeConflictMessages:
+            design.typeConflictMessages.add(message)
+            print(message)
+    def solve(self):
+        ''' Evaluates the rules until no type changes. Must be called after all unions. '''
+        dependents: 'dict[int, list[int]]' = {}  # the rules reading from each class
+        for i in range(len(self._rules)):
+            for node in self._rules[i][0]:
+                dependents.setdefault(self._find(id(node)), []).append(i)
+        worklist = list(range(len(self._rules)))
+        queued = set(worklist)
+        while len(worklist) > 0:
+            i = worklist.pop()
+            queued.remove(i)
+            inputs, output, rule = self._rules[i]
+            if self.constrain(output, rule([self.typeOf(node) for node in inputs])):
+                for j in dependents.get(self._find(id(output)), []):
+                    if j not in queued:
+                        queued.add(j)
+                        worklist.append(j)
+
 '''
+Width inference.
+inferWidths gives a concrete width to the nodes which setWireTypes leaves as Integer or Any, such as the outputs
+of operators (which have no type rules). Each leaf component has a transfer function (transferWidths) giving the
+widths of its outputs from the widths and types of its inputs:
+    - arithmetic and bitwise operators and muxes: all operands have the width of the widest operand whose width
+      is known, and operands whose width is not known (eg Integer constants) are given that width too,
+    - shifts have the width of the value shifted; comparisons, logical operators and reductions have 1 bit
+      (and the operands of a comparison are matched as above),
+    - a slice [msb:lsb] has msb-lsb+1 bits, and an index [i] has 1 bit or the width of a vector element,
+    - a concatenation has the sum of the widths of its inputs, and a field access .f has the width of f,
+    - builtin functions use the type rule of the builtin.
+A node whose type has a packed width keeps that width. In particular, extends, truncates and register reads and
+writes get their widths from the types setWireTypes propagates to them from the declared types of variables,
+registers and function outputs.
+The nodes are visited in topological order (Kahn's algorithm), where the graph has the wires as edges plus an edge
+from each input to each output of a leaf component. The value of a register does not depend on its input, which
+breaks the cycles of sequential logic. Each transfer function runs once, after all of its inputs are visited, so
+the pass is linear in the size of the design. Matching operand widths can give a width to a node which was already
+visited (eg an Integer constant which also drives another operator), and then the pass is repeated so the nodes it
+drives get the width too; each repeat gives a width to at least one more node, and there are rarely any. Nodes on
+combinational cycles keep the widths of their types.
+Nodes given a width are retyped as Bit#(n), as are the wires out of them, so Node.width and Wire.width are
+concrete wherever a width could be inferred.
+'''
+
+reductionOperators = set(['!', '&', '~&', '|', '~|', '^', '^~', '~^'])
+sameWidthOperators = (mtypes.arithmetic_binary - set(['<<', '>>'])) | mtypes.logical_binary
+comparisonOperators = mtypes.relational_binary | mtypes.equality_binary | mtypes.boolean_binary
+
+def inferWidths(comp: 'Component') -> 'list[Node]':
+    ''' Gives a width to each node and wire of comp whose type has no packed width, where one can be inferred.
+    Run after setWireTypes. Returns the nodes whose width could not be inferred. '''
+    with comp.design:
+        return _inferWidths(comp)
+
+def _inferWidths(comp: 'Component') -> 'list[Node]':
+    nodes: 'list[Node]' = []
+    leaves: 'list[Component]' = []
+    components: 'list[Component]' = [comp]
+    while len(components) > 0:
+        component = components.pop()
+        nodes.extend(component._inputs.values())
+        nodes.extend(component._outputs.values())
+        if len(component._children) == 0 and component is not comp:
+            leaves.append(component)
+        components.extend(component._children)
+    widths: 'dict[int, int|None]' = {id(node): node._mtype.packedWidth() for node in nodes}
+    while propagateWidths(nodes, leaves, widths):
+        pass  # a source was given a width after it was visited, so the nodes it drives are visited again
+    unknown: 'list[Node]' = []
+    for node in nodes:
+        width = widths[id(node)]
+        if width == None:
+            unknown.append(node)
+        elif node._mtype.packedWidth() == None:
+            node._mtype = mtypes.Bit(mtypes.IntegerLiteral(width))
+    for node in nodes:
+        for wire in node._outWires:
+            if wire._mtype.packedWidth() == None and node._mtype.packedWidth() != None:
+                wire._mtype = node._mtype
+    return unknown
 
-def setWireTypes(comp: 'Component'):
-    nodesToUpdate: 'set[Node]' = set()
-    getAllNodes(comp, nodesToUpdate)
-    nextNodes: 'set[Node]' = set()
-    while len(nodesToUpdate) != 0:
-        for node in nodesToUpdate:
-            setWiresTypesFromNode(node, nextNodes)
-        nodesToUpdate = nextNodes
-        nextNodes = set()
-
-
-def getAllNodes(comp: 'Component', nodes: 'set[Node]'):
-    for nodeKey, node in comp._inputs.items():
-        nodes.add(node)
-    for nodeKey, node in comp._outputs.items():
-        nodes.add(node)
-    for child in comp.children:
-        getAllNodes(child, nodes)
-
-def setWiresTypesFromNode(node: 'Node', nextNodes: 'set[Node]'):
-    sharedType = node._mtype
-    for wire in node.inWires:
-        sharedType = mtypes.mergeEqualTypes(wire._mtype, sharedType)
-    for wire in node.outWires:
-        sharedType = mtypes.mergeEqualTypes(wire._mtype, sharedType)
-    node._mtype = sharedType
-    for wire in node.inWires:
-        if wire._mtype != sharedType:
-            wire._mtype = sharedType
-            nextNodes.add(wire.src)
-    for wire in node.outWires:
-        if wire._mtype != sharedType:
-            wire._mtype = sharedType
-            nextNodes.add(wire.dst)
-    nodesUpdated = node.parent.updateTypes()
-    for otherNode in nodesUpdated:
-        nextNodes.add(otherNode)
+def propagateWidths(nodes: 'list[Node]', leaves: 'list[Component]', widths: 'dict[int, int|None]') -> 'bool':
+    ''' Visits nodes in topological order, giving each node with no width the width of the node driving it and
+    transferring widths through leaves once all their inputs are visited. Returns True if a node was given a width
+    after it was visited, in which case the nodes it drives have to be visited again. '''
+    # the number of edges into each node which have not been visited
+    pending: 'dict[int, int]' = {id(node): 0 for node in nodes}
+    for node in nodes:
+        for wire in node._outWires:
+            if id(wire._dst) in pending:  # wires leaving comp are not followed
+                pending[id(wire._dst)] += 1
+    waiting: 'dict[int, int]' = {}  # the number of inputs of each leaf component which have not been visited
+    for leaf in leaves:
+        if leaf.__class__ == Register or len(leaf._inputs) == 0:
+            continue  # the outputs are sources
+        waiting[id(leaf)] = len(leaf._inputs)
+        for node in leaf._outputs.values():
+            pending[id(node)] += 1
+    worklist = [node for node in nodes if pending[id(node)] == 0]
+    revisit = False
+    while len(worklist) > 0:
+        node = worklist.pop()
+        for wire in node._outWires:
+            dst = wire._dst
+            if id(dst) not in pending:
+                continue
+            if widths[id(dst)] == None:
+                widths[id(dst)] = widths[id(node)]
+            pending[id(dst)] -= 1
+            if pending[id(dst)] == 0:
+                worklist.append(dst)
+        parent = node._parent
+        if node._isInput and id(parent) in waiting:
+            waiting[id(parent)] -= 1
+            if waiting[id(parent)] == 0:
+                # matchWidths can give a width to the source of an input, which has already been visited
+                sources = [wire._src for input in parent._inputs.values() for wire in input._inWires if widths.get(id(wire._src), 0) == None]
+                parent.transferWidths(widths)
+                revisit = revisit or any(widths[id(source)] != None for source in sources)
+                for output in parent._outputs.values():
+                    pending[id(output)] -= 1
+                    if pending[id(output)] == 0:
+                        worklist.append(output)
+    return revisit
+
+def matchWidths(nodes: 'list[Node]', widths: 'dict[int, int|None]'):
+    ''' Gives the nodes with no width, and the sources of the wires into them, the largest width of the nodes. The
+    sources have usually been visited by propagateWidths already, which then visits them again. '''
+    knownWidths = [widths[id(node)] for node in nodes if widths[id(node)] != None]
+    if len(knownWidths) == 0:
+        return
+    width = max(knownWidths)
+    for node in nodes:
+        if widths[id(node)] == None:
+            widths[id(node)] = width
+            for wire in node._inWires:
+                if id(wire._src) in widths and widths[id(wire._src)] == None:
+                    widths[id(wire._src)] = width
+
+def sliceWidth(name: 'str', mtype: 'mtypes.MType') -> 'int|None':
+    ''' Returns the width of the output of the slice or index function with the given name, eg [3:0] or [_],
+    on a value of type mtype. '''
+    if name.count('[') != 1 or not name.endswith(']'):
+        return None
+    bounds = name[1:-1].split(':')
+    if len(bounds) == 2:
+        if '_' in bounds:
+            return None
+        return synth.parseIntLiteral(bounds[0]).value - synth.parseIntLiteral(bounds[1]).value + 1
+    mtype = mtype.untypedef()
+    if mtype._constructor == mtypes.Vector:
+        return mtype._typeValue.packedWidth()
+    return 1
 
 '''
 Vector module vacuum.
 We move components into a Vector module if they are part of a tight loop or if they have a unique
-output wire which ends in the Vector module.
+output wire which ends in the Vector module. Both conditions only depend on the wires and on which
+components are already in the Vector module, and stay true as the Vector module grows, so the final
+placement does not depend on the order in which components are considered. vacuumIntoVectorModule uses
+a worklist: it checks the neighbors of each child of the vector, and moving a component into the vector
+only queues the children whose neighbors may have become movable, so each pass is linear in the number
+of wires it looks at.
 '''
 
 def vacuumIntoVectors(comp: 'Component'):
-    if comp.__class__ == VectorModule:
-        vacuumIntoVectorModule(comp)
-    for child in comp.children.copy():
-        vacuumIntoVectors(child)
+    toVisit: 'list[Component]' = [comp]
+    while len(toVisit) > 0:
+        component = toVisit.pop()
+        if component.__class__ == VectorModule:
+            vacuumIntoVectorModule(component)
+        toVisit.extend(component._children)
 
 def vacuumIntoVectorModule(vector: 'VectorModule'):
-    progress = True
-    while progress:
-        progress = False
-        for child in vector.children.copy():
-            if len(child.outputs) == 1:
-                output = child.output
-                for wire in output.outWires:
-                    dstComp: 'Component' = wire.dst.parent
-                    assert dstComp != None, "Destination of wire must be part of component"
-                    if dstComp.parent == vector:
-                        # dstComp is already in vector, no need to consider it
-                        continue
-                    if len(dstComp.outputs) == 1:
-                        output2 = dstComp.output
-                        if len(output2.outWires) == 1:
-                            wire2 = list(output2.outWires)[0]
-                            dstComp2 = wire2.dst.parent
-                            if dstComp2.parent == vector:
-                                # dstComp is part of a tight loop
-                                dstComp.parent._children.remove(dstComp)
-                                vector.addChild(dstComp)
-                                progress = True
-            for inputKey, input in child._inputs.items():
-                for wire in input.inWires:
-                    src = wire.src
-                    if len(src.outWires) == 1:
-                        dstComp = src.parent
-                        if dstComp.parent != vector:
-                            # dstComp has a unique output which ends in vector
-                            dstComp.parent._children.remove(dstComp)
-                            vector.addChild(dstComp)
-                            progress = True
+    ancestors: 'set[Component]' = set()  # the vector and its ancestors, which can never move into the vector
+    ancestor = vector
+    while ancestor != None:
+        ancestors.add(ancestor)
+        ancestor = ancestor._parent
+    toVisit: 'list[Component]' = list(vector._children)
+    def moveIntoVector(component: 'Component'):
+        component._parent.removeChild(component)
+        vector.addChild(component)
+        toVisit.append(component)
+        # a component whose unique output wire ends in component may now be part of a tight loop
+        # with a child of the vector, which the child finds when it is visited again.
+        for input in component._inputs.values():
+            for wire in input._inWires:
+                for feederInput in wire._src._parent._inputs.values():
+                    for feederWire in feederInput._inWires:
+                        if feederWire._src._parent._parent is vector:
+                            toVisit.append(feederWire._src._parent)
+    while len(toVisit) > 0:
+        child = toVisit.pop()
+        if len(child._outputs) == 1:
+            output = child.output
+            for wire in list(output._outWires):
+                dstComp: 'Component' = wire._dst._parent
+                assert dstComp != None, "Destination of wire must be part of component"
+                if dstComp._parent is vector or dstComp in ancestors:
+                    # dstComp is already in vector, no need to consider it
+                    continue
+                if len(dstComp._outputs) == 1:
+                    output2 = dstComp.output
+                    if len(output2._outWires) == 1:
+                        wire2 = next(iter(output2._outWires))
+                        dstComp2 = wire2._dst._parent
+                        if dstComp2._parent is vector:
+                            # dstComp is part of a tight loop
+                            moveIntoVector(dstComp)
+        for input in list(child._inputs.values()):
+            for wire in list(input._inWires):
+                src = wire._src
+                if len(src._outWires) == 1:
+                    dstComp = src._parent
+                    if dstComp._parent is not vector and dstComp not in ancestors:
+                        # dstComp has a unique output which ends in vector
+                        moveIntoVector(dstComp)
 '''
 Some helpful ELK examples:
 https://rtsys.informatik.uni-kiel.de/elklive/elkgraph.html?compressedContent=OYJwhgDgFgBA4gRgFABswE8D2BXALjAbRgGcBLALwFMAuGAZjoAYAaeugNhgF0kA7TACaUAyhUoA6AMaZexXOFK9cxWgCICAOQDyAEQCiAfQAyAQQBCeo8NYBZAJIa7NgKo2DwuwC09XVUiiklOAgklDoABJgvAIoisC0DgDCRs76BonhdkY6AEp6GkhgKMCYIKS4UAC2tKXA4pSSsRDEEpQoANbiaOhBlAJ8mEYYOLi0AGZFLQNCMNJKYIpBMADeSACQ3SOE62sQmGS4pDK0AEwsMGc7ZFSnAJzsrCe3jOs8a-xColRSMnIKSioYOptGlTBYrLYHE5XO4vD4-GsAkEwCEwpForFePEYEkUmkMllcvl1h8RGJxJVFKRKthqkCABR0E7iFgAFnYLIAlAi2p0IGABAI4moCLhMBAALwclgoShjXAShAs5gAI0wuDFlUVyrKwCgCqVjF862I-MkcXEpI0ghoMBeGzAKraMCMCDUc1wC14QVUKx2mzw2zWwb2ByOvFoCBOrNYAFYdmtrrbWQAOR7IYNvd42oZOlDEcQQNCSSiVShKEXhdL5AAqehyrAAagYa1oAAqsBwefTGtYAXxJNpgellZaUCD9wYD+AICdD5XDkdYTITSbuMZgsboOyzpK+Ejmfy9yhFIMMYMs1hg9kcLjcHm8vcRgWCoQiURiwpxGmSqUMBOyPICmDPdyUpXhqVpNR6ROFNlROaVuX9R1nSME41BHUty1wBBfVWYMHSwQNZwIxMxFoFMHguDMCPnQ5jjtOMEyzbMhFzNoCyLMASzHUYgQIKtElresmxbdtOw0bt4R2Ad+0HGZMN4k5J0IrYSJDfYFwYhBWBTeMCLXC5bg3WN7TWXcbX3H5ZHkY9AWBXRz3MS9IVvGEH2k4MkVfNEP0xbFcT-dJMkA4kQMssCqRpOlVBguCWBOAB2LkEQdPMXToDDR2wk48ITacgwM8iYEo9ME12TT6IjRiYHYZiE1Jdj80LYssIrfjBOEhsYGbVsO2-KSn1k2TSWHbKlDoFSCvUiqw201gEDofTg0Mp4N0SmiLM+clD1sxQT34s9jGciFryhO9YUfVLvJRN90U-LEEh-PF-xColgNYslvnAyCYri+DksYJCpxQlAXVZLK2twOg8oI6bysM0rqPKujFxquqCJYxrQc41reMrasNDrbrevEga7B7VLhvkygxqh1kpuGYi50qtGdIuRgMZW4q1t07dMx2UDvl2-4Doc0ETqvG9oXvOEnxu1F3wxL9AvxN6gMFiLvqiqCGVggGUuQ9KjFjSHeNZWGQaImcEeKpGThojS5uq84ufMhqcxxlruKhgmhKJkSerE-quwpzy5LkgcgA
@@ -837,7 +1595,7 @@ uses the fact that ELKJS is known to preserve id information.
 The id of an object is then:
     <unique id created as component/wire creation> + '|' + <stringified json object with additional info>
 The unique id created for each component/wire does not contain a '|' and is guaranteed to be unique via a
-class variable counter that is incremented each time an instance is created. It has not been tested whether
+per-design counter that is incremented each time an instance is created (see Design above). It has not been tested whether
 or not longer node names may possibly slow down layout generation.
     In the html template, the portion of the id past the '|' is parsed into a JSON object to read off any
 properties that go beyond ELK's layouting data.
@@ -845,11 +1603,63 @@ properties that go beyond ELK's layouting data.
 json, which somewhat reduces the file size.
 '''
 
+'''
+Common ancestors.
+Each edge in the ELK output is placed in the lowest common ancestor of its endpoints. Walking up from both
+endpoints costs O(depth) per edge, so CommonAncestors indexes the component tree once per export instead.
+It records an Euler tour of the tree (every component is listed when it is entered and again after each of
+its children), so the lowest common ancestor of a and b is the shallowest component in the tour between the
+first appearances of a and b. A sparse table holds the shallowest position in each range of length 2**k,
+and any range is covered by two such ranges, so each query takes O(1) after O(n log n) preprocessing.
+'''
+
+class CommonAncestors:
+    ''' Answers lowest common ancestor queries in a tree of components. '''
+    __slots__ = 'first', 'tour', 'depths', 'table'
+    def __init__(self, root: 'Component'):
+        self.first: 'dict[Component, int]' = {root: 0}  # the first position of each component in the tour
+        self.tour: 'list[Component]' = [root]
+        self.depths: 'list[int]' = [0]
+        toVisit: 'list[tuple[Component, Iterator[Component]]]' = [(root, iter(root._children))]
+        while len(toVisit) > 0:
+            component, children = toVisit[-1]
+            child = next(children, None)
+            if child == None:
+                toVisit.pop()
+                if len(toVisit) > 0:
+                    self.tour.append(toVisit[-1][0])
+                    self.depths.append(len(toVisit) - 1)
+                continue
+            self.first[child] = len(self.tour)
+            self.tour.append(child)
+            self.depths.append(len(toVisit))
+            toVisit.append((child, iter(child._children)))
+        # table[k][i] is the position of the shallowest component in tour[i:i+2**k]
+        depths = self.depths
+        self.table: 'list[list[int]]' = [list(range(len(depths)))]
+        length = 1
+        while 2*length <= len(depths):
+            previous = self.table[-1]
+            self.table.append([ i if depths[i] <= depths[j] else j for i, j in zip(previous, previous[length:]) ])
+            length *= 2
+    def lowestCommonAncestor(self, first: 'Component', second: 'Component') -> 'Component':
+        ''' Returns the deepest component which contains (or is) both first and second. '''
+        assert first in self.first and second in self.first, "Can't find common ancestor for edge source/target"
+        start, end = sorted((self.first[first], self.first[second]))
+        k = (end - start + 1).bit_length() - 1
+        row = self.table[k]
+        i, j = row[start], row[end - 2**k + 1]
+        return self.tour[i if self.depths[i] <= self.depths[j] else j]
+
 def getELK(component: 'Component') -> 'dict[str, Any]':
     ''' Converts given component into the ELK JSON format, see https://rtsys.informatik.uni-kiel.de/elklive/json.html '''
-    
+    with component.design:
+        return _getELK(component)
+
+def _getELK(component: 'Component') -> 'dict[str, Any]':
     componentELKs: 'dict[Component, dict[str, Any]]' = {}  # maps components to the corresponding json object
     componentELK = toELK(component, componentELKs)
+    ancestors = CommonAncestors(component)
     
     # Place edges with closest common ancestor of their src/dst Nodes
     for wire in component.getAllWires():
@@ -881,20 +1691,9 @@ def getELK(component: 'Component') -> 'dict[str, Any]':
         # we have an ordinary edge, move it to the correct parent
         if not sourceNode._isInput:
             sourceParent = sourceParent.parent
-        # collect the parents of the source node
-        currentELK: 'Component' = sourceParent
-        sourceParents: 'list[Component]' = [currentELK]
-        while currentELK.parent != None:
-            currentELK = currentELK.parent
-            sourceParents.append(currentELK)
         if targetNode._isInput:
             targetParent = targetParent.parent
-        # collect the parents of the target node
-        currentELK = targetParent
-        while currentELK not in sourceParents:
-            assert currentELK.parent != None, "Can't find common ancestor for edge source/target"
-            currentELK = currentELK.parent
-        elk = componentELKs[currentELK]
+        elk = componentELKs[ancestors.lowestCommonAncestor(sourceParent, targetParent)]
         if "edges" not in elk:
             elk["edges"] = []
         elk["edges"].append(edge)
@@ -0,0 +1,190 @@
+import hardware
+from typing import Iterator
+
+''' Hardware diffs.
+When a source file is edited and synthesized again, most of the new hardware tree is the same as the old one, but
+the two trees share no objects and their ids and source tokens may all have shifted. diff(old, new) matches the
+two trees and reports what changed, so that a viewer can keep the layout of the unchanged parts and highlight the
+changed ones. It takes O(size of both trees):
+    1. Each Wire belongs to the scope of the lowest Component which contains both of its ends, as in getELK
+       (the scope of an input Node is its Component, and the scope of an output Node is the parent of its Component).
+    2. Each Component gets a structural hash, computed children first, from its class, its name, the labels of its
+       Nodes, the multiset of the hashes of its children and the multiset of the Wires in its scope, with each end of
+       a Wire described by the hash of the child it is on (or by self) and the side and label of its Node.
+       Ids and source tokens are ignored, so a subtree which did not change has the same hash in both trees.
+    3. The trees are matched top down. Components with the same hash are unchanged and are matched along with
+       their whole subtrees. Components with different hashes are matched if they have the same class and name
+       (children are paired by hash first, then by class and name in order of creation); the matched pair is
+       modified and its children are matched in turn. Components left over are removed (old) or added (new), along
+       with their subtrees.
+    4. The Wires in the scopes of the modified Components are compared through the matching of their end Nodes;
+       the Wires in the scopes of removed or added Components are removed or added.
+Two Components with different structure can have the same hash only when the Wires in a scope between identical
+children cannot be told apart by child hash; the hash, like the canonical form, does not distinguish such children.
+'''
+
+class HardwareDiff:
+    ''' The differences between two hardware trees, see the note above. matched maps each old Component which is
+    in the new tree to its new Component. modified lists the matched pairs whose subtrees changed, including the
+    ancestors of every change; the other matched Components are unchanged. '''
+    __slots__ = 'matched', 'modified', 'removed', 'added', 'removedWires', 'addedWires'
+    def __init__(self):
+        self.matched: 'dict[hardware.Component, hardware.Component]' = {}
+        self.modified: 'list[tuple[hardware.Component, hardware.Component]]' = []
+        self.removed: 'list[hardware.Component]' = []  # old Components, including the subtrees of removed Components
+        self.added: 'list[hardware.Component]' = []  # new Components, including the subtrees of added Components
+        self.removedWires: 'list[hardware.Wire]' = []
+        self.addedWires: 'list[hardware.Wire]' = []
+    def __repr__(self):
+        return f"HardwareDiff({len(self.modified)} modified, {len(self.removed)} removed, {len(self.added)} added, {len(self.removedWires)} wires removed, {len(self.addedWires)} wires added)"
+    def isEmpty(self) -> 'bool':
+        ''' Whether the two trees have the same structure. '''
+        return len(self.modified) == len(self.removed) == len(self.added) == len(self.removedWires) == len(self.addedWires) == 0
+    def unchanged(self) -> 'Iterator[tuple[hardware.Component, hardware.Component]]':
+        ''' The matched pairs whose subtrees did not change. '''
+        modified = {old for old, new in self.modified}
+        for old, new in self.matched.items():
+            if old not in modified:
+                yield old, new
+
+class StructuralHashes:
+    ''' The structural hash of each Component in the tree of root and the Wires in the scope of each Component. '''
+    __slots__ = 'root', 'components', 'hashes', 'scopeWires'
+    def __init__(self, root: 'hardware.Component'):
+        self.root: 'hardware.Component' = root
+        self.components: 'list[hardware.Component]' = [root]  # parents before children
+        depths: 'dict[hardware.Component, int]' = {root: 0}
+        for component in self.components:
+            for child in component._children:
+                depths[child] = depths[component] + 1
+                self.components.append(child)
+        self.scopeWires: 'dict[hardware.Component, list[hardware.Wire]]' = {component: [] for component in self.components}
+        for component in self.components:
+            for nodes in (component._inputs, component._outputs):
+                for node in nodes.values():
+                    for wire in node._outWires:
+                        scope = wireScope(wire, depths)
+                        if scope != None:
+                            self.scopeWires[scope].append(wire)
+        self.hashes: 'dict[hardware.Component, int]' = {}
+        for component in reversed(self.components):
+            self.hashes[component] = self.computeHash(component)
+    def computeHash(self, component: 'hardware.Component') -> 'int':
+        ''' The hash of component, given the hashes of its children. '''
+        wires = sorted((self.describeEnd(component, wire._src), self.describeEnd(component, wire._dst)) for wire in self.scopeWires[component])
+        return hardware.stableHash(repr((component.__class__.__name__, component._name, sorted(map(repr, component._inputs)), sorted(map(repr, component._outputs)),
+                                         sorted(self.hashes[child] for child in component._children), wires)))
+    def describeEnd(self, scope: 'hardware.Component', node: 'hardware.Node') -> 'tuple':
+        ''' Describes node, an end of a Wire in the scope of scope, without ids. '''
+        owner = node._parent
+        if owner is scope:
+            return (0, node._isInput, repr(node._label), ())
+        path = []  # the names of the Components between the child of scope and node, if node is deeper
+        while owner._parent is not scope:
+            path.append(owner._name)
+            owner = owner._parent
+        return (self.hashes[owner], node._isInput, repr(node._label), tuple(path))
+
+def wireScope(wire: 'hardware.Wire', depths: 'dict[hardware.Component, int]') -> 'hardware.Component|None':
+    ''' The lowest Component containing both ends of wire, or None if wire leaves the tree of depths. '''
+    src = wire._src._parent if wire._src._isInput else wire._src._parent._parent
+    dst = wire._dst._parent if not wire._dst._isInput else wire._dst._parent._parent
+    if src is dst:
+        return src
+    if src not in depths or dst not in depths:
+        return None
+    while depths[src] > depths[dst]:
+        src = src._parent
+    while depths[dst] > depths[src]:
+        dst = dst._parent
+    while src is not dst:
+        src, dst = src._parent, dst._parent
+    return src
+
+def diff(old: 'hardware.Component', new: 'hardware.Component') -> 'HardwareDiff':
+    ''' Matches the tree of old against the tree of new and returns the differences. See the note above. '''
+    oldHashes, newHashes = StructuralHashes(old), StructuralHashes(new)
+    result = HardwareDiff()
+    toMatch: 'list[tuple[hardware.Component, hardware.Component]]' = []
+    if sameKind(old, new):
+        toMatch.append((old, new))
+    else:
+        removeSubtree(result, oldHashes, old)
+        addSubtree(result, newHashes, new)
+    while len(toMatch) > 0:
+        oldComponent, newComponent = toMatch.pop()
+        result.matched[oldComponent] = newComponent
+        if oldHashes.hashes[oldComponent] == newHashes.hashes[newComponent]:
+            # unchanged, match the subtrees
+            for oldChild, newChild in pairChildren(oldComponent, newComponent, oldHashes, newHashes)[0]:
+                toMatch.append((oldChild, newChild))
+            continue
+        result.modified.append((oldComponent, newComponent))
+        same, similar, oldLeft, newLeft = pairChildren(oldComponent, newComponent, oldHashes, newHashes)
+        toMatch.extend(same)
+        toMatch.extend(similar)
+        for oldChild in oldLeft:
+            removeSubtree(result, oldHashes, oldChild)
+        for newChild in newLeft:
+            addSubtree(result, newHashes, newChild)
+    # compare the Wires of the modified scopes through the matched Nodes
+    for oldComponent, newComponent in result.modified:
+        newWires = {(wire._src, wire._dst): wire for wire in newHashes.scopeWires[newComponent]}
+        for wire in oldHashes.scopeWires[oldComponent]:
+            src, dst = matchNode(result, wire._src), matchNode(result, wire._dst)
+            if src == None or dst == None or newWires.pop((src, dst), None) == None:
+                result.removedWires.append(wire)
+        result.addedWires.extend(newWires.values())
+    return result
+
+def sameKind(old: 'hardware.Component', new: 'hardware.Component') -> 'bool':
+    ''' Whether old and new may be matched as versions of the same Component. '''
+    return old.__class__ == new.__class__ and old._name == new._name
+
+def pairChildren(old: 'hardware.Component', new: 'hardware.Component', oldHashes: 'StructuralHashes', newHashes: 'StructuralHashes') -> 'tuple[list, list, list, list]':
+    ''' Pairs the children of old and new. Returns the pairs with the same hash, the pairs of the same kind with
+    different hashes, and the unpaired old and new children. Ties are broken by order of creation. '''
+    byHash: 'dict[int, list[hardware.Component]]' = {}
+    for child in sorted(old._children, key=lambda child: child._id, reverse=True):
+        byHash.setdefault(oldHashes.hashes[child], []).append(child)
+    same, newLeft = [], []
+    for child in sorted(new._children, key=lambda child: child._id):
+        candidates = byHash.get(newHashes.hashes[child])
+        if candidates:
+            same.append((candidates.pop(), child))
+        else:
+            newLeft.append(child)
+    byKind: 'dict[tuple[type, str], list[hardware.Component]]' = {}
+    for child in sorted((child for candidates in byHash.values() for child in candidates), key=lambda child: child._id, reverse=True):
+        byKind.setdefault((child.__class__, child._name), []).append(child)
+    similar, added = [], []
+    for child in newLeft:
+        candidates = byKind.get((child.__class__, child._name))
+        if candidates:
+            similar.append((candidates.pop(), child))
+        else:
+            added.append(child)
+    return same, similar, [child for candidates in byKind.values() for child in candidates], added
+
+def matchNode(result: 'HardwareDiff', node: 'hardware.Node') -> 'hardware.Node|None':
+    ''' The Node of the new tree matching node of the old tree, if any. '''
+    component = result.matched.get(node._parent)
+    if component == None:
+        return None
+    return (component._inputs if node._isInput else component._outputs).get(node._label)
+
+def removeSubtree(result: 'HardwareDiff', hashes: 'StructuralHashes', component: 'hardware.Component'):
+    toVisit = [component]
+    while len(toVisit) > 0:
+        component = toVisit.pop()
+        result.removed.append(component)
+        result.removedWires.extend(hashes.scopeWires[component])
+        toVisit.extend(component._children)
+
+def addSubtree(result: 'HardwareDiff', hashes: 'StructuralHashes', component: 'hardware.Component'):
+    toVisit = [component]
+    while len(toVisit) > 0:
+        component = toVisit.pop()
+        result.added.append(component)
+        result.addedWires.extend(hashes.scopeWires[component])
+        toVisit.extend(component._children)
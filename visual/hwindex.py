@@ -0,0 +1,171 @@
+import hardware
+from typing import Any
+
+''' Hardware indexes.
+Tools which inspect a synthesized design (the viewer, the tests, analysis scripts) look for Components by name,
+class or source token, or for the Components with many Wires, and walking the whole component tree for each such
+query costs O(size of the design). A HardwareIndex is built in one pass over the tree and answers them in
+O(size of the result):
+    - named(name): the Components with a given name. The name of a Function is its op (eg '+', '~' or 'f'),
+      and the name of a Register is its type (eg 'Reg#(Bit#(4))').
+    - ofClass(componentClass): the Components of exactly that class, eg hardware.Mux; registers() is
+      ofClass(hardware.Register).
+    - sourcedFrom(filename, token) and wiresSourcedFrom(filename, token): the Components and Wires with the
+      given source token.
+    - withFanout(k), withFanin(k) and withFanoutAtLeast(k): the Components by the number of Wires leaving their
+      outputs or entering their inputs. Wires between a Component and its children are not counted.
+Each Component is stored under the keys it was indexed with (its entry), so it can be removed exactly even after
+it has changed. The index does not watch the hardware: code which edits an indexed design either goes through
+the editing methods of the index (addChild, removeChild, connect, disconnect), which edit the hardware and the
+index together, or calls add/remove/update itself after editing the hardware. Each edit costs O(number of ports)
+per Component it touches, so the index stays up to date without rebuilding it.
+'''
+
+class IndexEntry:
+    ''' The keys a Component is indexed under. '''
+    __slots__ = 'name', 'componentClass', 'tokens', 'fanin', 'fanout'
+    def __init__(self, component: 'hardware.Component'):
+        self.name: 'str' = component._name
+        self.componentClass: 'type' = component.__class__
+        self.tokens: 'list[tuple[str, int]]' = component.getSourceTokens()
+        self.fanin: 'int' = sum(len(node._inWires) for node in component._inputs.values())
+        self.fanout: 'int' = sum(len(node._outWires) for node in component._outputs.values())
+
+class HardwareIndex:
+    ''' An index of the Components and Wires in the tree of a Component. See the note above. '''
+    __slots__ = 'root', 'entries', 'byName', 'byClass', 'bySource', 'byFanin', 'byFanout', 'wireTokens', 'wiresBySource'
+    def __init__(self, root: 'hardware.Component'):
+        self.root: 'hardware.Component' = root
+        self.entries: 'dict[hardware.Component, IndexEntry]' = {}
+        self.byName: 'dict[str, set[hardware.Component]]' = {}
+        self.byClass: 'dict[type, set[hardware.Component]]' = {}
+        self.bySource: 'dict[tuple[str, int], set[hardware.Component]]' = {}
+        self.byFanin: 'dict[int, set[hardware.Component]]' = {}
+        self.byFanout: 'dict[int, set[hardware.Component]]' = {}
+        self.wireTokens: 'dict[hardware.Wire, list[tuple[str, int]]]' = {}  # the tokens each Wire is indexed under
+        self.wiresBySource: 'dict[tuple[str, int], set[hardware.Wire]]' = {}
+        self.add(root)
+    def __repr__(self):
+        return f"HardwareIndex({len(self.entries)} components, {len(self.wireTokens)} wires)"
+    def __contains__(self, component: 'hardware.Component') -> 'bool':
+        return component in self.entries
+    def __len__(self) -> 'int':
+        return len(self.entries)
+
+    def add(self, component: 'hardware.Component'):
+        ''' Indexes component, the Components in its subtree and the Wires leaving their Nodes. '''
+        toVisit = [component]
+        while len(toVisit) > 0:
+            component = toVisit.pop()
+            self.indexComponent(component)
+            for nodes in (component._inputs, component._outputs):
+                for node in nodes.values():
+                    for wire in node._outWires:
+                        self.indexWire(wire)
+            toVisit.extend(component._children)
+    def remove(self, component: 'hardware.Component'):
+        ''' Removes component, the Components in its subtree and the Wires leaving their Nodes from the index. '''
+        toVisit = [component]
+        while len(toVisit) > 0:
+            component = toVisit.pop()
+            self.unindexComponent(component)
+            for nodes in (component._inputs, component._outputs):
+                for node in nodes.values():
+                    for wire in node._outWires:
+                        self.unindexWire(wire)
+            toVisit.extend(component._children)
+    def update(self, component: 'hardware.Component'):
+        ''' Indexes component again, after its name, source tokens or Wires have changed. '''
+        self.unindexComponent(component)
+        self.indexComponent(component)
+
+    def addChild(self, parent: 'hardware.Component', child: 'hardware.Component'):
+        ''' Adds child (and its subtree) to the children of parent and to the index. '''
+        parent.addChild(child)
+        self.add(child)
+    def removeChild(self, parent: 'hardware.Component', child: 'hardware.Component'):
+        ''' Removes child (and its subtree) from the children of parent and from the index. '''
+        self.remove(child)
+        parent.removeChild(child)
+    def connect(self, src: 'hardware.Node', dst: 'hardware.Node') -> 'hardware.Wire':
+        ''' Creates a Wire from src to dst and indexes it. '''
+        wire = hardware.Wire(src, dst)
+        self.indexWire(wire)
+        self.updateEnds(wire)
+        return wire
+    def disconnect(self, wire: 'hardware.Wire'):
+        ''' Removes wire from the hardware and from the index. '''
+        self.unindexWire(wire)
+        hardware.removeWire(wire)
+        self.updateEnds(wire)
+    def updateEnds(self, wire: 'hardware.Wire'):
+        ''' Updates the degrees of the Components whose fanout or fanin includes wire. '''
+        if not wire._src._isInput and wire._src._parent in self.entries:
+            self.update(wire._src._parent)
+        if wire._dst._isInput and wire._dst._parent in self.entries:
+            self.update(wire._dst._parent)
+
+    def indexComponent(self, component: 'hardware.Component'):
+        assert component not in self.entries, f"{component.name} is already indexed"
+        entry = IndexEntry(component)
+        self.entries[component] = entry
+        self.byName.setdefault(entry.name, set()).add(component)
+        self.byClass.setdefault(entry.componentClass, set()).add(component)
+        for token in entry.tokens:
+            self.bySource.setdefault(token, set()).add(component)
+        self.byFanin.setdefault(entry.fanin, set()).add(component)
+        self.byFanout.setdefault(entry.fanout, set()).add(component)
+    def unindexComponent(self, component: 'hardware.Component'):
+        entry = self.entries.pop(component)
+        discard(self.byName, entry.name, component)
+        discard(self.byClass, entry.componentClass, component)
+        for token in entry.tokens:
+            discard(self.bySource, token, component)
+        discard(self.byFanin, entry.fanin, component)
+        discard(self.byFanout, entry.fanout, component)
+    def indexWire(self, wire: 'hardware.Wire'):
+        tokens = wire.getSourceTokens()
+        self.wireTokens[wire] = tokens
+        for token in tokens:
+            self.wiresBySource.setdefault(token, set()).add(wire)
+    def unindexWire(self, wire: 'hardware.Wire'):
+        for token in self.wireTokens.pop(wire):
+            discard(self.wiresBySource, token, wire)
+
+    def named(self, name: 'str') -> 'set[hardware.Component]':
+        ''' The Components with the given name (for a Function, its op). '''
+        return self.byName.get(name, set()).copy()
+    def ofClass(self, componentClass: 'type') -> 'set[hardware.Component]':
+        ''' The Components whose class is exactly componentClass. '''
+        return self.byClass.get(componentClass, set()).copy()
+    def registers(self) -> 'set[hardware.Register]':
+        ''' The Registers in the index. '''
+        return self.ofClass(hardware.Register)
+    def sourcedFrom(self, filename: 'str', token: 'int') -> 'set[hardware.Component]':
+        ''' The Components with the given source token. '''
+        return self.bySource.get((filename, token), set()).copy()
+    def wiresSourcedFrom(self, filename: 'str', token: 'int') -> 'set[hardware.Wire]':
+        ''' The Wires with the given source token. '''
+        return self.wiresBySource.get((filename, token), set()).copy()
+    def withFanout(self, fanout: 'int') -> 'set[hardware.Component]':
+        ''' The Components with exactly fanout Wires leaving their outputs. '''
+        return self.byFanout.get(fanout, set()).copy()
+    def withFanin(self, fanin: 'int') -> 'set[hardware.Component]':
+        ''' The Components with exactly fanin Wires entering their inputs. '''
+        return self.byFanin.get(fanin, set()).copy()
+    def withFanoutAtLeast(self, fanout: 'int') -> 'set[hardware.Component]':
+        ''' The Components with at least fanout Wires leaving their outputs. Takes O(number of distinct fanouts)
+        on top of the size of the result. '''
+        return set().union(*(components for degree, components in self.byFanout.items() if degree >= fanout))
+    def fanout(self, component: 'hardware.Component') -> 'int':
+        return self.entries[component].fanout
+    def fanin(self, component: 'hardware.Component') -> 'int':
+        return self.entries[component].fanin
+
+def discard(table: 'dict[Any, set]', key: 'Any', item: 'Any'):
+    ''' Removes item from the set table[key], and removes the set once it is empty so that
+    the tables do not collect empty sets. '''
+    items = table[key]
+    items.discard(item)
+    if len(items) == 0:
+        del table[key]
@@ -0,0 +1,212 @@
+import bisect
+import pathlib
+import re
+from typing import Any
+
+''' Liberty libraries.
+The synthesis flow in ../synth maps designs onto the standard cells of a Liberty (.lib) library: basic.lib has
+INV, BUF, NAND2, NOR2 and a DFF, and extended.lib adds AND, OR, NAND and NOR gates of up to four inputs and XOR2 and
+XNOR2. This module reads those libraries so that the estimators in timing.py and area.py use the same cells as the
+real flow.
+A Liberty file is a tree of groups, `name (args) { ... }`, which contain simple attributes, `name : value ;`,
+complex attributes, `name (args) ;`, and more groups. parse returns the tree as Groups, and Library picks out what
+the estimators need:
+    - the area of each cell,
+    - the capacitance of each input pin,
+    - the delay and output transition of each timing arc, as tables indexed by input transition and output load,
+    - the setup constraint of each sequential cell.
+Tables are interpolated (and extrapolated past their last index) bilinearly, as static timing tools do. Times are
+in the time_unit of the library (1ns for the bundled libraries) and capacitances in its capacitive_load_unit (1fF).
+'''
+
+class Group:
+    ''' A group of a Liberty file, eg `cell (INV) { ... }`. '''
+    __slots__ = 'kind', 'args', 'attributes', 'groups'
+    def __init__(self, kind: 'str', args: 'list[str]'):
+        self.kind: 'str' = kind
+        self.args: 'list[str]' = args
+        self.attributes: 'dict[str, Any]' = {}  # a str for a simple attribute, a list of args for a complex one
+        self.groups: 'list[Group]' = []
+    def __repr__(self):
+        return f"Group({self.kind}({', '.join(self.args)}), {len(self.attributes)} attributes, {len(self.groups)} groups)"
+    def get(self, kind: 'str') -> 'list[Group]':
+        ''' The groups of the given kind directly in self. '''
+        return [group for group in self.groups if group.kind == kind]
+
+tokenPattern = re.compile(r'"(?:[^"\\]|\\.)*"|[(){}:;,]|[^\s(){}:;,"]+')
+
+def parse(text: 'str') -> 'Group':
+    ''' Parses the text of a Liberty file and returns its outermost group (the library). '''
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.DOTALL).replace('\\\n', ' ')
+    tokens = tokenPattern.findall(text)
+    root = Group('', [])
+    stack = [root]
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token == '}':
+            stack.pop()
+            i += 1
+            continue
+        if token == ';':
+            i += 1
+            continue
+        name, next = token, tokens[i+1]
+        if next == ':':
+            # simple attribute, up to the end of the statement
+            end = i + 2
+            while end < len(tokens) and tokens[end] not in (';', '}'):
+                end += 1
+            stack[-1].attributes[name] = unquote(' '.join(tokens[i+2:end]))
+            i = end
+        elif next == '(':
+            end = tokens.index(')', i)
+            args = [unquote(arg) for arg in tokens[i+2:end] if arg != ',']
+            if end + 1 < len(tokens) and tokens[end+1] == '{':
+                group = Group(name, args)
+                stack[-1].groups.append(group)
+                stack.append(group)
+                i = end + 2
+            else:
+                stack[-1].attributes[name] = args
+                i = end + 1
+        else:
+            raise Exception(f"Unexpected token {name} {next} in Liberty file")
+    assert len(stack) == 1, "Unbalanced braces in Liberty file"
+    libraries = root.get('library')
+    assert len(libraries) == 1, f"Expected one library, found {len(libraries)}"
+    return libraries[0]
+
+def unquote(token: 'str') -> 'str':
+    if token.startswith('"'):
+        return token[1:-1]
+    return token
+
+class Table:
+    ''' A lookup table of a timing arc, with one or two indices. '''
+    __slots__ = 'variables', 'index1', 'index2', 'values'
+    def __init__(self, group: 'Group', templates: 'dict[str, Group]'):
+        template = templates.get(group.args[0]) if len(group.args) > 0 else None
+        variables = template.attributes if template != None else {}
+        self.variables: 'tuple[str, str]' = (variables.get('variable_1', ''), variables.get('variable_2', ''))
+        self.index1: 'list[float]' = numbers(group.attributes.get('index_1', template.attributes.get('index_1', ['0']) if template != None else ['0']))
+        self.index2: 'list[float]' = numbers(group.attributes.get('index_2', template.attributes.get('index_2', ['0']) if template != None else ['0']))
+        rows = group.attributes['values']
+        self.values: 'list[list[float]]' = [numbers([row]) for row in rows]
+        if len(self.values) == 1 and len(self.index1) > 1:
+            # a table with one index has a single row
+            self.values = [[value] for value in self.values[0]]
+    def lookup(self, values: 'dict[str, float]') -> 'float':
+        ''' The value of the table at the given values of its variables, eg input_net_transition and
+        total_output_net_capacitance. '''
+        return interpolate(self.index1, self.index2, self.values, values.get(self.variables[0], 0.0), values.get(self.variables[1], 0.0))
+
+def numbers(args: 'list[str]') -> 'list[float]':
+    ''' The numbers in the comma separated strings args. '''
+    return [float(value) for arg in args for value in arg.split(',') if value.strip() != '']
+
+def interpolate(index1: 'list[float]', index2: 'list[float]', values: 'list[list[float]]', x: 'float', y: 'float') -> 'float':
+    ''' Bilinear interpolation of values at (x, y), extrapolating linearly outside the indices. '''
+    i, tx = bracket(index1, x)
+    j, ty = bracket(index2, y)
+    i2, j2 = min(i + 1, len(index1) - 1), min(j + 1, len(index2) - 1)
+    low = values[i][j] + (values[i][j2] - values[i][j]) * ty
+    high = values[i2][j] + (values[i2][j2] - values[i2][j]) * ty
+    return low + (high - low) * tx
+
+def bracket(index: 'list[float]', x: 'float') -> 'tuple[int, float]':
+    ''' The position i of the segment of index containing x and the fraction of the way through it. '''
+    if len(index) == 1:
+        return 0, 0.0
+    i = min(max(bisect.bisect_right(index, x) - 1, 0), len(index) - 2)
+    return i, (x - index[i]) / (index[i+1] - index[i])
+
+class Arc:
+    ''' A timing arc from a related pin to an output pin, or a constraint on an input pin. '''
+    __slots__ = 'relatedPin', 'timingType', 'tables'
+    def __init__(self, group: 'Group', templates: 'dict[str, Group]'):
+        self.relatedPin: 'str' = group.attributes.get('related_pin', '')
+        self.timingType: 'str' = group.attributes.get('timing_type', 'combinational')
+        self.tables: 'dict[str, Table]' = {table.kind: Table(table, templates) for table in group.groups if table.kind in tableKinds}
+    def delay(self, transition: 'float', load: 'float') -> 'float':
+        ''' The worse of the rising and falling delays. '''
+        values = {'input_net_transition': transition, 'total_output_net_capacitance': load}
+        return max(self.tables[kind].lookup(values) for kind in ('cell_rise', 'cell_fall') if kind in self.tables)
+    def transition(self, transition: 'float', load: 'float') -> 'float':
+        ''' The worse of the rising and falling output transitions. '''
+        values = {'input_net_transition': transition, 'total_output_net_capacitance': load}
+        return max(self.tables[kind].lookup(values) for kind in ('rise_transition', 'fall_transition') if kind in self.tables)
+    def constraint(self, transition: 'float', relatedTransition: 'float') -> 'float':
+        ''' The worse of the rising and falling constraints. '''
+        values = {'constrained_pin_transition': transition, 'related_pin_transition': relatedTransition}
+        return max(self.tables[kind].lookup(values) for kind in ('rise_constraint', 'fall_constraint') if kind in self.tables)
+
+tableKinds = {'cell_rise', 'cell_fall', 'rise_transition', 'fall_transition', 'rise_constraint', 'fall_constraint'}
+
+class Pin:
+    __slots__ = 'name', 'direction', 'capacitance', 'function', 'arcs'
+    def __init__(self, group: 'Group', templates: 'dict[str, Group]'):
+        self.name: 'str' = group.args[0]
+        self.direction: 'str' = group.attributes.get('direction', '')
+        self.capacitance: 'float' = float(group.attributes.get('capacitance', 0))
+        self.function: 'str|None' = group.attributes.get('function')
+        self.arcs: 'list[Arc]' = [Arc(timing, templates) for timing in group.get('timing')]
+
+class Cell:
+    __slots__ = 'name', 'area', 'pins', 'sequential'
+    def __init__(self, group: 'Group', templates: 'dict[str, Group]'):
+        self.name: 'str' = group.args[0]
+        self.area: 'float' = float(group.attributes.get('area', 0))
+        self.pins: 'dict[str, Pin]' = {pin.name: pin for pin in (Pin(pinGroup, templates) for pinGroup in group.get('pin'))}
+        self.sequential: 'bool' = len(group.get('ff')) > 0 or len(group.get('latch')) > 0
+    def __repr__(self):
+        return f"Cell({self.name}, area {self.area})"
+    def inputs(self) -> 'list[Pin]':
+        return [pin for pin in self.pins.values() if pin.direction == 'input']
+    def outputs(self) -> 'list[Pin]':
+        return [pin for pin in self.pins.values() if pin.direction == 'output']
+    def inputCapacitance(self) -> 'float':
+        ''' The largest capacitance of an input pin of the cell (other than a clock). '''
+        return max((pin.capacitance for pin in self.inputs() if not any(arc.timingType == 'min_pulse_width' for arc in pin.arcs)), default=0.0)
+    def delayArcs(self) -> 'list[Arc]':
+        ''' The arcs from an input to an output of the cell. '''
+        return [arc for pin in self.outputs() for arc in pin.arcs if 'cell_rise' in arc.tables or 'cell_fall' in arc.tables]
+    def delay(self, transition: 'float', load: 'float') -> 'float':
+        ''' The delay of the slowest arc of the cell, driving load with inputs of the given transition. '''
+        return max((arc.delay(transition, load) for arc in self.delayArcs()), default=0.0)
+    def transition(self, transition: 'float', load: 'float') -> 'float':
+        ''' The output transition of the slowest arc of the cell. '''
+        return max((arc.transition(transition, load) for arc in self.delayArcs()), default=transition)
+    def setup(self, transition: 'float', clockTransition: 'float') -> 'float':
+        ''' The largest setup time of an input of a sequential cell. '''
+        return max((arc.constraint(transition, clockTransition) for pin in self.inputs() for arc in pin.arcs if arc.timingType.startswith('setup')), default=0.0)
+
+class Library:
+    ''' The cells of a Liberty library, see the note above. '''
+    __slots__ = 'name', 'cells', 'timeUnit'
+    def __init__(self, text: 'str'):
+        library = parse(text)
+        templates = {template.args[0]: template for template in library.get('lu_table_template')}
+        self.name: 'str' = library.args[0] if len(library.args) > 0 else ''
+        self.cells: 'dict[str, Cell]' = {cell.name: cell for cell in (Cell(group, templates) for group in library.get('cell'))}
+        self.timeUnit: 'float' = timeUnits[library.attributes.get('time_unit', '1ns')]
+    def __repr__(self):
+        return f"Library({self.name}, {len(self.cells)} cells)"
+    def __contains__(self, name: 'str') -> 'bool':
+        return name in self.cells
+    def __getitem__(self, name: 'str') -> 'Cell':
+        return self.cells[name]
+    def area(self, name: 'str') -> 'float':
+        return self.cells[name].area
+
+timeUnits = {'1ps': 1e-12, '10ps': 1e-11, '100ps': 1e-10, '1ns': 1e-9}
+
+libraries: 'dict[str, Library]' = {}  # the bundled libraries which have been loaded, by name
+
+def bundledLibrary(name: 'str' = 'basic') -> 'Library':
+    ''' The library ../synth/<name>.lib used by the synthesis flow, eg 'basic' or 'extended'. Each library is
+    parsed once. '''
+    if name not in libraries:
+        path = pathlib.Path(__file__).resolve().parent.parent.joinpath('synth', name + '.lib')
+        libraries[name] = Library(path.read_text())
+    return libraries[name]
@@ -2,6 +2,11 @@
 import hardware
 import build
 import math # for math.inf in .numLiterals()
+import weakref
+try:
+    import numpy  # optional, used to fold operations on vectors of bits in bulk
+except ImportError:
+    numpy = None
 
 # A minispec type is a python classes; instances thereof represent literal values.
 
@@ -31,6 +36,40 @@ Typedef synonyms. Every minispec class maintains an "untypedef" class method whi
         typedef Word Bit#(32)
     then Word.untypedef() will return the Bit#(32) type class.
 
+Bit layouts. Every minispec type with a packed representation can compute its layout: bitLayout() is the
+    list of (field name, offset, width) of the leaf fields of the type, least significant first, and
+    packedWidth() is the total width. The layouts follow bsc's conventions, so they agree with the layouts
+    ../synth/minispeclayout.py reads from the bsc-generated BSV:
+        - Bool is 1 bit and Bit#(n) is n bits. Integer and module types have no packed representation.
+        - An enum takes enough bits for its largest tag (tags are 0, 1, 2, ... unless given explicitly).
+        - The first member of a struct takes the most significant bits.
+        - In a Maybe#(t), the value takes the low bits and the valid bit is the most significant bit.
+        - In a Vector#(k, t), element i takes bits [i*n+n-1:i*n], where n is the width of t.
+    Nested fields are named by their path, eg "a.value._2" for element 2 of the Maybe field a of a struct.
+    Layouts are cached per type.
+
+Four-state literals. A Bit#(n) literal may have unknown (don't-care) bits, given by the bitmask unknown, so
+    each bit is 0, 1 or x. The don't-care value ? becomes a Bit#(n) literal with every bit unknown when it meets
+    a Bit#(n) operand, and operations track the unknown bits precisely:
+        - bitwise operations are computed bit by bit, eg 0 & x is 0 and 1 | x is 1,
+        - in a sum, difference or product, the bits from the lowest unknown bit of the operands up are unknown,
+        - shifts and slices by known amounts move the unknown bits with the value,
+        - comparisons are decided whenever the known bits decide them (eg 4'b1xxx > 4'b0111), otherwise
+          they give ?, as do operations on ? and a value with no bits (eg an Integer).
+    Since ? may take any value, a mux whose inputs are literals agreeing on their known bits is just the
+    merged literal (see mergeLiterals), which lets default arms and partially-initialized values fold away.
+
+Interning. The factory functions (Bit, Vector, Maybe, Enum, Struct, Synonym) hash-cons the types they
+    create: calling a factory twice with the same arguments (compared by identity for type arguments)
+    returns the same class. So Bit(IntegerLiteral(4)) is Bit(IntegerLiteral(4)), and comparing or hashing
+    such types is an identity check in the common case. Types which are equal but not identical
+    (eg Word and Bit#(32), or Vector#(2, Word) and Vector#(2, Bit#(32))) are still equal under MType.__eq__
+    and have equal hashes, so synonyms keep their own names for display.
+    The table of interned types only holds weak references, so a type is dropped once no design, literal or
+    other type uses it and the table does not grow with every design synthesized in a process. Keys which hold
+    the id of a type argument stay valid: an interned type keeps its arguments alive, so their ids are not reused
+    while its entry exists. A factory called again after its type was dropped creates an equal new type.
+
 '''
 
 
@@ -71,11 +110,13 @@ def numericalBinaryOperation(left: 'MLiteral', right: 'MLiteral', op: 'str') ->
     assert leftVal.__class__ == int, f"Expected int, not {leftVal.__class__}"
     assert rightVal.__class__ == int, f"Expected int, not {leftVal.__class__}"
     if left.isBitLiteral() and right.isBitLiteral():
-        assert left.n == right.n, f"Bit literals must have same width to operate, found widths {left.n} and {right.n}"
+        assert left.width == right.width, f"Bit literals must have same width to operate, found widths {left.width} and {right.width}"
+    if (left.isBitLiteral() and left.unknown) or (right.isBitLiteral() and right.unknown):
+        return fourStateBinaryOperation(left, right, op)
     if left.isBitLiteral():
-        n = left.n
+        resultClass = left.__class__
     if right.isBitLiteral():
-        n = right.n
+        resultClass = right.__class__
     value = None
     if op == '**':
         value = leftVal ** rightVal
@@ -110,17 +151,94 @@ def numericalBinaryOperation(left: 'MLiteral', right: 'MLiteral', op: 'str') ->
     elif op == '^':
         value = leftVal ^ rightVal
     elif op == '^~' or op == '~^':
-        raise Exception("Not implemented")
+        value = ~(leftVal ^ rightVal)
     elif op == '|':
         value = leftVal | rightVal
     else:
         raise Exception(f"Unrecognized binary operation {op}")
     
     if left.isBitLiteral() or right.isBitLiteral():
-        return Bit(n)(value % (2**n.value))
+        return resultClass(value)  # the bit literal constructor reduces value mod 2**n
     return Integer(value)
 
+def carriedUnknowns(unknown: 'int', mask: 'int') -> 'int':
+    ''' Returns the bits of the result of an addition, subtraction or multiplication (masked by mask) which are
+    unknown when the bits unknown of the operands are unknown: the lowest unknown bit and every bit above it,
+    since each bit of the result depends only on the bits of the operands at or below it. '''
+    if unknown == 0:
+        return 0
+    return mask & ~((unknown & -unknown) - 1)
+
+def fourStateBinaryOperation(left: 'MLiteral', right: 'MLiteral', op: 'str') -> 'MLiteral':
+    ''' numericalBinaryOperation when some bits of left or right are unknown. See the notes on four-state literals. '''
+    if op == '<<' or op == '>>':
+        if right.isBitLiteral() and right.unknown:
+            return left.dontCare() if left.isBitLiteral() else DontCareLiteral()  # the shift amount is unknown
+        if not left.isBitLiteral():
+            return DontCareLiteral()
+        if op == '<<':
+            return left.__class__(left.value << right.value, left.unknown << right.value)
+        return left.__class__(left.value >> right.value, left.unknown >> right.value)
+    resultClass = left.__class__ if left.isBitLiteral() else right.__class__
+    mask = resultClass.mask
+    leftVal, leftUnknown = left.value & mask, left.unknown if left.isBitLiteral() else 0
+    rightVal, rightUnknown = right.value & mask, right.unknown if right.isBitLiteral() else 0
+    unknown = leftUnknown | rightUnknown
+    if op == '&':
+        knownZeros = (mask & ~(leftVal | leftUnknown)) | (mask & ~(rightVal | rightUnknown))
+        return resultClass(leftVal & rightVal, unknown & ~knownZeros)
+    if op == '|':
+        return resultClass(leftVal | rightVal, unknown & ~(leftVal | rightVal))  # known ones are the ones of the values
+    if op == '^':
+        return resultClass(leftVal ^ rightVal, unknown)
+    if op == '^~' or op == '~^':
+        return resultClass(~(leftVal ^ rightVal), unknown)
+    if op == '+':
+        return resultClass(leftVal + rightVal, carriedUnknowns(unknown, mask))
+    if op == '-':
+        return resultClass(leftVal - rightVal, carriedUnknowns(unknown, mask))
+    if op == '*':
+        return resultClass(leftVal * rightVal, carriedUnknowns(unknown, mask))
+    if op == '/' or op == '%' or op == '**':
+        return resultClass.dontCare()
+    # comparisons are decided when the ranges of possible values of the operands do not overlap
+    leftMax, rightMax = leftVal | leftUnknown, rightVal | rightUnknown
+    if op == '==' or op == '!=':
+        if (leftVal ^ rightVal) & ~unknown:
+            return Bool(op == '!=')  # the known bits differ
+        return DontCareLiteral()
+    if op == '<' or op == '>=':
+        if leftMax < rightVal:
+            return Bool(op == '<')
+        if leftVal >= rightMax:
+            return Bool(op == '>=')
+        return DontCareLiteral()
+    if op == '>' or op == '<=':
+        if leftVal > rightMax:
+            return Bool(op == '>')
+        if leftMax <= rightVal:
+            return Bool(op == '<=')
+        return DontCareLiteral()
+    raise Exception(f"Unrecognized binary operation {op}")
+
+def dontCareBinaryOperation(left: 'MLiteral', right: 'MLiteral', op: 'str') -> 'MLiteral':
+    ''' binaryOperation when left or right is a DontCareLiteral. See the notes on four-state literals. '''
+    if op in boolean_binary:
+        other = right if left.__class__ == DontCareLiteral else left
+        if other.__class__ == Bool and other.value == (op == '||'):
+            return Bool(op == '||')  # False && ? is False and True || ? is True
+        return DontCareLiteral()
+    if left.__class__ == DontCareLiteral and right.isBitLiteral() and op not in ('<<', '>>'):
+        left = right.dontCare()
+    if right.__class__ == DontCareLiteral and left.isBitLiteral():
+        right = left.dontCare()
+    if left.__class__ == DontCareLiteral or right.__class__ == DontCareLiteral:
+        return DontCareLiteral()  # eg an Integer or a struct, which have no known bits
+    return numericalBinaryOperation(left, right, op)
+
 def equalityBinaryOperation(left: 'MLiteral', right: 'MLiteral', op: 'str') -> 'Bool':
+    if left.__class__ == DontCareLiteral or right.__class__ == DontCareLiteral:
+        return dontCareBinaryOperation(left, right, op)
     if (left.__class__ == Integer or left.isBitLiteral()) and (right.__class__ == Integer or right.isBitLiteral()):
         # perform type coercions for integer/bit values
         return numericalBinaryOperation(left, right, op)
@@ -128,7 +246,7 @@ def equalityBinaryOperation(left: 'MLiteral', right: 'MLiteral', op: 'str') -> '
         assert left.__class__ == right.__class__, f"Can only compare values of the same type, found {left.__class__} and {right.__class__}"
         return left.eq(right)
     if op == '!=':
-        return Bool(not equalityBinaryOperation(left, right, '==').value)
+        return equalityBinaryOperation(left, right, '==').booleaninv()
     raise Exception(f"Unrecognized binary operation {op}")
 
 def booleanBinaryOperation(left: 'Bool', right: 'Bool', op: 'str') -> 'Bool':
@@ -145,7 +263,9 @@ def binaryOperation(left: 'MLiteral', right: 'MLiteral', op: 'str') -> 'MLiteral
     For typechecking specs, see, page ~170, "Type Classes for Bit" etc.
         http://csg.csail.mit.edu/6.375/6_375_2019_www/resources/bsv-reference-guide.pdf '''
     if left.__class__ == DontCareLiteral or right.__class__ == DontCareLiteral:
-        raise Exception("Arithmetic with don't care literals is not implemented due to entanglement")
+        return dontCareBinaryOperation(left, right, op)
+    if isVectorLiteral(left) and isVectorLiteral(right) and op not in equality_binary:
+        return left.operateLanes(right, op)
     if op in boolean_binary:
         return booleanBinaryOperation(left, right, op)
     if op in arithmetic_binary or op in relational_binary or op in logical_binary:
@@ -160,21 +280,21 @@ def unaryOperation(value: 'MLiteral', op: 'str') -> 'MLiteral':
     if op == '~':
         return value.inv()
     if op == '&':
-        return value.redand(),
+        return value.redand()
     if op == '~&':
-        return value.redand().inv(),
+        return value.redand().inv()
     if op == '|':
-        return value.redor(),
+        return value.redor()
     if op == '~|':
-        return value.redor().inv(),
+        return value.redor().inv()
     if op == '^':
-        return value.redxor(),
+        return value.redxor()
     if op == '^~':
-        return value.redxor().inv(),
+        return value.redxor().inv()
     if op == '~^':
-        return value.redxor().inv(),
+        return value.redxor().inv()
     if op == '+':
-        return value.unaryadd(),
+        return value.unaryadd()
     if op == '-':
         return value.neg()
 
@@ -208,6 +328,8 @@ class MType(type):
     def __eq__(self, other):
         ''' Handles equality of minispec types. Returns true if self and other are the same minispec type.
         Typedefs of the same type compare to true. '''
+        if self is other:  # interned types are usually identical
+            return True
         if other.__class__ != MType:
             return False
         self = self.untypedef()
@@ -217,6 +339,31 @@ class MType(type):
         if self._constructor != other._constructor:  # look at the factory function
             return False
         return self.sameType(other) # remove typedef synonyms before comparing
+    def __hash__(self):
+        ''' Types which are __eq__ have the same hash. A type created in a factory stores the hash
+        of its (untypedef-ed) structure in _hash; other types hash by identity. '''
+        self = self.untypedef()
+        if self._constructor == None:
+            return type.__hash__(self)
+        return self._hash
+
+_bitLayouts: 'weakref.WeakKeyDictionary[MType, list[tuple[str, int, int]]|None]' = weakref.WeakKeyDictionary()
+
+def nestFields(name: 'str', fields: 'list[tuple[str, int]]|None') -> 'list[tuple[str, int]]|None':
+    ''' Prefixes the names of the leaf fields of a member with the name of the member. '''
+    if fields == None:
+        return None
+    return [(name + "." + fieldName if fieldName != "" else name, width) for fieldName, width in fields]
+
+_internedTypes: 'weakref.WeakValueDictionary[tuple, MType]' = weakref.WeakValueDictionary()  # see the note on interning
+def getInterned(key: 'tuple') -> 'MType|None':
+    ''' Returns the type previously created by a factory with the given key, or None. '''
+    return _internedTypes.get(key)
+
+def intern(key: 'tuple', mtype: 'MType') -> 'MType':
+    ''' Records mtype as the type for the given key and returns it. If another thread interned a type
+    with the same key first, returns that type instead so that there is only ever one. '''
+    return _internedTypes.setdefault(key, mtype)
 
 def isMLiteral(value):
     '''Returns whether or not value is an MLiteral'''
@@ -245,6 +392,52 @@ class MLiteral(metaclass=MType):
     def sameType(self, other):
         ''' Returns true if self and other are the same minispec type. Assumes self and other were created in the same type factory. '''
         raise Exception(f"Not implemented, class {repr(self.__class__)} was not created in a type factory.")
+    @classmethod
+    def bitLayout(cls) -> 'list[tuple[str, int, int]]|None':
+        ''' Returns the packed layout of the type as a list of (field name, offset, width), least significant
+        field first, or None if the type has no packed representation. See the notes on bit layouts. '''
+        mtype = cls.untypedef()
+        if mtype not in _bitLayouts:
+            fields = mtype.leafFields()
+            if fields == None:
+                _bitLayouts[mtype] = None
+            else:
+                layout = []
+                offset = 0
+                for fieldName, width in fields:
+                    layout.append((fieldName, offset, width))
+                    offset += width
+                _bitLayouts[mtype] = layout
+        return _bitLayouts[mtype]
+    @classmethod
+    def packedWidth(cls) -> 'int|None':
+        ''' Returns the number of bits in the packed representation of the type, or None if there is none. '''
+        layout = cls.bitLayout()
+        if layout == None:
+            return None
+        if len(layout) == 0:
+            return 0
+        fieldName, offset, width = layout[-1]
+        return offset + width
+    @classmethod
+    def fieldOfBit(cls, index: 'int') -> 'str|None':
+        ''' Returns the name of bit index of the packed representation, eg "a.valid" or "b[3]", or None
+        if the type has no packed representation or index is out of range. '''
+        layout = cls.bitLayout()
+        if layout == None:
+            return None
+        for fieldName, offset, width in layout:
+            if offset <= index < offset + width:
+                if width == 1:
+                    return fieldName
+                return f"{fieldName}[{index - offset}]"
+        return None
+    @classmethod
+    def leafFields(cls) -> 'list[tuple[str, int]]|None':
+        ''' Returns the (name, width) of each leaf field of the (untypedef-ed) type, least significant first,
+        or None if the type has no packed representation. Types override this to define their layout;
+        use bitLayout, which caches the result. '''
+        return None
     def getHardware(self, globalsHandler, sourceTokens: 'list[list[tuple[str, int]]]') -> 'hardware.Node':
         assert globalsHandler.isGlobalsHandler(), "Quick type check"
         constantFunc = hardware.Constant(self)
@@ -291,6 +484,10 @@ class MLiteral(metaclass=MType):
 def Synonym(mtype: 'MType', newName: 'str'):
     ''' Returns a class which is a synonym of the given class, with the appropriate name.
     Used for typedef synonyms. '''
+    key = (Synonym, id(mtype), newName)  # the created class keeps mtype alive, so its id is not reused
+    interned = getInterned(key)
+    if interned is not None:
+        return interned
     class TypeDef(mtype):
         _name = newName
         _constructor = Synonym
@@ -300,16 +497,34 @@ def Synonym(mtype: 'MType', newName: 'str'):
         @classmethod
         def sameType(self, other):
             raise Exception("Typedef synonyms should be extracted before calling this method.")
-    return TypeDef
+    return intern(key, TypeDef)
 
-def Enum(name: 'str', values: 'set[str]'):
-    ''' Returns a class which represents an enum type. '''
+def Enum(name: 'str', values: 'list[str]|set[str]', tagValues: 'dict[str, int]|None' = None):
+    ''' Returns a class which represents an enum type. values are the tags of the enum, in declaration order
+    (a set is put in sorted order). tagValues maps tags which were given an explicit encoding to their encoding;
+    as in bsc, any other tag is encoded as one more than the previous tag, starting from 0. '''
+    if values.__class__ == set or values.__class__ == frozenset:
+        values = sorted(values)
+    if tagValues == None:
+        tagValues = {}
+    encoding: 'dict[str, int]' = {}
+    currentValue = -1
+    for tag in values:
+        currentValue = tagValues[tag] if tag in tagValues else currentValue + 1
+        encoding[tag] = currentValue
+    key = (Enum, name, tuple(encoding.items()))
+    interned = getInterned(key)
+    if interned is not None:
+        return interned
+    values = set(values)
     class EnumType(MLiteral):
         ''' value is the tag of the enum instance to create. Must be one of the types in the enum.
         The only operations which are defined for enum literals are eq/neq #TODO check this '''
         _name = name
         _constructor = Enum
         _values = values
+        _encoding = encoding
+        _hash = hash((Enum, frozenset(values)))
         def __init__(self, value: 'str'):
             ''' Create an enum literal '''
             assert value in values, f"Enum type may only take on the specified values {values}, not the given value {value}"
@@ -328,21 +543,30 @@ def Enum(name: 'str', values: 'set[str]'):
         @classmethod
         def sameType(self, other):
             return self._values == other._values
+        @classmethod
+        def leafFields(cls):
+            return [("", max(encoding.values(), default=0).bit_length())]
         def eq(self, other):
             assert self.__class__ == other.__class__, f"Can only compare values of the same type, found {self.__class__} and {other.__class__}"
             return Bool(self.value == other.value)
         def __str__(self):
             return self.value
-    return EnumType
+    return intern(key, EnumType)
 
 def Struct(name: 'str', fields: 'dict[str, MType]'):
     ''' Returns a class which represents a struct type.
     fields is a dict[str:MType] mapping a field name to the type the field should have. '''
+    key = (Struct, name, tuple((field, id(fields[field])) for field in fields))  # field types are kept alive by _fields
+    interned = getInterned(key)
+    if interned is not None:
+        return interned
+    fields = fields.copy()
     class StructType(MLiteral):
         ''' The only operations which are defined for struct literals are eq/neq #TODO check this '''
         _name = name
         _constructor = Struct
         _fields = fields
+        _hash = hash((Struct, frozenset(fields)))  # field types are left out so that hashing does not recurse
         def __init__(self, fieldBinds: 'dict[str, MLiteral]'):
             assert set(fieldBinds) == set(fields), f"Must specify fields {set(fields)} but instead specified fields {set(fieldBinds)}"
             for field in fieldBinds:
@@ -358,6 +582,15 @@ def Struct(name: 'str', fields: 'dict[str, MType]'):
             fieldTypeList = [ fields[field] for field in fields ]
             return math.prod([ fieldType.numLiteral() for fieldType in fieldTypeList ])
         @classmethod
+        def leafFields(cls):
+            layout = []
+            for field in reversed(fields):  # the first member takes the most significant bits
+                fieldLayout = nestFields(field, fields[field].untypedef().leafFields())
+                if fieldLayout == None:
+                    return None
+                layout += fieldLayout
+            return layout
+        @classmethod
         def sameType(self, other):
             if set(self._fields) != set(other._fields):
                 return False
@@ -375,13 +608,17 @@ def Struct(name: 'str', fields: 'dict[str, MType]'):
             return all( self.fieldBinds[field] == other.fieldBinds[field] for field in self.fieldBinds )
         def eq(self, other):
             assert self.__class__ == other.__class__, f"Can only compare values of the same type, found {self.__class__} and {other.__class__}"
+            result = Bool(True)
             for field in self.fieldBinds:
-                if self.fieldBinds[field].eq(other.fieldBinds[field]) == Bool(False):
+                fieldEq = equalityBinaryOperation(self.fieldBinds[field], other.fieldBinds[field], '==')
+                if fieldEq == Bool(False):
                     return Bool(False)
-            return Bool(True)
+                if fieldEq.__class__ == DontCareLiteral:
+                    result = DontCareLiteral()  # equal unless a later field differs
+            return result
         def neq(self, other):
             return self.eq(other).booleaninv()
-    return StructType
+    return intern(key, StructType)
 
 class Any(MLiteral):
     ''' An unknown type. This type has no instances. '''
@@ -442,78 +679,136 @@ IntegerLiteral = Integer  #useful alias
 def Bit(n: 'IntegerLiteral'):
     ''' Returns a type corresponding to a bitstring Bit#(n) of length n. '''
     assert n.__class__ == IntegerLiteral, f"Bit takes integer literals, not {n} which is {n.__class__}"
+    key = (Bit, n.value)
+    interned = getInterned(key)
+    if interned is not None:
+        return interned
+    widthLiteral = IntegerLiteral(n.value)  # the shared type should not hold on to the source tokens of the caller's literal
+    bitWidth = n.value
+    bitMask = (1 << bitWidth) - 1
+    signBit = 1 << (bitWidth - 1) if bitWidth > 0 else 0
+    binaryFormat = f"0{bitWidth}b"
     class BitLiteral(MLiteral):
-        ''' self.n: 'int' is the number of bits. self.value: 'int' is an integer 0 <= value < 2**n. '''
-        _name = f"Bit#({n})"
+        ''' self.value: 'int' is an integer 0 <= value < 2**n. The width is a property of the class:
+        n is the width as an IntegerLiteral and width is the width as an int.
+        self.unknown: 'int' is the bitmask of the bits whose value is not known (don't-care bits), which are 0 in
+        self.value. See the notes on four-state literals. '''
+        __slots__ = 'value', 'unknown'
+        _name = f"Bit#({widthLiteral})"
         _constructor = Bit
-        _n = n
-        def __init__(self, value: 'int'):
+        _n = widthLiteral
+        _hash = hash((Bit, bitWidth))
+        n = widthLiteral
+        width = bitWidth
+        mask = bitMask
+        def __init__(self, value: 'int', unknown: 'int' = 0):
             ''' Create a Bit#(n) literal.
             value is an integer which will be assigned (mod 2**n) to self.value.
             Value may be any integer even though bsc requires Bit#(n) literals
-            to be in the range -2**(n-1), ..., (2**n)-1. '''
-            self.n = n
+            to be in the range -2**(n-1), ..., (2**n)-1.
+            unknown is the bitmask of the bits which are not known. '''
             assert value.__class__ == int, f"Expected int, not {value} which is {value.__class__}"
-            self.value = value % (2**n.value)
+            if unknown:
+                self.unknown = unknown & bitMask
+                self.value = value & bitMask & ~unknown
+            else:
+                self.unknown = 0
+                self.value = value & bitMask
+        @classmethod
+        def dontCare(cls) -> 'MLiteral':
+            return cls(0, bitMask)
+        def isKnown(self) -> 'bool':
+            return self.unknown == 0
         def copy(self):
-            c = BitLiteral(self.value)
+            c = self.__class__(self.value, self.unknown)
             for tokenArray in self.getSourceTokensNotFlat():
                 c.addSourceTokens(tokenArray)
             return c
         def isBitLiteral(self):
             return True
         def numLiterals(self) -> 'int|float':
-            return 2**n.value
+            return bitMask + 1
         @classmethod
         def sameType(self, other):
             return self._n == other._n
+        @classmethod
+        def leafFields(cls):
+            return [("", bitWidth)]
         def __repr__(self):
-            return "BitLiteral(" + str(self.n) + "," + str(self.value) + ")"
+            if self.unknown:
+                return "BitLiteral(" + str(bitWidth) + "," + str(self.value) + "," + str(self.unknown) + ")"
+            return "BitLiteral(" + str(bitWidth) + "," + str(self.value) + ")"
         def __str__(self):
-            output = ""
-            val = self.value
-            for i in range(self.n.value):
-                output = str(val % 2) + output
-                val //= 2
-            return str(self.n) + "'b" + output
+            if self.unknown:
+                digits = format(self.value, binaryFormat)
+                unknownDigits = format(self.unknown, binaryFormat)
+                return f"{bitWidth}'b" + "".join('x' if unknownDigits[i] == '1' else digits[i] for i in range(bitWidth))
+            return f"{bitWidth}'b{format(self.value, binaryFormat) if bitWidth > 0 else ''}"
         def __eq__(self, other):
             if self.__class__ != other.__class__:
                 return False
-            return self.value == other.value
+            return self.value == other.value and self.unknown == other.unknown
+        def __hash__(self):
+            if self.unknown:
+                return hash((bitWidth, self.value, self.unknown))
+            return hash((bitWidth, self.value))
+        def toInt(self) -> 'int':
+            ''' Returns the unsigned value of self. '''
+            return self.value
+        def signedValue(self) -> 'int':
+            ''' Returns the value of self read as a two's complement number. '''
+            return self.value - (bitMask + 1) if self.value & signBit else self.value
         def fromIntegerLiteral(self, i: 'IntegerLiteral'):
-            assert -(2**(self.n-1)) <= i.toInt() < 2**self.n, "Bluespec requires Bit#(n) literals to be in range -2**(n-1),...,2**n-1."
-            return Bit(self.n)(i.toInt())
+            assert -signBit <= i.toInt() <= bitMask, "Bluespec requires Bit#(n) literals to be in range -2**(n-1),...,2**n-1."
+            return self.__class__(i.toInt())
         def eq(self, other):
             assert self.__class__ == other.__class__, f"Can only compare values of the same type, found {self.__class__} and {other.__class__}"
+            if self.unknown or other.unknown:
+                if (self.value ^ other.value) & ~(self.unknown | other.unknown):
+                    return BooleanLiteral(False)  # the known bits differ
+                return DontCareLiteral()
             return BooleanLiteral(self.value == other.value)
         '''unary operations'''
         def booleaninv(self):
             raise Exception("Not implemented")
         def inv(self):
-            return Bit(self.n)(~self.value)
+            return self.__class__(~self.value, self.unknown)
         def redand(self):
-            raise Exception("Not implemented")
+            if self.unknown and (self.value | self.unknown) == bitMask:
+                return Bit(IntegerLiteral(1))(0, 1)  # no bit is known to be 0
+            return Bit(IntegerLiteral(1))(1 if self.value == bitMask else 0)
         def redor(self):
-            raise Exception("Not implemented")
+            if self.unknown and self.value == 0:
+                return Bit(IntegerLiteral(1))(0, 1)  # no bit is known to be 1
+            return Bit(IntegerLiteral(1))(1 if self.value != 0 else 0)
         def redxor(self):
-            raise Exception("Not implemented")
+            if self.unknown:
+                return Bit(IntegerLiteral(1))(0, 1)
+            return Bit(IntegerLiteral(1))(bin(self.value).count('1') & 1)
         def unaryadd(self):
-            raise Exception("Not implemented")
+            return self.__class__(self.value, self.unknown)
         def neg(self):
-            return Bit(self.n)(-self.value)
+            return self.__class__(-self.value, carriedUnknowns(self.unknown, bitMask))
         ''' other operations '''
         def slice(self, msb, lsb=None):
             if lsb != None:
                 assert msb.value >= lsb.value, f"Values msb={msb} and lsb={lsb} are of range"
-                width = msb.value - lsb.value + 1
-                return Bit(IntegerLiteral(width))((self.value >> lsb.value) % 2**(width))
-            return Bit(IntegerLiteral(1))((self.value//(2**msb.value)) % 2)
-    return BitLiteral
+                sliceWidth = msb.value - lsb.value + 1
+                return Bit(IntegerLiteral(sliceWidth))(self.value >> lsb.value, self.unknown >> lsb.value)
+            return Bit(IntegerLiteral(1))(self.value >> msb.value, self.unknown >> msb.value)
+        def concat(self, other: 'MLiteral') -> 'MLiteral':
+            ''' Returns the bit concatenation {self, other}, with self in the most significant bits. '''
+            assert other.isBitLiteral(), f"Can only concatenate bit literals, not {other.__class__}"
+            return Bit(IntegerLiteral(bitWidth + other.width))((self.value << other.width) | other.value, (self.unknown << other.width) | other.unknown)
+    return intern(key, BitLiteral)
 BitLiteral = Bit #useful synonym
 
 class Bool(MLiteral):
     '''The boolean type'''
     _name = "Bool"
+    @classmethod
+    def leafFields(cls):
+        return [("", 1)]
     def __init__(self, value: 'bool'):
         assert value.__class__ == bool, "Boolean literals must have boolean value"
         self.value = value
@@ -555,23 +850,219 @@ class Bool(MLiteral):
         raise Exception("Not implemented")
 BooleanLiteral = Bool  #useful alias
         
-def Vector(k: 'int', typeValue: 'MType'):
+def Vector(k: 'IntegerLiteral', typeValue: 'MType'):
+    ''' Returns the type Vector#(k, typeValue). Instances are vector literals. '''
+    key = (Vector, k, id(typeValue))  # the created class keeps typeValue alive, so its id is not reused
+    interned = getInterned(key)
+    if interned is not None:
+        return interned
+    numElements = k.value if k.__class__ == IntegerLiteral else k
+    allDefined = (1 << numElements) - 1
+    laneWidth = bitWidthOf(typeValue)
+    laneMask = (1 << laneWidth) - 1 if laneWidth != None else None
+    useNumpy = numpy != None and laneWidth != None and laneWidth <= 64
     class VectorType(MLiteral):
-        '''The Vector(k, tt) type'''
+        ''' The Vector(k, tt) type. A vector literal stores its elements in lanes: for a vector of Bit#(n),
+        lanes holds the value of each element as an int (in a numpy array if n <= 64 and numpy is available,
+        otherwise in a list), and for other vectors lanes is a list of literals. defined is a bitmask of the
+        elements which have been assigned; unassigned lanes hold 0 or None. For a vector of Bit#(n), unknown is the
+        bitmask of the don't-care bits of the elements, with the bits of element i at i*n, as in a four-state
+        Bit#(n) literal; operations on vectors with unknown bits go one element at a time.
+        withElement does not copy the lanes: the new vector takes them over and writes the element in place, and
+        self keeps only the element it had (in _newer) and gets the lanes back when it is next read. A loop
+        writing the elements of a vector one at a time takes O(1) per write, and older vectors stay valid. '''
+        __slots__ = '_lanes', 'defined', 'unknown', '_newer'
         _name = f"Vector#({k},{typeValue})"
         _constructor = Vector
         _k = k
         _typeValue = typeValue
-        def __init__(self):
-            self.k = k
-            self.typeValue = typeValue
+        _hash = hash((Vector, k, typeValue))
+        def __init__(self, elements: 'list[MLiteral|None]|None' = None):
+            ''' Create a vector literal with the given elements. Elements which are None or don't-care
+            are left unassigned. If elements is None, no elements are assigned. '''
+            if elements == None:
+                elements = [None] * numElements
+            assert len(elements) == numElements, f"Expected {numElements} elements, not {len(elements)}"
+            self.defined = 0
+            self.unknown = 0
+            lanes = []
+            for i in range(numElements):
+                element = elements[i]
+                if element == None or element.__class__ == DontCareLiteral:
+                    lanes.append(0 if laneWidth != None else None)
+                    continue
+                self.defined |= 1 << i
+                lanes.append(element.value & laneMask if laneWidth != None else element)
+                if laneWidth != None and element.isBitLiteral():
+                    self.unknown |= element.unknown << (i * laneWidth)
+            self.lanes = numpy.array(lanes, dtype=numpy.uint64) if useNumpy else lanes
+        @classmethod
+        def fromLanes(cls, lanes: 'list|numpy.ndarray', defined: 'int', unknown: 'int' = 0) -> 'MLiteral':
+            ''' Create a vector literal directly from its lanes, which are not copied. '''
+            vector = cls.__new__(cls)
+            vector.lanes = lanes
+            vector.defined = defined
+            vector.unknown = unknown
+            return vector
+        @property
+        def lanes(self) -> 'list|numpy.ndarray':
+            if self._newer != None:
+                self.reroot()
+            return self._lanes
+        @lanes.setter
+        def lanes(self, lanes: 'list|numpy.ndarray'):
+            self._lanes = lanes
+            self._newer: 'tuple[MLiteral, int, object]|None' = None  # (the vector holding the lanes, the index written, the element of self there)
+        def reroot(self):
+            ''' Takes back the lanes from the vector they were handed to by withElement, undoing its writes. '''
+            chain = [self]
+            while chain[-1]._newer != None:
+                chain.append(chain[-1]._newer[0])
+            lanes = chain[-1]._lanes
+            for vector in reversed(chain[:-1]):
+                newer, i, lane = vector._newer
+                newer._lanes, newer._newer = None, (vector, i, lanes[i])
+                lanes[i] = lane
+                vector._lanes, vector._newer = lanes, None
+        def copy(self):
+            c = self.fromLanes(self.lanes.copy(), self.defined, self.unknown)
+            for tokenArray in self.getSourceTokensNotFlat():
+                c.addSourceTokens(tokenArray)
+            return c
         def numLiterals(self) -> 'int|float':
-            return typeValue.numLiterals() ** k
+            return typeValue.numLiterals() ** numElements
         @classmethod
         def sameType(self, other):
             return self._k == other._k and self._typeValue == other._typeValue
+        @classmethod
+        def leafFields(cls):
+            elementLayout = typeValue.untypedef().leafFields() if typeValue.__class__ == MType else None
+            if elementLayout == None:
+                return None
+            layout = []
+            for i in range(numElements):  # element 0 takes the least significant bits
+                layout += nestFields(f"_{i}", elementLayout)
+            return layout
+        @classmethod
+        def laneWidth(cls) -> 'int|None':
+            ''' The width n of the elements if this is a vector of Bit#(n), otherwise None. '''
+            return laneWidth
+        def isDefined(self, i: 'int') -> 'bool':
+            return (self.defined >> i) & 1 == 1
+        def hasDefinedElements(self) -> 'bool':
+            return self.defined != 0
+        def element(self, i: 'int') -> 'MLiteral':
+            ''' Returns element i, or a don't-care literal if element i has not been assigned. '''
+            assert 0 <= i < numElements, f"Index {i} is out of bounds for {self.__class__}"
+            if not self.isDefined(i):
+                return DontCareLiteral()
+            if laneWidth != None:
+                if self.unknown:
+                    return typeValue(int(self.lanes[i]), (self.unknown >> (i * laneWidth)) & laneMask)
+                return typeValue(int(self.lanes[i]))
+            return self.lanes[i]
+        def elements(self) -> 'list[MLiteral]':
+            return [self.element(i) for i in range(numElements)]
+        def withElement(self, i: 'int', value: 'MLiteral') -> 'MLiteral':
+            ''' Returns a copy of self with element i set to value, see the note above. '''
+            assert 0 <= i < numElements, f"Index {i} is out of bounds for {self.__class__}"
+            lanes = self.lanes
+            unknown = 0
+            if value.__class__ == DontCareLiteral:
+                lane, defined = 0 if laneWidth != None else None, self.defined & ~(1 << i)
+            else:
+                lane, defined = value.value & laneMask if laneWidth != None else value, self.defined | (1 << i)
+                if laneWidth != None and value.isBitLiteral():
+                    unknown = value.unknown
+            if self.unknown or unknown:
+                unknown = (self.unknown & ~(laneMask << (i * laneWidth))) | (unknown << (i * laneWidth))
+            vector = self.fromLanes(lanes, defined, unknown)
+            self._lanes, self._newer = None, (vector, i, lanes[i])
+            lanes[i] = lane
+            return vector
         def __str__(self):
-            return "Vector#(" + str(self.k) + ", " + str(self.typeValue) + ")"
+            return "[" + ", ".join(str(element) for element in self.elements()) + "]"
+        def __eq__(self, other):
+            if self.__class__ != other.__class__ or self.defined != other.defined or self.unknown != other.unknown:
+                return False
+            if useNumpy:
+                return bool(numpy.array_equal(self.lanes, other.lanes))
+            return all(self.lanes[i] == other.lanes[i] for i in range(numElements))
+        def __hash__(self):
+            if useNumpy:
+                return hash((self.defined, self.unknown, self.lanes.tobytes()))
+            return hash((self.defined, self.unknown, tuple(self.lanes)))
+        def eq(self, other):
+            assert self.__class__ == other.__class__, f"Can only compare values of the same type, found {self.__class__} and {other.__class__}"
+            if self.defined != allDefined or other.defined != allDefined:
+                return DontCareLiteral()
+            if laneWidth != None and not (self.unknown or other.unknown):
+                return Bool(self == other)
+            if laneWidth != None:
+                results = [self.element(i).eq(other.element(i)) for i in range(numElements)]
+                if Bool(False) in results:
+                    return Bool(False)
+                return Bool(True) if all(result == Bool(True) for result in results) else DontCareLiteral()
+            for i in range(numElements):
+                if self.lanes[i].eq(other.lanes[i]) == Bool(False):
+                    return Bool(False)
+            return Bool(True)
+        def slice(self, msb, lsb=None):
+            ''' v[i] is element i. v[msb:lsb] is the vector of elements lsb through msb. '''
+            if lsb == None:
+                return self.element(msb.value)
+            assert 0 <= lsb.value <= msb.value < numElements, f"Values msb={msb} and lsb={lsb} are out of range"
+            sliceLength = msb.value - lsb.value + 1
+            sliceType = Vector(IntegerLiteral(sliceLength), typeValue)
+            unknown = (self.unknown >> (lsb.value * laneWidth)) & ((1 << (sliceLength * laneWidth)) - 1) if self.unknown else 0
+            return sliceType.fromLanes(self.lanes[lsb.value:msb.value+1].copy(), (self.defined >> lsb.value) & ((1 << sliceLength) - 1), unknown)
+        def operateLanes(self, other: 'MLiteral', op: 'str') -> 'MLiteral':
+            ''' Returns the element-wise result of self `op` other. Arithmetic and logical operations return a
+            vector of the same type; relational and equality operations return a vector of Bool. '''
+            assert self.__class__ == other.__class__, f"Can only operate on vectors of the same type, found {self.__class__} and {other.__class__}"
+            defined = self.defined & other.defined
+            if laneWidth == None:
+                return operateLiteralLanes(self, other, op, defined)
+            if self.unknown or other.unknown:
+                # four-state elements, one at a time
+                resultType = Vector(k, Bool) if op in relational_binary or op in equality_binary else self.__class__
+                return resultType([binaryOperation(self.element(i), other.element(i), op) if (defined >> i) & 1 else None for i in range(numElements)])
+            if op in relational_binary or op in equality_binary:
+                resultType = Vector(k, Bool)
+                if useNumpy:
+                    results = numpyRelational[op](self.lanes, other.lanes).tolist()
+                else:
+                    results = [pythonRelational[op](self.lanes[i], other.lanes[i]) for i in range(numElements)]
+                return resultType.fromLanes([Bool(results[i]) if (defined >> i) & 1 else None for i in range(numElements)], defined)
+            if useNumpy and op in numpyArithmetic:
+                return self.fromLanes(numpyArithmetic[op](self.lanes, other.lanes, laneWidth) & numpy.uint64(laneMask), defined)
+            left, right = (self.lanes.tolist(), other.lanes.tolist()) if useNumpy else (self.lanes, other.lanes)
+            lanes = [pythonArithmetic[op](left[i], right[i]) & laneMask if (defined >> i) & 1 else 0 for i in range(numElements)]
+            return self.fromLanes(numpy.array(lanes, dtype=numpy.uint64) if useNumpy else lanes, defined)
+        def reduceLanes(self, op: 'str') -> 'MLiteral':
+            ''' Returns the element type literal obtained by combining all the elements with op, which is
+            one of '+', '*', '&', '|', '^', 'min', 'max'. Returns a don't-care literal if any element is unassigned. '''
+            if self.defined != allDefined:
+                return DontCareLiteral()
+            assert numElements > 0, "Cannot reduce an empty vector"
+            if laneWidth == None:
+                result = self.lanes[0]
+                for i in range(1, numElements):
+                    result = binaryOperation(result, self.lanes[i], op)
+                return result
+            if self.unknown:
+                if op in ('min', 'max'):
+                    return typeValue(0, laneMask)  # which element is smallest is not known
+                result = self.element(0)
+                for i in range(1, numElements):
+                    result = binaryOperation(result, self.element(i), op)
+                return result
+            if useNumpy:
+                return typeValue(int(numpyReductions[op](self.lanes)) & laneMask)
+            result = self.lanes[0]
+            for i in range(1, numElements):
+                result = pythonReductions[op](result, self.lanes[i]) & laneMask
+            return typeValue(result)
         @classmethod
         def accept(cls, visitor):  #note that accept is called on Vector the class, not an instance of vector.
             ''' If the vector is being visited as a type, redirect it to synthesizing a vector. '''
@@ -579,7 +1070,98 @@ def Vector(k: 'int', typeValue: 'MType'):
     VectorType._moduleCtx = BuiltinVectorCtx(typeValue)  # since this is also a ModuleType object
     VectorType._params = [k, typeValue]
     # TODO refactor the vector type into a separate type object and ctx parse node object
-    return VectorType
+    return intern(key, VectorType)
+
+def isVectorLiteral(value: 'MLiteral') -> 'bool':
+    return value.__class__.untypedef()._constructor == Vector
+
+def isValueType(mtype: 'MType') -> 'bool':
+    ''' Returns whether literals of mtype are plain values (as opposed to modules or unknown types). '''
+    if mtype.__class__ != MType:
+        return False
+    mtype = mtype.untypedef()
+    if mtype == Bool or mtype == Integer:
+        return True
+    if mtype._constructor == Vector:
+        return isValueType(mtype._typeValue)
+    return mtype._constructor in (Bit, Maybe, Struct, Enum)
+
+def bitWidthOf(mtype: 'MType') -> 'int|None':
+    ''' Returns n if mtype is Bit#(n), otherwise None. '''
+    if mtype.__class__ != MType:
+        return None
+    mtype = mtype.untypedef()
+    if mtype._constructor == Bit:
+        return mtype._n.value
+    return None
+
+def operateLiteralLanes(left: 'MLiteral', right: 'MLiteral', op: 'str', defined: 'int') -> 'MLiteral':
+    ''' Element-wise operation on vectors whose elements are not bits, one literal at a time. '''
+    results = [binaryOperation(left.lanes[i], right.lanes[i], op) if (defined >> i) & 1 else None for i in range(len(left.lanes))]
+    resultType = left.__class__
+    if op in relational_binary or op in equality_binary:
+        resultType = Vector(left._k, Bool)
+    return resultType.fromLanes(results, defined)
+
+''' Element-wise operations on the lanes of vectors of bits. Results are reduced mod 2**n by the caller.
+Division and remainder are done with python ints so that division by zero raises as it does for bit literals. '''
+def _shiftLanes(shift):
+    def operate(a, b, width):
+        # shifting a 64 bit lane by 64 or more is not defined in numpy
+        return numpy.where(b >= width, numpy.uint64(0), shift(a, numpy.minimum(b, numpy.uint64(63))))
+    return operate
+numpyArithmetic = {} if numpy == None else {
+    '+': lambda a, b, width: a + b,
+    '-': lambda a, b, width: a - b,
+    '*': lambda a, b, width: a * b,
+    '**': lambda a, b, width: a ** b,
+    '&': lambda a, b, width: a & b,
+    '|': lambda a, b, width: a | b,
+    '^': lambda a, b, width: a ^ b,
+    '^~': lambda a, b, width: ~(a ^ b),
+    '~^': lambda a, b, width: ~(a ^ b),
+    '<<': _shiftLanes(numpy.left_shift),
+    '>>': _shiftLanes(numpy.right_shift),
+}
+pythonArithmetic = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': lambda a, b: a // b,
+    '%': lambda a, b: a % b,
+    '**': lambda a, b: a ** b,
+    '&': lambda a, b: a & b,
+    '|': lambda a, b: a | b,
+    '^': lambda a, b: a ^ b,
+    '^~': lambda a, b: ~(a ^ b),
+    '~^': lambda a, b: ~(a ^ b),
+    '<<': lambda a, b: a << b,
+    '>>': lambda a, b: a >> b,
+}
+numpyRelational = {} if numpy == None else {
+    '<': numpy.less, '>': numpy.greater, '<=': numpy.less_equal, '>=': numpy.greater_equal, '==': numpy.equal, '!=': numpy.not_equal,
+}
+pythonRelational = {
+    '<': lambda a, b: a < b, '>': lambda a, b: a > b, '<=': lambda a, b: a <= b, '>=': lambda a, b: a >= b, '==': lambda a, b: a == b, '!=': lambda a, b: a != b,
+}
+numpyReductions = {} if numpy == None else {
+    '+': lambda lanes: numpy.add.reduce(lanes, dtype=numpy.uint64),
+    '*': lambda lanes: numpy.multiply.reduce(lanes, dtype=numpy.uint64),
+    '&': numpy.bitwise_and.reduce,
+    '|': numpy.bitwise_or.reduce,
+    '^': numpy.bitwise_xor.reduce,
+    'min': numpy.min,
+    'max': numpy.max,
+}
+pythonReductions = {
+    '+': lambda a, b: a + b,
+    '*': lambda a, b: a * b,
+    '&': lambda a, b: a & b,
+    '|': lambda a, b: a | b,
+    '^': lambda a, b: a ^ b,
+    'min': min,
+    'max': max,
+}
 
 class BuiltinVectorCtx:
     def __init__(self, vectorType: 'MType'):
@@ -618,11 +1200,16 @@ def ModuleType(moduleCtx, params: 'list[MLiteral|MType]'):
 
 def Maybe(mtype: 'MType'):
     ''' mtype is the type of the Maybe minispec type '''
+    key = (Maybe, id(mtype))  # the created class keeps mtype alive, so its id is not reused
+    interned = getInterned(key)
+    if interned is not None:
+        return interned
     class MaybeType(MLiteral):
         '''value is the value if valid, None if invalid'''
         _name = "Maybe#(" + str(mtype) + ")"
         _constructor = Maybe
         _mtype = mtype
+        _hash = hash((Maybe, mtype))
         def __init__(self, value: 'mtype' = None):
             self.value = value
             if value == None:
@@ -653,14 +1240,21 @@ def Maybe(mtype: 'MType'):
         @classmethod
         def sameType(self, other):
             return self._mtype == other._mtype
+        @classmethod
+        def leafFields(cls):
+            valueLayout = nestFields("value", mtype.untypedef().leafFields())
+            if valueLayout == None:
+                return None
+            return valueLayout + [("valid", 1)]  # the valid bit is the most significant bit
 
-    return MaybeType
+    return intern(key, MaybeType)
 
 def Invalid(mtype: 'MType'):
     return Maybe(mtype)()
 
 class DontCareLiteral(MLiteral):
-    '''only one kind, "?" '''
+    '''only one kind, "?". A value of unknown type of which nothing is known. Operations on don't care values
+    return don't care values, except where the result does not depend on the unknown value. '''
     def __init__(self):
         pass
     def __str__(self):
@@ -668,80 +1262,96 @@ class DontCareLiteral(MLiteral):
     def __eq__(self, other):
         return self.__class__ == other.__class__
     def eq(self, other):
-        # TODO figure out what happens to ? values in case/if statements/expressions
-        assert self.__class__ == other.__class__, f"Can only compare values of the same type, found {self.__class__} and {other.__class__}"
-        raise Exception("Arithmetic with don't care literals is not implemented due to entanglement")
+        return DontCareLiteral()
+    def copy(self):
+        c = DontCareLiteral()
+        for tokenArray in self.getSourceTokensNotFlat():
+            c.addSourceTokens(tokenArray)
+        return c
     '''unary operations'''
     def booleaninv(self):
-        raise Exception("Arithmetic with don't care literals is not implemented due to entanglement")
+        return DontCareLiteral()
     def inv(self):
-        raise Exception("Arithmetic with don't care literals is not implemented due to entanglement")
+        return DontCareLiteral()
     def redand(self):
-        raise Exception("Arithmetic with don't care literals is not implemented due to entanglement")
+        return DontCareLiteral()
     def redor(self):
-        raise Exception("Arithmetic with don't care literals is not implemented due to entanglement")
+        return DontCareLiteral()
     def redxor(self):
-        raise Exception("Arithmetic with don't care literals is not implemented due to entanglement")
+        return DontCareLiteral()
     def unaryadd(self):
-        raise Exception("Arithmetic with don't care literals is not implemented due to entanglement")
+        return DontCareLiteral()
     def neg(self):
-        raise Exception("Arithmetic with don't care literals is not implemented due to entanglement")
-
-strangelyDifferentTypes = []
-strangelyDifferentTypeMessages = set()
-def mergeEqualTypes(type1: 'MType', type2: 'MType') -> 'MType':
-    ''' Given two types, returns a type eqivalent to both which should be regared as more specific. '''
-    # print(type1, type2, type1 == type2)
-    if type1 == DontCareLiteral:
-        return type2
-    if type2 == DontCareLiteral:
+        return DontCareLiteral()
+
+def isKnownLiteral(value: 'MLiteral') -> 'bool':
+    ''' Returns whether value is a literal of which every bit is known. '''
+    if value.__class__ == DontCareLiteral:
+        return False
+    if value.isBitLiteral():
+        return value.unknown == 0
+    if value.__class__.untypedef()._constructor == Struct:
+        return all(isKnownLiteral(field) for field in value.fieldBinds.values())
+    return True
+
+def mergeLiterals(values: 'list[MLiteral]') -> 'MLiteral|None':
+    ''' Returns a literal which is a possible value of each of the given literals, or None if there is none,
+    eg 4'b10xx and 4'bx0x1 merge to 4'b10x1 and ? merges with anything. A mux whose inputs are all literals
+    which merge may be replaced by the merged literal. '''
+    merged = values[0]
+    for value in values[1:]:
+        merged = mergeTwoLiterals(merged, value)
+        if merged is None:
+            return None
+    return merged
+
+def mergeTwoLiterals(left: 'MLiteral', right: 'MLiteral') -> 'MLiteral|None':
+    if left.__class__ == DontCareLiteral:
+        return right
+    if right.__class__ == DontCareLiteral:
+        return left
+    if left.__class__ != right.__class__:
+        return None
+    if left.isBitLiteral():
+        if (left.value ^ right.value) & ~(left.unknown | right.unknown):
+            return None
+        return left.__class__(left.value | right.value, left.unknown & right.unknown)
+    if left.__class__.untypedef()._constructor == Struct:
+        fieldBinds = {}
+        for field in left.fieldBinds:
+            fieldBinds[field] = mergeTwoLiterals(left.fieldBinds[field], right.fieldBinds[field])
+            if fieldBinds[field] is None:
+                return None
+        return left.__class__(fieldBinds)
+    return left if left == right else None
+
+def joinTypes(type1: 'MType', type2: 'MType') -> 'MType|None':
+    ''' Given two types, returns the least specific type which is at least as specific as both,
+    or None if there is no such type (the types conflict). Types are ordered by:
+        - Any and DontCareLiteral are less specific than every type,
+        - Integer is less specific than Bit#(n),
+        - Maybe#(t1) is less specific than Maybe#(t2) if t1 is less specific than t2, and similarly for Vector#(k, t).
+    Equal types (eg typedef synonyms) join to type1. '''
+    if type1 is type2:
         return type1
-    if type1 == Any:
+    if type1 is DontCareLiteral or type1 is Any:
         return type2
-    if type2 == Any:
+    if type2 is DontCareLiteral or type2 is Any:
+        return type1
+    if type1 == type2:
         return type1
     if type1 == Integer and type2.isBitLiteral(None):
         return type2
     if type2 == Integer and type1.isBitLiteral(None):
         return type1
-    if type1 == Maybe(Any):
-        if type2._constructor == Maybe:
-            return type2
-    if type2 == Maybe(Any):
-        if type1._constructor == Maybe:
-            return type1
-    if type1 != type2:
-        message = f'strangely different types {type1} {type2}'
-        if message not in strangelyDifferentTypeMessages:
-            print(message)
-        strangelyDifferentTypeMessages.add(message)
-        # to avoid circular dependecies on types, we dynamically create an implicit ordering.
-        # we prefer types that appear earlier in strangelyDifferentTypes.
-        indx1 = -1
-        for i in range(len(strangelyDifferentTypes)):
-            if type1 == strangelyDifferentTypes[i]:
-                indx1 = i
-            break
-        indx2 = -1
-        for i in range(len(strangelyDifferentTypes)):
-            if type2 == strangelyDifferentTypes[i]:
-                indx2 = i
-            break
-        if indx1 == -1 and indx2 == -1:
-            strangelyDifferentTypes.append(type1)
-            strangelyDifferentTypes.append(type2)
-            return type1
-        if indx1 == -1:
-            strangelyDifferentTypes.append(type1)
-            return type2
-        if indx2 == -1:
-            strangelyDifferentTypes.append(type2)
-            return type1
-        assert indx1 != indx2, f"Broke transitivity of equality with {type1}, {type2}, and {strangelyDifferentTypes[indx1]}"
-        if indx1 < indx2:
-            return type1
-        return type2
-    return type1
+    untyped1, untyped2 = type1.untypedef(), type2.untypedef()
+    if untyped1._constructor == Maybe and untyped2._constructor == Maybe:
+        joined = joinTypes(untyped1._mtype, untyped2._mtype)
+        return Maybe(joined) if joined != None else None
+    if untyped1._constructor == Vector and untyped2._constructor == Vector and untyped1._k == untyped2._k:
+        joined = joinTypes(untyped1._typeValue, untyped2._typeValue)
+        return Vector(untyped1._k, joined) if joined != None else None
+    return None
 
 if __name__ == '__main__':
     # #Create a synonym of Bit#(32). For testing purposes.
@@ -0,0 +1,459 @@
+import array
+import hardware
+import mtypes
+from typing import Any
+try:
+    import numpy  # optional, used for bulk queries over the columns
+except ImportError:
+    numpy = None
+
+''' Array-backed netlists.
+The hardware representation of hardware.py makes every Node, Wire and Component a python object, and each Node
+keeps two sets of Wires (even though a Node is the dst of at most one Wire). On designs with millions of Nodes the
+objects and sets dominate both memory use and the time spent walking the graph.
+A Netlist stores the same two data structures (the graph of Nodes and Wires and the tree of Components) with
+integer ids instead of objects. Each field lives in a column: a growable `array.array` indexed by id, so a Node
+costs a few machine words instead of an object and two sets.
+    Nodes. nodeParent, nodeIsInput, nodeLabel and nodeType hold the parent Component, the side and label of the
+        Node in its parent and the type of the Node. nodeInWire is the unique Wire with the Node as its dst (or -1).
+        The Wires with the Node as their src form a linked list starting at nodeFirstOut and continuing through
+        wireNextOut.
+    Wires. wireSrc, wireDst and wireType. A removed Wire has wireSrc -1.
+    Components. componentClass is the index of the hardware class of the Component in componentClasses, and
+        componentName is the atom of its name. The children of a Component form a linked list starting at
+        componentFirstChild and continuing through componentNextSibling. The Nodes of a Component (its port table)
+        form a linked list, in the order they were added, from componentFirstPort through nodeNextPort.
+Labels and names are interned in the atom table and types in the type table, so the columns only hold ints.
+Information which only a few Components or Wires have (source tokens, the value of a Constant, the input names of
+a Function, ...) is kept in dicts keyed by id.
+    A Netlist is an export format, not a second hardware representation: the passes of hardware.py (type and
+width inference, levelization, garbage collection, ELK output, ...) only run on Components, so a Netlist is turned
+back into Components with toComponent before it is worked on. NodeView, WireView and ComponentView are thin views
+(a Netlist and an id) for inspecting a Netlist without rebuilding it. Their properties borrow the names of the
+hardware.py classes where they can, but they are not interchangeable with Node, Wire and Component (eg a view has
+mtype and componentClass properties and ComponentView.inputs is a dict even for a Function). A view is created on
+each access and two views are equal if they have the same Netlist and id.
+    Netlist.fromComponent copies a synthesized design into a Netlist, and toComponent rebuilds the Component tree.
+'''
+
+componentClasses: 'tuple[type, ...]' = (hardware.Component, hardware.Function, hardware.Mux, hardware.Constant, hardware.Module,
+                                        hardware.Register, hardware.VectorModule, hardware.Inserter, hardware.Demux, hardware.Splitter)
+componentClassIds: 'dict[type, int]' = {componentClass: i for i, componentClass in enumerate(componentClasses)}
+
+def intColumn() -> 'array.array':
+    ''' An empty column of ids. '''
+    return array.array('i')
+
+def flagColumn() -> 'array.array':
+    ''' An empty column of booleans. '''
+    return array.array('b')
+
+class Netlist:
+    ''' An array-backed store for a hardware graph and component tree. See the note above. '''
+    __slots__ = 'atoms', '_atomIds', 'types', '_typeIds', \
+                'nodeParent', 'nodeIsInput', 'nodeLabel', 'nodeType', 'nodeInWire', 'nodeFirstOut', 'nodeNextPort', 'nodeNames', \
+                'wireSrc', 'wireDst', 'wireType', 'wireNextOut', 'wireTokens', 'numWiresRemoved', \
+                'componentClass', 'componentName', 'componentParent', 'componentFirstChild', 'componentNextSibling', \
+                'componentFirstPort', 'componentLastPort', 'componentPersistent', 'componentTokens', 'componentData'
+    def __init__(self):
+        self.atoms: 'list[Any]' = []  # interned names and labels
+        self._atomIds: 'dict[tuple[type, Any], int]' = {}
+        self.types: 'list[mtypes.MType]' = []  # interned types
+        self._typeIds: 'dict[int, int]' = {}  # keyed by id(type) so that typedef synonyms are kept apart
+        self.nodeParent, self.nodeIsInput, self.nodeLabel, self.nodeType = intColumn(), flagColumn(), intColumn(), intColumn()
+        self.nodeInWire, self.nodeFirstOut, self.nodeNextPort = intColumn(), intColumn(), intColumn()
+        self.nodeNames: 'dict[int, str]' = {}  # only for Nodes with a nonempty name
+        self.wireSrc, self.wireDst, self.wireType, self.wireNextOut = intColumn(), intColumn(), intColumn(), intColumn()
+        self.wireTokens: 'dict[int, list[tuple[str, int]]]' = {}
+        self.numWiresRemoved: 'int' = 0
+        self.componentClass, self.componentName, self.componentParent = flagColumn(), intColumn(), intColumn()
+        self.componentFirstChild, self.componentNextSibling = intColumn(), intColumn()
+        self.componentFirstPort, self.componentLastPort, self.componentPersistent = intColumn(), intColumn(), flagColumn()
+        self.componentTokens: 'dict[int, list[tuple[str, int]]]' = {}
+        self.componentData: 'dict[int, dict[str, Any]]' = {}  # the fields particular to the class of the Component, see fromComponent
+    def __repr__(self):
+        return f"Netlist({self.numComponents()} components, {self.numNodes()} nodes, {self.numWires()} wires)"
+
+    def atom(self, value: 'Any') -> 'int':
+        ''' Returns the index of value in the atom table, adding it if needed. '''
+        key = (value.__class__, value)
+        atomId = self._atomIds.get(key)
+        if atomId == None:
+            atomId = len(self.atoms)
+            self.atoms.append(value)
+            self._atomIds[key] = atomId
+        return atomId
+    def typeId(self, mtype: 'mtypes.MType') -> 'int':
+        ''' Returns the index of mtype in the type table, adding it if needed. '''
+        typeId = self._typeIds.get(id(mtype))
+        if typeId == None:
+            typeId = len(self.types)
+            self.types.append(mtype)
+            self._typeIds[id(mtype)] = typeId
+        return typeId
+
+    def numNodes(self) -> 'int':
+        return len(self.nodeParent)
+    def numWires(self) -> 'int':
+        ''' The number of Wires which have not been removed. '''
+        return len(self.wireSrc) - self.numWiresRemoved
+    def numComponents(self) -> 'int':
+        return len(self.componentParent)
+    @property
+    def root(self) -> 'ComponentView':
+        ''' The root of the component tree, which is the first Component added. '''
+        assert self.numComponents() > 0, "An empty netlist has no root"
+        return ComponentView(self, 0)
+
+    def addComponent(self, componentClass: 'type', name: 'str', parent: 'int' = -1) -> 'int':
+        ''' Adds a Component of the given hardware class as a child of parent (or as the root if parent is -1)
+        and returns its id. '''
+        component = len(self.componentParent)
+        assert (parent == -1) == (component == 0), "The first Component added is the root, and is the only Component without a parent"
+        self.componentClass.append(componentClassIds[componentClass])
+        self.componentName.append(self.atom(name))
+        self.componentParent.append(parent)
+        self.componentFirstChild.append(-1)
+        self.componentFirstPort.append(-1)
+        self.componentLastPort.append(-1)
+        self.componentPersistent.append(False)
+        if parent != -1:
+            self.componentNextSibling.append(self.componentFirstChild[parent])
+            self.componentFirstChild[parent] = component
+        else:
+            self.componentNextSibling.append(-1)
+        return component
+    def addNode(self, component: 'int', isInput: 'bool', label: 'Any', mtype: 'mtypes.MType' = mtypes.Any, name: 'str' = "") -> 'int':
+        ''' Adds a Node to the port table of component and returns its id. '''
+        node = len(self.nodeParent)
+        self.nodeParent.append(component)
+        self.nodeIsInput.append(isInput)
+        self.nodeLabel.append(self.atom(label))
+        self.nodeType.append(self.typeId(mtype))
+        self.nodeInWire.append(-1)
+        self.nodeFirstOut.append(-1)
+        self.nodeNextPort.append(-1)
+        if name != "":
+            self.nodeNames[node] = name
+        last = self.componentLastPort[component]
+        if last == -1:
+            self.componentFirstPort[component] = node
+        else:
+            self.nodeNextPort[last] = node
+        self.componentLastPort[component] = node
+        return node
+    def addWire(self, src: 'int', dst: 'int', mtype: 'mtypes.MType' = mtypes.Any) -> 'int':
+        ''' Adds a Wire from src to dst and returns its id. '''
+        assert self.nodeInWire[dst] == -1, "A Node can only be the dst of at most one Wire."
+        wire = len(self.wireSrc)
+        self.wireSrc.append(src)
+        self.wireDst.append(dst)
+        self.wireType.append(self.typeId(mtype))
+        self.wireNextOut.append(self.nodeFirstOut[src])
+        self.nodeFirstOut[src] = wire
+        self.nodeInWire[dst] = wire
+        return wire
+    def removeWire(self, wire: 'int'):
+        ''' Disconnects the Wire. Its id is not reused. '''
+        src, dst = self.wireSrc[wire], self.wireDst[wire]
+        assert src != -1, "Wire has already been removed"
+        previous, current = -1, self.nodeFirstOut[src]
+        while current != wire:
+            previous, current = current, self.wireNextOut[current]
+        if previous == -1:
+            self.nodeFirstOut[src] = self.wireNextOut[wire]
+        else:
+            self.wireNextOut[previous] = self.wireNextOut[wire]
+        self.nodeInWire[dst] = -1
+        self.wireSrc[wire] = self.wireDst[wire] = -1
+        self.numWiresRemoved += 1
+
+    def outWires(self, node: 'int') -> 'list[int]':
+        ''' The ids of the Wires with node as their src. '''
+        wires, wire, wireNextOut = [], self.nodeFirstOut[node], self.wireNextOut
+        while wire != -1:
+            wires.append(wire)
+            wire = wireNextOut[wire]
+        return wires
+    def children(self, component: 'int') -> 'list[int]':
+        ''' The ids of the children of component. '''
+        children, child, componentNextSibling = [], self.componentFirstChild[component], self.componentNextSibling
+        while child != -1:
+            children.append(child)
+            child = componentNextSibling[child]
+        return children
+    def ports(self, component: 'int') -> 'list[int]':
+        ''' The ids of the Nodes of component, in the order they were added. '''
+        ports, node, nodeNextPort = [], self.componentFirstPort[component], self.nodeNextPort
+        while node != -1:
+            ports.append(node)
+            node = nodeNextPort[node]
+        return ports
+    def liveWires(self) -> 'list[int]':
+        ''' The ids of the Wires which have not been removed. '''
+        return [wire for wire, src in enumerate(self.wireSrc) if src != -1]
+    def fanouts(self) -> 'list[int]':
+        ''' The number of Wires leaving each Node, indexed by node id. '''
+        if numpy != None:
+            src = numpy.frombuffer(self.wireSrc, dtype=numpy.int32)
+            return numpy.bincount(src[src != -1], minlength=self.numNodes()).tolist()
+        counts = [0] * self.numNodes()
+        for src in self.wireSrc:
+            if src != -1:
+                counts[src] += 1
+        return counts
+    def nbytes(self) -> 'int':
+        ''' The number of bytes used by the columns. '''
+        columns = [self.nodeParent, self.nodeIsInput, self.nodeLabel, self.nodeType, self.nodeInWire, self.nodeFirstOut, self.nodeNextPort,
+                   self.wireSrc, self.wireDst, self.wireType, self.wireNextOut,
+                   self.componentClass, self.componentName, self.componentParent, self.componentFirstChild, self.componentNextSibling,
+                   self.componentFirstPort, self.componentLastPort, self.componentPersistent]
+        return sum(column.itemsize * len(column) for column in columns)
+
+    @classmethod
+    def fromComponent(cls, root: 'hardware.Component') -> 'Netlist':
+        ''' Copies the hardware tree of root, and the Wires between its Nodes, into a new Netlist. '''
+        netlist = cls()
+        nodeIds: 'dict[int, int]' = {}  # maps id(Node) to its node id
+        componentIds: 'dict[int, int]' = {}  # maps id(Component) to its component id
+        nodes: 'list[hardware.Node]' = []
+        vectorModules: 'list[tuple[int, hardware.VectorModule]]' = []
+        stack: 'list[tuple[hardware.Component, int]]' = [(root, -1)]
+        while len(stack) > 0:
+            component, parent = stack.pop()
+            componentId = netlist.addComponent(component.__class__, component._name, parent)
+            componentIds[id(component)] = componentId
+            for ports, isInput in ((component._inputs, True), (component._outputs, False)):
+                for label, node in ports.items():
+                    nodeIds[id(node)] = netlist.addNode(componentId, isInput, label, node._mtype, node._name)
+                    nodes.append(node)
+            if component._persistent:
+                netlist.componentPersistent[componentId] = True
+            if len(component._tokensSourcedFrom) > 0:
+                netlist.componentTokens[componentId] = component.getSourceTokens()
+            data = componentData(component)
+            if len(data) > 0:
+                netlist.componentData[componentId] = data
+            if component.__class__ == hardware.VectorModule:
+                vectorModules.append((componentId, component))
+            stack.extend((child, componentId) for child in component._children)
+        for componentId, component in vectorModules:
+            netlist.componentData.setdefault(componentId, {})['numberedSubmodules'] = [componentIds[id(submodule)] for submodule in component.numberedSubmodules]
+        for node in nodes:
+            for wire in node._outWires:
+                if id(wire._dst) in nodeIds:  # wires leaving root are not copied
+                    wireId = netlist.addWire(nodeIds[id(node)], nodeIds[id(wire._dst)], wire._mtype)
+                    if len(wire._tokensSourcedFrom) > 0:
+                        netlist.wireTokens[wireId] = wire.getSourceTokens()
+        return netlist
+
+    def toComponent(self) -> 'hardware.Component':
+        ''' Builds the hardware tree described by the netlist in the current Design and returns its root. '''
+        nodes = [hardware.Node(self.nodeNames.get(node, ""), self.types[self.nodeType[node]]) for node in range(self.numNodes())]
+        components: 'list[hardware.Component]' = []
+        for component in range(self.numComponents()):
+            inputs, outputs = {}, {}
+            for node in self.ports(component):
+                (inputs if self.nodeIsInput[node] else outputs)[self.atoms[self.nodeLabel[node]]] = nodes[node]
+            componentClass = componentClasses[self.componentClass[component]]
+            hardwareComponent = componentClass.__new__(componentClass)
+            hardware.Component.__init__(hardwareComponent, self.atoms[self.componentName[component]], inputs, outputs, None, set())
+            for field, value in self.componentData.get(component, {}).items():
+                setattr(hardwareComponent, field, value.copy() if value.__class__ == list else value)
+            if componentClass == hardware.Mux:
+                hardwareComponent._control = inputs[-1]
+            hardwareComponent._persistent = bool(self.componentPersistent[component])
+            if component in self.componentTokens:
+                hardwareComponent.addSourceTokens(self.componentTokens[component].copy())
+            components.append(hardwareComponent)
+        for component, hardwareComponent in enumerate(components):
+            if component > 0:
+                components[self.componentParent[component]].addChild(hardwareComponent)
+            if hardwareComponent.__class__ == hardware.VectorModule:
+                hardwareComponent.numberedSubmodules = [components[submodule] for submodule in hardwareComponent.numberedSubmodules]
+        for wire, src in enumerate(self.wireSrc):
+            if src != -1:
+                hardwareWire = hardware.Wire(nodes[src], nodes[self.wireDst[wire]])
+                hardwareWire._mtype = self.types[self.wireType[wire]]
+                if wire in self.wireTokens:
+                    hardwareWire.addSourceTokens(self.wireTokens[wire].copy())
+        return components[0]
+
+def componentData(component: 'hardware.Component') -> 'dict[str, Any]':
+    ''' Returns the fields of component particular to its class, by slot name. The control of a Mux is its input
+    labelled -1 and the numbered submodules of a VectorModule refer to other Components, so both are handled by
+    the Netlist. '''
+    data = {}
+    for componentClass in component.__class__.__mro__:
+        if componentClass == hardware.Component:
+            break
+        slots = componentClass.__dict__.get('__slots__', ())
+        for field in ((slots,) if slots.__class__ == str else slots):
+            if field not in ('_control', 'numberedSubmodules') and hasattr(component, field):
+                value = getattr(component, field)
+                data[field] = value.copy() if value.__class__ == list else value
+    return data
+
+
+class NodeView:
+    ''' A view of a Node of a Netlist. '''
+    __slots__ = 'netlist', 'id'
+    def __init__(self, netlist: 'Netlist', id: 'int'):
+        self.netlist = netlist
+        self.id = id
+    def __eq__(self, other):
+        return other.__class__ == NodeView and self.id == other.id and self.netlist is other.netlist
+    def __hash__(self):
+        return self.id
+    def __repr__(self):
+        return "Node(" + str(self.id) + ": " + str(self.mtype) + ")"
+    def __str__(self):
+        return "Node(" + str(self.name) + ": " + str(self.mtype) + ")"
+    @property
+    def name(self) -> 'str':
+        return self.netlist.nodeNames.get(self.id, "")
+    @property
+    def mtype(self) -> 'mtypes.MType':
+        return self.netlist.types[self.netlist.nodeType[self.id]]
+    def setMType(self, value: 'mtypes.MType'):
+        self.netlist.nodeType[self.id] = self.netlist.typeId(value)
+    @property
+    def width(self) -> 'int|None':
+        ''' The number of bits of the Node, or None if its type has no packed width. '''
+        return self.mtype.packedWidth()
+    @property
+    def inWires(self) -> 'set[WireView]':
+        ''' The set of Wires with this Node as their dst. '''
+        wire = self.netlist.nodeInWire[self.id]
+        return set() if wire == -1 else {WireView(self.netlist, wire)}
+    @property
+    def outWires(self) -> 'set[WireView]':
+        ''' The set of Wires with this Node as their src. '''
+        return {WireView(self.netlist, wire) for wire in self.netlist.outWires(self.id)}
+    @property
+    def parent(self) -> 'ComponentView':
+        ''' The parent Component of the Node. '''
+        return ComponentView(self.netlist, self.netlist.nodeParent[self.id])
+    @property
+    def isInput(self) -> 'bool':
+        ''' True if the parent Component has this Node as an input, false otherwise. '''
+        return bool(self.netlist.nodeIsInput[self.id])
+    @property
+    def label(self) -> 'Any':
+        ''' The label of the Node in its parent Component. '''
+        return self.netlist.atoms[self.netlist.nodeLabel[self.id]]
+
+class WireView:
+    ''' A view of a Wire of a Netlist. '''
+    __slots__ = 'netlist', 'id'
+    def __init__(self, netlist: 'Netlist', id: 'int'):
+        self.netlist = netlist
+        self.id = id
+    def __eq__(self, other):
+        return other.__class__ == WireView and self.id == other.id and self.netlist is other.netlist
+    def __hash__(self):
+        return self.id
+    def __repr__(self):
+        return "Wire(" + self.src.__repr__() + ", " + self.dst.__repr__() + ")"
+    def __str__(self):
+        return "wire from " + str(self.src) + " to " + str(self.dst)
+    @property
+    def src(self) -> 'NodeView':
+        '''The source node of the wire'''
+        return NodeView(self.netlist, self.netlist.wireSrc[self.id])
+    @property
+    def dst(self) -> 'NodeView':
+        '''The destination node of the wire'''
+        return NodeView(self.netlist, self.netlist.wireDst[self.id])
+    @property
+    def mtype(self) -> 'mtypes.MType':
+        return self.netlist.types[self.netlist.wireType[self.id]]
+    @property
+    def width(self) -> 'int|None':
+        ''' The number of bits of the Wire, or None if its type has no packed width. '''
+        return self.mtype.packedWidth()
+    def getSourceTokens(self) -> 'list[tuple[str, int]]':
+        ''' Returns the source tokens of self, flattened '''
+        return self.netlist.wireTokens.get(self.id, []).copy()
+    def weight(self):
+        ''' Returns an estimate of how large a Component is. '''
+        return 1
+
+class ComponentView:
+    ''' A view of a Component of a Netlist, see the note above. '''
+    __slots__ = 'netlist', 'id'
+    def __init__(self, netlist: 'Netlist', id: 'int'):
+        self.netlist = netlist
+        self.id = id
+    def __eq__(self, other):
+        return other.__class__ == ComponentView and self.id == other.id and self.netlist is other.netlist
+    def __hash__(self):
+        return self.id
+    def __repr__(self):
+        return "Component(" + self.name + ", " + self.children.__repr__() + ", " + self.inputs.__repr__() + ", " + self.outputs.__repr__() + ")"
+    @property
+    def componentClass(self) -> 'type':
+        ''' The hardware class of the Component, eg hardware.Mux. '''
+        return componentClasses[self.netlist.componentClass[self.id]]
+    @property
+    def name(self) -> 'str':
+        ''' The name of the component, eg 'f' or 'combine#(1,1)' or '*'. '''
+        return self.netlist.atoms[self.netlist.componentName[self.id]]
+    @property
+    def children(self) -> 'set[ComponentView]':
+        ''' The child Components of the Component '''
+        return {ComponentView(self.netlist, child) for child in self.netlist.children(self.id)}
+    @property
+    def inputs(self) -> 'dict[Any, NodeView]':
+        ''' The input Nodes of the Component by label '''
+        netlist = self.netlist
+        return {netlist.atoms[netlist.nodeLabel[node]]: NodeView(netlist, node) for node in netlist.ports(self.id) if netlist.nodeIsInput[node]}
+    @property
+    def outputs(self) -> 'dict[Any, NodeView]':
+        ''' The output Nodes of the Component by label '''
+        netlist = self.netlist
+        return {netlist.atoms[netlist.nodeLabel[node]]: NodeView(netlist, node) for node in netlist.ports(self.id) if not netlist.nodeIsInput[node]}
+    @property
+    def output(self) -> 'NodeView':
+        ''' The output Node of the Component, if it is unique. '''
+        outputs = self.outputs
+        assert len(outputs) == 1, "Can only return output if it is unique"
+        return next(iter(outputs.values()))
+    @property
+    def control(self) -> 'NodeView':
+        '''The control input Node of a mux'''
+        assert self.componentClass == hardware.Mux, "Only a Mux has a control"
+        return self.inputs[-1]
+    @property
+    def value(self) -> 'mtypes.MLiteral':
+        '''The value of a constant'''
+        assert self.componentClass == hardware.Constant, "Only a Constant has a value"
+        return self.netlist.componentData[self.id]['_value']
+    @property
+    def parent(self) -> 'ComponentView|None':
+        ''' The parent of the component. '''
+        parent = self.netlist.componentParent[self.id]
+        return None if parent == -1 else ComponentView(self.netlist, parent)
+    def getSourceTokens(self) -> 'list[tuple[str, int]]':
+        ''' Returns the source tokens of self, flattened '''
+        return self.netlist.componentTokens.get(self.id, []).copy()
+    def getAllWires(self) -> 'set[WireView]':
+        ''' Returns the set of all wires in the subtree of the Component. '''
+        netlist = self.netlist
+        wires = set()
+        stack = [self.id]
+        while len(stack) > 0:
+            component = stack.pop()
+            for node in netlist.ports(component):
+                wires.update(WireView(netlist, wire) for wire in netlist.outWires(node))
+            stack.extend(netlist.children(component))
+        return wires
+    def weight(self):
+        ''' Returns an estimate of how large a Component is. '''
+        netlist = self.netlist
+        count = 0
+        stack = [self.id]
+        while len(stack) > 0:
+            count += 1
+            stack.extend(netlist.children(stack.pop()))
+        return count
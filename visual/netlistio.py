@@ -0,0 +1,336 @@
+import array
+import json
+import mmap
+import struct
+import sys
+import hardware
+import mtypes
+import netlist
+from typing import Any
+try:
+    import numpy  # optional, only needed for vector literals whose lanes are numpy arrays
+except ImportError:
+    numpy = None
+
+''' Binary netlist files.
+A netlist file holds a Netlist (see netlist.py), so a synthesized design can be saved once and loaded again for
+layout, diffing or analysis without parsing or elaborating the source again. The file is
+    header. The magic bytes b'MSNETLST' followed by the format version, the number of sections and the number of
+        removed Wires, as little-endian uint32s.
+    section table. For each section, its name (32 bytes of ascii, zero padded), offset and length in bytes, as
+        little-endian uint64s.
+    sections. Each section starts at a multiple of 8 bytes. The sections are
+        - one section per column of the Netlist (see columnNames), holding the column as little-endian int32s
+          or int8s, so it can be used in place,
+        - nodeName, a column holding the atom of the name of each Node or -1 if the Node has no name,
+        - tables, the atom table (names, labels and source file names) and the type table as utf-8 JSON,
+        - the source spans of Wires and Components: wireTokenStart and componentTokenStart are the start of the
+          tokens of each Wire/Component in tokenFile (the atom of the file name) and tokenIndex (the position
+          of the token in its file), with one extra entry for the end of the last one,
+        - the fields particular to the class of each Component (see netlist.componentData), as one utf-8 JSON
+          document per Component in componentDataBlob starting at the byte offsets in componentDataStart.
+Values in the JSON documents are encoded by encodeValue: strings, ints, bools and None are stored as they are,
+and lists, tuples, dicts, types and literals as single-key objects. A type is stored as its index in the type
+table. The type table starts with the type table of the Netlist (so the type ids in the columns stay the same)
+and holds each type as the arguments of the factory function (Bit, Vector, Maybe, Enum, Struct or Synonym) which
+created it, with the types among the arguments given by index.
+    load maps the file into memory by default. The columns are then memoryviews of the (copy-on-write) mapping
+instead of arrays, so loading does not read the columns and the pages of a column are only read when it is used.
+Names, source spans and component data are decoded when they are first looked up. A mapped Netlist can be read
+and changed in place (eg removeWire) but cannot grow; load it with useMmap=False to get an ordinary Netlist.
+    The version is incremented whenever the format changes, and load refuses files with a different version.
+'''
+
+magic = b'MSNETLST'
+version = 1
+headerFormat = '<8sIII'
+sectionFormat = '<32sQQ'
+
+columnNames: 'tuple[str, ...]' = ('nodeParent', 'nodeIsInput', 'nodeLabel', 'nodeType', 'nodeInWire', 'nodeFirstOut', 'nodeNextPort',
+                                  'wireSrc', 'wireDst', 'wireType', 'wireNextOut',
+                                  'componentClass', 'componentName', 'componentParent', 'componentFirstChild', 'componentNextSibling',
+                                  'componentFirstPort', 'componentLastPort', 'componentPersistent')
+
+assert array.array('i').itemsize == 4, "Netlist files store ids as 32-bit integers"
+
+def save(store: 'netlist.Netlist', path: 'str'):
+    ''' Writes store to the file at path. '''
+    with open(path, 'wb') as file:
+        file.write(dumps(store))
+
+def saveComponent(root: 'hardware.Component', path: 'str'):
+    ''' Writes the hardware tree of root to the file at path. '''
+    save(netlist.Netlist.fromComponent(root), path)
+
+def dumps(store: 'netlist.Netlist') -> 'bytes':
+    ''' Returns the contents of a netlist file holding store. '''
+    atoms = TableWriter(store)
+    sections: 'list[tuple[str, bytes]]' = [(name, columnBytes(getattr(store, name))) for name in columnNames]
+    nodeName = array.array('i', [-1]) * store.numNodes()
+    for node, name in store.nodeNames.items():
+        nodeName[node] = atoms.atom(name)
+    sections.append(('nodeName', columnBytes(nodeName)))
+    for owner, tokens, count in (('wire', store.wireTokens, len(store.wireSrc)), ('component', store.componentTokens, store.numComponents())):
+        tokenStart, tokenFile, tokenIndex = array.array('i'), array.array('i'), array.array('i')
+        for item in range(count):
+            tokenStart.append(len(tokenFile))
+            for filename, index in tokens.get(item, []):
+                tokenFile.append(atoms.atom(filename))
+                tokenIndex.append(index)
+        tokenStart.append(len(tokenFile))
+        sections += [(owner + 'TokenStart', columnBytes(tokenStart)), (owner + 'TokenFile', columnBytes(tokenFile)), (owner + 'TokenIndex', columnBytes(tokenIndex))]
+    dataStart, dataBlob = array.array('i'), bytearray()
+    for component in range(store.numComponents()):
+        dataStart.append(len(dataBlob))
+        if component in store.componentData:
+            dataBlob += json.dumps(atoms.encodeValue(store.componentData[component]), separators=(',', ':')).encode()
+    dataStart.append(len(dataBlob))
+    sections += [('componentDataStart', columnBytes(dataStart)), ('componentDataBlob', bytes(dataBlob))]
+    # the tables are written last, since encoding the other sections adds to them
+    tables = {'atoms': [atoms.encodeValue(atom) for atom in atoms.atoms], 'types': atoms.types}
+    sections.append(('tables', json.dumps(tables, separators=(',', ':')).encode()))
+
+    headerSize = struct.calcsize(headerFormat) + len(sections) * struct.calcsize(sectionFormat)
+    offsets, offset = [], align(headerSize)
+    for name, data in sections:
+        offsets.append(offset)
+        offset = align(offset + len(data))
+    output = bytearray(offset)
+    struct.pack_into(headerFormat, output, 0, magic, version, len(sections), store.numWiresRemoved)
+    for i, (name, data) in enumerate(sections):
+        struct.pack_into(sectionFormat, output, struct.calcsize(headerFormat) + i * struct.calcsize(sectionFormat), name.encode('ascii'), offsets[i], len(data))
+        output[offsets[i]:offsets[i] + len(data)] = data
+    return bytes(output)
+
+def align(offset: 'int') -> 'int':
+    ''' Rounds offset up to a multiple of 8. '''
+    return (offset + 7) & ~7
+
+def columnBytes(column: 'array.array|memoryview') -> 'bytes':
+    ''' The contents of column as little-endian bytes. '''
+    if sys.byteorder == 'little':
+        return column.tobytes()
+    column = array.array(column.typecode if column.__class__ == array.array else column.format, column)
+    column.byteswap()
+    return column.tobytes()
+
+class TableWriter:
+    ''' Collects the atom and type tables of a netlist file. The atom table starts as the atom table of the Netlist,
+    so the atom ids in the columns stay the same. '''
+    __slots__ = 'atoms', 'atomIds', 'types', 'typeIds'
+    def __init__(self, store: 'netlist.Netlist'):
+        self.atoms: 'list[Any]' = list(store.atoms)
+        self.atomIds: 'dict[tuple[type, Any], int]' = {}
+        for atomId, atom in enumerate(self.atoms):
+            self.atomIds.setdefault((atom.__class__, atom), atomId)
+        self.types: 'list[list]' = [None] * len(store.types)
+        self.typeIds: 'dict[int, int]' = {id(mtype): typeId for typeId, mtype in enumerate(store.types)}  # keyed by id(type), as in Netlist
+        for typeId, mtype in enumerate(store.types):
+            self.types[typeId] = self.describeType(mtype)
+    def atom(self, value: 'Any') -> 'int':
+        ''' Returns the index of value in the atom table, adding it if needed. '''
+        key = (value.__class__, value)
+        if key not in self.atomIds:
+            self.atomIds[key] = len(self.atoms)
+            self.atoms.append(value)
+        return self.atomIds[key]
+    def typeId(self, mtype: 'mtypes.MType') -> 'int':
+        ''' Returns the index of mtype in the type table, adding it (and the types it is built from) if needed. '''
+        if id(mtype) in self.typeIds:
+            return self.typeIds[id(mtype)]
+        typeId = self.typeIds[id(mtype)] = len(self.types)
+        self.types.append(None)
+        self.types[typeId] = self.describeType(mtype)
+        return typeId
+    def describeType(self, mtype: 'mtypes.MType') -> 'list':
+        ''' Returns the entry of mtype in the type table. '''
+        constructor = mtype._constructor
+        if constructor == mtypes.Synonym:
+            entry = ['Synonym', self.typeId(mtype.__bases__[0]), mtype._name]
+        elif constructor == mtypes.Bit:
+            entry = ['Bit', mtype.width]
+        elif constructor == mtypes.Vector:
+            k = mtype._k
+            entry = ['Vector', k.value if k.__class__ == mtypes.IntegerLiteral else k, k.__class__ == mtypes.IntegerLiteral, self.typeId(mtype._typeValue)]
+        elif constructor == mtypes.Maybe:
+            entry = ['Maybe', self.typeId(mtype._mtype)]
+        elif constructor == mtypes.Enum:
+            entry = ['Enum', mtype._name, list(mtype._encoding.items())]
+        elif constructor == mtypes.Struct:
+            entry = ['Struct', mtype._name, [[field, self.typeId(fieldType)] for field, fieldType in mtype._fields.items()]]
+        elif constructor == None and getattr(mtypes, mtype.__name__, None) is mtype:
+            entry = ['Builtin', mtype.__name__]  # eg Any, Integer or Bool
+        else:
+            raise Exception(f"Can't save the type {mtype}, which is not created by a type factory")
+        return entry
+    def encodeValue(self, value: 'Any') -> 'Any':
+        ''' Returns value in a form which json can encode. See the note above. '''
+        if value.__class__ in (type(None), bool, int, str, float):
+            return value
+        if value.__class__ == list:
+            return {'list': [self.encodeValue(item) for item in value]}
+        if value.__class__ == tuple:
+            return {'tuple': [self.encodeValue(item) for item in value]}
+        if value.__class__ == dict:
+            return {'dict': [[self.encodeValue(key), self.encodeValue(item)] for key, item in value.items()]}
+        if value.__class__ == mtypes.MType:
+            return {'type': self.typeId(value)}
+        if value.__class__.__class__ == mtypes.MType:
+            return {'literal': self.typeId(value.__class__), 'fields': self.encodeValue(literalFields(value))}
+        if numpy != None and value.__class__ == numpy.ndarray:
+            return {'ndarray': value.tolist(), 'dtype': str(value.dtype)}
+        raise Exception(f"Can't save the value {value} of class {value.__class__} (synthesize with detach=True to drop elaboration state)")
+
+def literalFields(literal: 'mtypes.MLiteral') -> 'dict[str, Any]':
+    ''' The fields of literal, from its slots and its __dict__. '''
+    fields = {}
+    for literalClass in literal.__class__.__mro__:
+        slots = literalClass.__dict__.get('__slots__', ())
+        for field in ((slots,) if slots.__class__ == str else slots):
+            if hasattr(literal, field):
+                fields[field] = getattr(literal, field)
+    fields.update(getattr(literal, '__dict__', {}))
+    return fields
+
+
+def load(path: 'str', useMmap: 'bool' = True) -> 'netlist.Netlist':
+    ''' Reads the netlist file at path. See the note above for the difference useMmap makes. '''
+    with open(path, 'rb') as file:
+        if useMmap and sys.byteorder == 'little':
+            return loads(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY))
+        return loads(file.read(), copy=True)
+
+def loads(data: 'bytes|bytearray|mmap.mmap', copy: 'bool' = False) -> 'netlist.Netlist':
+    ''' Returns the Netlist held in data, the contents of a netlist file. If copy is false, the columns are views
+    of data, which must be writable for the Netlist to be changed. '''
+    fileMagic, fileVersion, numSections, numWiresRemoved = struct.unpack_from(headerFormat, data, 0)
+    assert fileMagic == magic, "Not a netlist file"
+    if fileVersion != version:
+        raise Exception(f"Can't load a version {fileVersion} netlist file, expected version {version}")
+    buffer = memoryview(data)
+    sections: 'dict[str, memoryview]' = {}
+    for i in range(numSections):
+        name, offset, length = struct.unpack_from(sectionFormat, data, struct.calcsize(headerFormat) + i * struct.calcsize(sectionFormat))
+        sections[name.rstrip(b'\0').decode('ascii')] = buffer[offset:offset + length]
+    def column(name: 'str', typecode: 'str') -> 'array.array|memoryview':
+        if copy or sys.byteorder != 'little':
+            values = array.array(typecode, sections[name].tobytes())
+            if sys.byteorder != 'little':
+                values.byteswap()
+            return values
+        return sections[name].cast(typecode)
+
+    store = netlist.Netlist()
+    for name in columnNames:
+        setattr(store, name, column(name, getattr(store, name).typecode))
+    store.numWiresRemoved = numWiresRemoved
+    tables = json.loads(sections['tables'].tobytes())
+    reader = TableReader(tables['types'])
+    store.atoms = [reader.decodeValue(atom) for atom in tables['atoms']]
+    for atomId, atom in enumerate(store.atoms):
+        store._atomIds.setdefault((atom.__class__, atom), atomId)
+    store.types = reader.types
+    for typeId, mtype in enumerate(store.types):
+        store._typeIds.setdefault(id(mtype), typeId)
+    nodeName = column('nodeName', 'i')
+    store.nodeNames = LazyTable(len(nodeName), lambda node: nodeName[node] != -1, lambda node: store.atoms[nodeName[node]])
+    for owner, count in (('wire', len(store.wireSrc)), ('component', store.numComponents())):
+        tokenStart, tokenFile, tokenIndex = column(owner + 'TokenStart', 'i'), column(owner + 'TokenFile', 'i'), column(owner + 'TokenIndex', 'i')
+        def hasTokens(item: 'int', tokenStart=tokenStart) -> 'bool':
+            return tokenStart[item] != tokenStart[item + 1]
+        def getTokens(item: 'int', tokenStart=tokenStart, tokenFile=tokenFile, tokenIndex=tokenIndex) -> 'list[tuple[str, int]]':
+            return [(store.atoms[tokenFile[i]], tokenIndex[i]) for i in range(tokenStart[item], tokenStart[item + 1])]
+        setattr(store, owner + 'Tokens', LazyTable(count, hasTokens, getTokens))
+    dataStart, dataBlob = column('componentDataStart', 'i'), sections['componentDataBlob']
+    def hasData(component: 'int') -> 'bool':
+        return dataStart[component] != dataStart[component + 1]
+    def getData(component: 'int') -> 'dict[str, Any]':
+        return reader.decodeValue(json.loads(dataBlob[dataStart[component]:dataStart[component + 1]].tobytes()))
+    store.componentData = LazyTable(store.numComponents(), hasData, getData)
+    return store
+
+class TableReader:
+    ''' Rebuilds the type table of a netlist file and decodes values. '''
+    __slots__ = 'entries', 'types'
+    def __init__(self, entries: 'list[list]'):
+        self.entries = entries
+        self.types: 'list[mtypes.MType]' = [None] * len(entries)
+        for typeId in range(len(entries)):
+            self.getType(typeId)
+    def getType(self, typeId: 'int') -> 'mtypes.MType':
+        ''' Returns the type with the given index, creating it (and the types it is built from) if needed. '''
+        if self.types[typeId] != None:
+            return self.types[typeId]
+        entry = self.entries[typeId]
+        kind = entry[0]
+        if kind == 'Synonym':
+            mtype = mtypes.Synonym(self.getType(entry[1]), entry[2])
+        elif kind == 'Bit':
+            mtype = mtypes.Bit(mtypes.IntegerLiteral(entry[1]))
+        elif kind == 'Vector':
+            mtype = mtypes.Vector(mtypes.IntegerLiteral(entry[1]) if entry[2] else entry[1], self.getType(entry[3]))
+        elif kind == 'Maybe':
+            mtype = mtypes.Maybe(self.getType(entry[1]))
+        elif kind == 'Enum':
+            encoding = dict(entry[2])
+            mtype = mtypes.Enum(entry[1], list(encoding), encoding)
+        elif kind == 'Struct':
+            mtype = mtypes.Struct(entry[1], {field: self.getType(fieldType) for field, fieldType in entry[2]})
+        elif kind == 'Builtin':
+            mtype = getattr(mtypes, entry[1])
+        else:
+            raise Exception(f"Unknown type {entry} in netlist file")
+        self.types[typeId] = mtype
+        return mtype
+    def decodeValue(self, value: 'Any') -> 'Any':
+        ''' The inverse of TableWriter.encodeValue. '''
+        if value.__class__ != dict:
+            return value
+        if 'list' in value:
+            return [self.decodeValue(item) for item in value['list']]
+        if 'tuple' in value:
+            return tuple(self.decodeValue(item) for item in value['tuple'])
+        if 'dict' in value:
+            return {self.decodeValue(key): self.decodeValue(item) for key, item in value['dict']}
+        if 'type' in value:
+            return self.types[value['type']]
+        if 'literal' in value:
+            literalClass = self.types[value['literal']]
+            literal = literalClass.__new__(literalClass)
+            for field, fieldValue in self.decodeValue(value['fields']).items():
+                setattr(literal, field, fieldValue)
+            return literal
+        if 'ndarray' in value:
+            if numpy == None:
+                return value['ndarray']
+            return numpy.array(value['ndarray'], dtype=value['dtype'])
+        raise Exception(f"Unknown value {value} in netlist file")
+
+class LazyTable:
+    ''' A read-only dict from ids in range(size) to values which are decoded on first access. contains(id) is true
+    if id has a value and get(id) decodes it. Replaces the dicts of a Netlist (nodeNames, wireTokens, ...) in a
+    loaded Netlist. '''
+    __slots__ = 'size', 'contains', 'decode', 'cache'
+    def __init__(self, size: 'int', contains: 'Callable[[int], bool]', decode: 'Callable[[int], Any]'):
+        self.size = size
+        self.contains = contains
+        self.decode = decode
+        self.cache: 'dict[int, Any]' = {}
+    def __contains__(self, key: 'int') -> 'bool':
+        return key.__class__ == int and 0 <= key < self.size and self.contains(key)
+    def __getitem__(self, key: 'int') -> 'Any':
+        if key not in self.cache:
+            if key not in self:
+                raise KeyError(key)
+            self.cache[key] = self.decode(key)
+        return self.cache[key]
+    def get(self, key: 'int', default: 'Any' = None) -> 'Any':
+        return self[key] if key in self else default
+    def keys(self) -> 'list[int]':
+        return [key for key in range(self.size) if self.contains(key)]
+    def __iter__(self):
+        return iter(self.keys())
+    def __len__(self) -> 'int':
+        return len(self.keys())
+    def items(self) -> 'list[tuple[int, Any]]':
+        return [(key, self[key]) for key in self.keys()]
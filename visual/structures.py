@@ -0,0 +1,139 @@
+import hardware
+import mtypes
+
+''' Gate-level structures.
+The estimators in timing.py and area.py both need to know what each leaf of a design would be built from. structureOf
+maps each leaf Component (a Function op, Mux, Inserter, Register or Constant) to a Structure at the width of its
+ports, and the estimators cost the same Structure: area.py adds up the area of every gate, and timing.py adds up the
+delays of the gates on the critical path through it.
+    - Adders and comparators are parallel-prefix circuits, multipliers are Wallace trees of full adders, division
+      is restoring division, shifters are barrel shifters and selects are trees of 2-input muxes.
+    - The select lines of muxes fan out to every bit, through a tree of BUFs which only the delay counts.
+    - Constants, concatenations, constant slices, fields, extensions and other builtins take no gates.
+Gates missing from a library are built from the cells in composedCells, eg AND2 is NAND2 and INV in basic.lib; each
+entry gives the parts (for the area) and the gates on the critical path through them (for the delay).
+'''
+
+class Structure:
+    ''' The gates of a leaf: gates counts the gates of each kind, path counts the gates of each kind on its
+    critical path, and loads is the number of gate inputs driven by its select lines (0 if it has none). '''
+    __slots__ = 'gates', 'path', 'loads'
+    def __init__(self, gates: 'dict[str, float]|None' = None, path: 'dict[str, float]|None' = None, loads: 'int' = 0):
+        self.gates: 'dict[str, float]' = {gate: count for gate, count in (gates or {}).items() if count > 0}
+        self.path: 'dict[str, float]' = {gate: count for gate, count in (path or {}).items() if count > 0}
+        self.loads: 'int' = loads
+    def __repr__(self):
+        return f"Structure({self.gates}, path {self.path}, {self.loads} loads)"
+    def then(self, other: 'Structure') -> 'Structure':
+        ''' self followed by other: the gates of both, with the path of other after the path of self. '''
+        return Structure(add(self.gates, other.gates), add(self.path, other.path), max(self.loads, other.loads))
+    def repeated(self, times: 'int') -> 'Structure':
+        ''' times copies of self, one after the other. '''
+        return Structure(scale(self.gates, times), scale(self.path, times), self.loads)
+
+composedCells = [
+    ('AND2', {'NAND2': 1, 'INV': 1}, ['NAND2', 'INV']),
+    ('OR2', {'NOR2': 1, 'INV': 1}, ['NOR2', 'INV']),
+    ('XOR2', {'NAND2': 4}, ['NAND2', 'NAND2', 'NAND2']),
+    ('XNOR2', {'XOR2': 1, 'INV': 1}, ['XOR2', 'INV']),
+    ('AO21', {'NAND2': 2, 'INV': 1}, ['NAND2', 'NAND2']),  # a carry merge, g | p & g', the INV is beside the first NAND2
+    ('MUX2', {'NAND2': 3, 'INV': 1}, ['INV', 'NAND2', 'NAND2']),
+    ('FA', {'XOR2': 2, 'NAND2': 3, 'INV': 1}, ['XOR2', 'XOR2']),  # a full adder, sum and majority
+]
+
+def structureOf(component: 'hardware.Component') -> 'Structure':
+    ''' The gates which component is built from, see the note above. Run setWireTypes and inferWidths first, so
+    that widths are known. '''
+    if component.__class__ == hardware.Register:
+        return Structure({'DFF': portWidth(component._inputs['_input'])})  # timed by its clock-to-q and setup
+    width = max((portWidth(node) for node in list(component._inputs.values()) + list(component._outputs.values())), default=1)
+    if component.__class__ == hardware.Mux:
+        return muxTree(len(component._inputs) - 1, width)
+    if component.__class__ == hardware.Inserter:
+        selectors = len(component._inputs) - (1 if component.withValue else 0) - 1
+        if selectors == 0:
+            return Structure()  # writes a constant part of the value
+        return Structure({'AND2': width}, {'AND2': levels(width)}).then(muxTree(2, width))
+    if component.__class__ != hardware.Function or len(component._children) > 0:
+        return Structure()
+    name, numInputs = component._name, len(component._inputs)
+    if numInputs == 1 and name in hardware.reductionOperators and name != '~':
+        if name == '!':
+            return gate('INV', 1)
+        inputWidth = portWidth(component._inputs[0])
+        reduction = {'&': 'AND2', '~&': 'AND2', '|': 'OR2', '~|': 'OR2'}.get(name, 'XOR2')
+        tree = Structure({reduction: inputWidth - 1}, {reduction: levels(inputWidth)})
+        return tree.then(gate('INV', 1)) if name.startswith('~') or name == '^~' else tree
+    if numInputs == 1 and name in ('~', '-', '+'):
+        return {'~': gate('INV', width), '-': gate('INV', width).then(adder(width)), '+': Structure()}[name]
+    if name in ('&&', '||'):
+        return gate('AND2' if name == '&&' else 'OR2', 1)
+    if name in ('&', '|', '^', '^~', '~^'):
+        return gate({'&': 'AND2', '|': 'OR2', '^': 'XOR2'}.get(name, 'XNOR2'), width)
+    if name in ('+', '-'):
+        return adder(width)
+    if name in mtypes.relational_binary:
+        return comparator(width)
+    if name in mtypes.equality_binary:
+        return gate('XOR2', width).then(Structure({'OR2': width - 1}, {'OR2': levels(width)})).then(gate('INV', 1))
+    if name in ('*', '**'):
+        return Structure({'AND2': width * width, 'FA': max(width * width - 2 * width, 0)}, {'AND2': 1, 'FA': wallaceLevels(width)}).then(adder(2 * width))
+    if name in ('/', '%'):
+        return adder(width).then(muxTree(2, width)).repeated(width)  # restoring division, a subtraction per bit
+    if name in ('<<', '>>'):
+        return muxTree(2, width).repeated(levels(width))
+    if name.startswith('[') and '_' in name:
+        # a variable index or slice selects among the positions of the output in the input
+        inputWidth, outputWidth = portWidth(component._inputs[0]), portWidth(component._outputs[0])
+        return muxTree(max(inputWidth // outputWidth, 1), outputWidth)
+    builtinName = component.builtin.name if component.builtin != None else None
+    if builtinName in ('min', 'max'):
+        return comparator(width).then(muxTree(2, width))
+    if builtinName == 'fromMaybe':
+        return muxTree(2, width)
+    if builtinName == 'countOnes':
+        inputWidth = portWidth(component._inputs[0])
+        return Structure({'FA': inputWidth}, {'FA': levels(inputWidth)})
+    return Structure()  # wiring, or an unknown function
+
+def gate(name: 'str', count: 'int') -> 'Structure':
+    ''' count gates side by side. '''
+    return Structure({name: count}, {name: 1})
+
+def muxTree(inputs: 'int', width: 'int') -> 'Structure':
+    ''' A tree of MUX2s selecting one of inputs values of width bits. '''
+    return Structure({'MUX2': width * (inputs - 1)}, {'MUX2': levels(inputs)}, width if inputs > 1 else 0)
+
+def adder(width: 'int') -> 'Structure':
+    ''' A parallel-prefix adder: propagate and sum per bit and width/2 carry merges per level. '''
+    return Structure({'XOR2': 2 * width, 'AND2': width, 'AO21': (width // 2) * levels(width)}, {'XOR2': 2, 'AO21': levels(width)})
+
+def comparator(width: 'int') -> 'Structure':
+    ''' A parallel-prefix comparator, the carry out of a subtraction. '''
+    return Structure({'INV': width, 'AO21': width - 1}, {'INV': 1, 'AO21': levels(width)})
+
+def add(first: 'dict[str, float]', second: 'dict[str, float]') -> 'dict[str, float]':
+    total = first.copy()
+    for name, count in second.items():
+        total[name] = total.get(name, 0) + count
+    return total
+
+def scale(counts: 'dict[str, float]', factor: 'float') -> 'dict[str, float]':
+    return {name: count * factor for name, count in counts.items()}
+
+def levels(n: 'int') -> 'int':
+    ''' The depth of a binary tree with n leaves. '''
+    return (n - 1).bit_length() if n > 1 else 0
+
+def wallaceLevels(width: 'int') -> 'int':
+    ''' The number of full adder levels which reduce width partial products to two. '''
+    count = 0
+    while width > 2:
+        width -= width // 3
+        count += 1
+    return count
+
+def portWidth(node: 'hardware.Node') -> 'int':
+    ''' The width of node, or 1 if it is not known. Run setWireTypes and inferWidths first. '''
+    width = node._mtype.packedWidth()
+    return width if width != None and width > 0 else 1
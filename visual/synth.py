@@ -1,4 +1,6 @@
 import inspect
+import time
+import types
 
 import antlr4
 import build.MinispecPythonParser
@@ -10,8 +12,6 @@ import hardware
 import mtypes
 from typing import Any
 
-folding_constants_through_function_defs = False
-
 #sets up parser for use in debugging:
 #now ctx.toStringTree(recog=parser) will work properly.
 data = antlr4.InputStream("")
@@ -32,6 +32,38 @@ def getLineNumber(ctx) -> int:
     start, stop  = ctx.start.start, ctx.stop.stop
     return ctx.start.line
 
+def parseIntLiteral(text: 'str') -> 'mtypes.MLiteral':
+    ''' Parses the text of an integer literal, which may be either an integer or a bit value. '''
+    if text[0] == "'":
+        # unsized literal, integer type
+        # must check for hex values first since b and d are legitimate hex digits
+        if 'h' in text: #hex value
+            i = mtypes.IntegerLiteral(int("0x"+text[2:], 0))
+        elif 'b' in text: #binary
+            i = mtypes.IntegerLiteral(int("0b"+text[2:], 0))
+        elif 'd' in text: #decimal value
+            i = mtypes.IntegerLiteral(int(text[2:]))
+        else:
+            raise Exception("Error: literal missing base indicator.")
+    # must check for hex values first since b and d are legitimate hex digits
+    elif 'h' in text: #hex value
+        # TODO test this branch
+        width, binValue = text.split("'h")
+        assert len(width) > 0 and len(binValue) > 0, f"something went wrong with parsing {text} into width {width} and value {binValue}"
+        i = mtypes.Bit(mtypes.IntegerLiteral(int(width)))(int("0x"+binValue, 0))
+    elif 'b' in text: #binary
+        width, binValue = text.split("'b")
+        assert len(width) > 0 and len(binValue) > 0, f"something went wrong with parsing {text} into width {width} and value {binValue}"
+        i = mtypes.Bit(mtypes.IntegerLiteral(int(width)))(int("0b"+binValue, 0))
+    elif 'd' in text: #decimal value
+        width, decValue = text.split("'d")
+        assert len(width) > 0 and len(decValue) > 0, f"something went wrong with parsing {text} into width {width} and value {decValue}"
+        i = mtypes.Bit(mtypes.IntegerLiteral(int(width)))(int(decValue))
+    else:
+        # else we have an ordinary decimal integer
+        i = mtypes.IntegerLiteral(int(text))
+    return i
+
 def decorateForErrorCatching(func):
     ''' Given a function func(self, ctx, ...), returns the function with a wrapper
     that catches errors, prints the text corresponding to ctx, and rethrows
@@ -120,7 +152,7 @@ Overall data structures:
   |             |       |
   |             |    currentScope (the scope currently of interest)
   |           allScopes
-  |           (list of all scope objects, useful for debugging)
+  |           (list of all scope objects, useful for debugging. Only kept when the globalsHandler is in debug mode.)
   |
 globalsHandler:
         currentComponent: the function/module component currently being synthesized.
@@ -153,7 +185,7 @@ various function/module scopes
 StaticTypeListener:
   This listener detects scope information and static declarations.
   - For each function/module/file with its own scope, a scope object is created.
-    This scope object is logged in parsedCode's allScopes list, is given parent pointer
+    This scope object is logged in parsedCode's allScopes list (in debug mode), is given parent pointer
     equal to the current scope, becomes the current scope (since the walker is about to bring
     the listener inside the function), and then is attached to the corresponding function/module
     def node under ".scope".
@@ -221,7 +253,9 @@ class MValue:
     May be a Node, an MLiteral, a Register, a PartiallyIndexedModule, an antlr ctx object, etc.
     TODO make a full list of variants '''
     __slots__ = '_value', '_tokensSourcedFrom'
-    def __init__(self, value: 'Any', tokensSourcedFrom: 'list[list[tuple[str, int]]]' = []):
+    def __init__(self, value: 'Any', tokensSourcedFrom: 'list[list[tuple[str, int]]]' = [], checkedTokens: 'int' = 0):
+        ''' The first checkedTokens lists of tokensSourcedFrom come from another MValue and are not checked again,
+        so that adding sources to a value with a long history (such as a loop variable) does not recheck all of it. '''
         assert value.__class__ != MValue, "Cannot have an MValue inside of an MValue"
         assert (
             value.__class__ == mtypes.MType
@@ -237,7 +271,8 @@ class MValue:
             or value.__class__ in ctx_with_value
         ), f"Unexpected value class {value.__class__}"
         self._value: 'Any' = value
-        for tokens in tokensSourcedFrom:
+        for i in range(checkedTokens, len(tokensSourcedFrom)):
+            tokens = tokensSourcedFrom[i]
             assert tokens.__class__ == list, f"unexpected token class {tokens.__class__}"
             assert all( place.__class__ == tuple for place in tokens ), f"unexpected classes of entries in tokens {[place.__class__ for place in tokens if place.__class__ != tuple]}"
         self._tokensSourcedFrom: 'list[list[tuple[str, int]]]' = tokensSourcedFrom
@@ -254,16 +289,35 @@ class MValue:
         raise Exception('Not mutable')
     def withSourceTokens(self, tokens: 'list[tuple[str, int]]'):
         ''' Returns an MValue with tokens added to its source. '''
-        return MValue(self.value, self._tokensSourcedFrom + [tokens])
+        return MValue(self.value, self._tokensSourcedFrom + [tokens], len(self._tokensSourcedFrom))
     def appendSourceTokens(self, mvalue: 'MValue'):
         ''' Returns an MValue with the source tokens of self appended to the source tokens of mvalue. '''
         assert mvalue.__class__ == MValue, f"Expected MValue, not {mvalue.__class__}"
-        return MValue(self.value, self._tokensSourcedFrom + mvalue._tokensSourcedFrom)
+        return MValue(self.value, self._tokensSourcedFrom + mvalue._tokensSourcedFrom, len(self._tokensSourcedFrom) + len(mvalue._tokensSourcedFrom))
+    def mergeSourceTokens(self, tokensSourcedFrom: 'list[list[tuple[str, int]]]') -> 'MValue':
+        ''' Returns an MValue with the token lists of tokensSourcedFrom which self does not already have added to
+        its source. Used for values which gather sources one write at a time, such as a vector literal assigned
+        element by element, so that the sources grow with the distinct tokens rather than with the writes. '''
+        seen = {tuple(tokens) for tokens in self._tokensSourcedFrom}
+        merged = self._tokensSourcedFrom.copy()
+        for tokens in tokensSourcedFrom:
+            key = tuple(tokens)
+            if key not in seen:
+                seen.add(key)
+                merged.append(tokens)
+        return MValue(self.value, merged, len(self._tokensSourcedFrom))
     def getSourceTokens(self) -> 'list[tuple[str, int]]':
         ''' Returns the source tokens of self, flattened. '''
         return sum(self._tokensSourcedFrom, [])
     def isLiteralValue(self):
         return mtypes.isMLiteral(self.value)
+    def resolveUnknownToNode(self, visitor: 'SynthesizerVisitor') -> 'MValue':
+        ''' Returns self, converted to hardware if self is a literal with unknown bits. Used for conditions and
+        case selectors, which can only be evaluated if they are known: two uses of the same don't-care value
+        must make the same choice, so the choice is left to the hardware. '''
+        if self.isLiteralValue() and not mtypes.isKnownLiteral(self.value):
+            return self.resolveToNode(visitor)
+        return self
     def getHardware(self, globalsHandler) -> 'hardware.Node':
         assert globalsHandler.isGlobalsHandler(), "Quick type check"
         assert self.isLiteralValue(), "Can only convert literal value to hardware"
@@ -329,17 +383,17 @@ class Scope:
         variable names map to nodes with the correct value.
     permanentValues are for static information, while temporaryValues are for information during synthesis.
 
-    If fleeting, then the scope does not pass local assignments up the scope chain.
+    The branches of if/case statements, which do not pass local assignments up the scope chain, use FleetingScope.
     '''
-    def __init__(self, globalsHandler: 'GlobalsHandler', name: 'str', parents: 'list[Scope]', fleeting: 'bool' = False):
+    def __init__(self, globalsHandler: 'GlobalsHandler', name: 'str', parents: 'list[Scope]'):
         self.globalsHandler = globalsHandler
-        self.globalsHandler.allScopes.append(self)
+        if globalsHandler.debug:
+            globalsHandler.allScopes.append(self)
         self.parents = parents.copy()
         self.name = name
         self.permanentValues = {}
         self.temporaryScope = TemporaryScope()
         self.temporaryScopeStack = [] # stores old temporary scopes (but not the current self.temporaryScope)
-        self.fleeting = fleeting
     def popTemporaryScope(self):
         ''' Restores the previous temporary scope. Discards the current temporary scope. '''
         self.temporaryScope = self.temporaryScopeStack.pop()
@@ -404,14 +458,11 @@ class Scope:
         Used for assigning variables to nodes, typically with no paramters.
         Currently ignores parameters.'''
         assert value.__class__ == MValue, f"Values must be MValue, not {value.__class__}"
-        if self.fleeting:
+        if varName in self.permanentValues:
             self.temporaryScope.temporaryValues[varName] = value
         else:
-            if varName in self.permanentValues:
-                self.temporaryScope.temporaryValues[varName] = value
-            else:
-                assert len(self.parents) == 1, f"Can't assign variable {varName} dynamically in a file scope"
-                self.parents[0].set(value, varName)
+            assert len(self.parents) == 1, f"Can't assign variable {varName} dynamically in a file scope"
+            self.parents[0].set(value, varName)
     def setPermanent(self, value: 'MValue|None', varName: 'str', parameters: 'list[ctxType|str]' = None):
         '''Sets the given name/parameters to the given value in permanent storage.
         Overrules but does not overwrite previous values with the same name.
@@ -426,9 +477,48 @@ class Scope:
         if varName not in self.permanentValues:
             self.permanentValues[varName] = []
         self.permanentValues[varName].append((parameters, value))
+    def declare(self, varName: 'str'):
+        '''Declares the given variable (with no parameters) in permanent storage, if it is not already declared.
+        Used during synthesis, where the same scope is entered once per call/instantiation, so that
+        repeated declarations do not grow permanentValues.'''
+        if varName not in self.permanentValues:
+            self.permanentValues[varName] = [([], None)]
+        elif ([], None) not in self.permanentValues[varName]:
+            self.permanentValues[varName].append(([], None))
     '''Note: we probably need a helper function to detect when given parameters match
     a list[int|str] description.'''
 
+class FleetingScope:
+    ''' A lightweight scope for one branch of an if/case statement.
+    Holds only temporary values; lookups which miss fall through to the single parent scope.
+    Local assignments are not passed up the scope chain--instead, copyBackIfStmt merges the
+    temporary values of the branches back into the original scope with muxes, after which the
+    branch scopes are released. '''
+    __slots__ = 'name', 'parents', 'temporaryValues'
+    def __init__(self, name: 'str', parent: 'Scope|FleetingScope'):
+        self.name = name
+        self.parents = [parent]
+        self.temporaryValues: 'dict[str, MValue]' = {}
+    def __str__(self):
+        output = "Fleeting scope " + self.name + " with parent " + self.parents[0].name + " and temporary values"
+        for varName in self.temporaryValues:
+            output += "\n  " + varName + ": " + str(self.temporaryValues[varName])
+        return output
+    def get(self, visitor, varName: 'str', parameters: 'list[int]' = None) -> 'MValue|None':
+        '''Looks up the given name/parameter combo, preferring values set in this scope.'''
+        if varName in self.temporaryValues:
+            visitor.globalsHandler.lastParameterLookup = parameters if parameters != None else []
+            return self.temporaryValues[varName]
+        return self.parents[0].get(visitor, varName, parameters)
+    def set(self, value: 'MValue', varName: 'str'):
+        '''Sets the given name to the given value in this scope only.'''
+        assert value.__class__ == MValue, f"Values must be MValue, not {value.__class__}"
+        self.temporaryValues[varName] = value
+    def release(self):
+        '''Drops all values and the parent pointer. Called once the scope has been copied back.'''
+        self.temporaryValues = None
+        self.parents = None
+
 class MissingVariableException(Exception):
     ''' Thrown by the builtin scope when a variable is not found.
     Can be caught if a variable might be a bluespec builtin. '''
@@ -436,17 +526,296 @@ class MissingVariableException(Exception):
 
 class BluespecBuiltinFunction(Exception):
     ''' Thrown when a bluespec builtin function is found.
-    self.functionComponent is the hardware corresponding to the function.
-    self.evaluate is a function that takes input literals to whatever the corresponding function would output.
-        so Valid is a builtin function that can be foled if a literal is fed in '''
-    def __init__(self, functionComponent, evaluate):
-        ''' self.functionComponent is the hardware corresponding to the function.
-        self.evaluate is a function that takes input literals to whatever the corresponding function would output.
-        so Valid is a builtin function that can be foled if a literal is fed in '''
-        self.functionComponent = functionComponent
-        self.evalute = evaluate
-
-assumedBuiltinOrImport = set()  # the set of function names for which we have issued warning messages
+    self.builtin is the registered BuiltinFunction.
+    self.parameters is the list of parameters the builtin was looked up with. '''
+    def __init__(self, builtin: 'BuiltinFunction', parameters: 'list[int|mtypes.MType]'):
+        self.builtin = builtin
+        self.parameters = parameters
+
+''' Builtins.
+The minispec/bluespec builtins are kept in two read-only default tables, looked up by name in BuiltInScope.get:
+    - defaultBuiltinValues maps a name to a function taking the lookup parameters to the corresponding MValue.
+      Used for builtin types (Bit, Vector, ...), literals (True, Invalid, ...), and modules (Reg).
+    - defaultBuiltinFunctions maps a name to a BuiltinFunction, which knows how to create the hardware for a
+      call, how to evaluate a call on literal arguments (so that the call may be constant-folded), and
+      how to infer the type of the output of a call from the types of its inputs (used by
+      hardware.Function.addTypeConstraints).
+Extra builtins may be added to a hardware.Design with registerBuiltinValue and registerBuiltinFunction. They are
+kept on the Design, layered over the default tables (hiding a default of the same name), so registering a builtin
+does not change the synthesis of other designs. Any name which is not found is assumed to be a bluespec builtin or
+import and becomes an opaque function.
+'''
+
+class BuiltinFunction:
+    ''' A bluespec builtin function.
+    name is the name of the function, eg 'zeroExtend'.
+    numArgs is the number of arguments the function takes.
+    evaluate takes the argument literals to the output literal, or returns None if the call cannot be folded
+        (eg, the output width depends on context). If evaluate is None, calls are never folded.
+    outputType takes the list of argument types to the output type, or returns None if the output type is
+        not determined by the argument types. If outputType is None, the output type is never inferred.
+    usesTargetType is True if the output type depends on context (eg zeroExtend). evaluate then takes the type
+        the context expects of the call (eg the declared type of the variable it initializes), or None if it is
+        not known, before the argument literals. '''
+    __slots__ = 'name', 'numArgs', 'evaluate', 'outputType', 'usesTargetType'
+    def __init__(self, name: 'str', numArgs: 'int', evaluate: 'Callable[..., mtypes.MLiteral|None]|None' = None, outputType: 'Callable[[list[mtypes.MType]], mtypes.MType|None]|None' = None, usesTargetType: 'bool' = False):
+        self.name = name
+        self.numArgs = numArgs
+        self.evaluate = evaluate
+        self.outputType = outputType
+        self.usesTargetType = usesTargetType
+    def createComponent(self, parameters: 'list[int|mtypes.MType]') -> 'hardware.Function':
+        ''' Returns the hardware for one call of the builtin. '''
+        functionName = self.name
+        if len(parameters) > 0:  #attach parameters to the function name if present
+            functionName += "#(" + ",".join(str(i) for i in parameters) + ")"
+        return hardware.Function(functionName, [hardware.Node() for i in range(self.numArgs)], builtin=self)
+    def inferOutputType(self, inputTypes: 'list[mtypes.MType]') -> 'mtypes.MType':
+        ''' Returns the output type given the input types, or mtypes.Any if it cannot be inferred. '''
+        if self.outputType == None:
+            return mtypes.Any
+        outputType = self.outputType(inputTypes)
+        if outputType == None:
+            return mtypes.Any
+        return outputType
+
+_defaultBuiltinValues: 'dict[str, Callable[[list[int|mtypes.MType]], MValue]]' = {}
+_defaultBuiltinFunctions: 'dict[str, BuiltinFunction]' = {}
+defaultBuiltinValues = types.MappingProxyType(_defaultBuiltinValues)
+defaultBuiltinFunctions = types.MappingProxyType(_defaultBuiltinFunctions)
+
+def _defaultBuiltinValue(name: 'str', lookup: 'Callable[[list[int|mtypes.MType]], MValue]'):
+    _defaultBuiltinValues[name] = lookup
+
+def _defaultBuiltinFunction(name: 'str', numArgs: 'int', evaluate: 'Callable[..., mtypes.MLiteral|None]|None' = None, outputType: 'Callable[[list[mtypes.MType]], mtypes.MType|None]|None' = None, usesTargetType: 'bool' = False):
+    _defaultBuiltinFunctions[name] = BuiltinFunction(name, numArgs, evaluate, outputType, usesTargetType)
+
+def registerBuiltinValue(name: 'str', lookup: 'Callable[[list[int|mtypes.MType]], MValue]', design: 'hardware.Design|None' = None):
+    ''' Registers a builtin type/literal/module on design (the current Design if None). lookup takes the
+    parameters to the corresponding MValue. '''
+    (design or hardware.currentDesign()).builtinValues[name] = lookup
+
+def registerBuiltinFunction(name: 'str', numArgs: 'int', evaluate: 'Callable[..., mtypes.MLiteral|None]|None' = None, outputType: 'Callable[[list[mtypes.MType]], mtypes.MType|None]|None' = None, usesTargetType: 'bool' = False, design: 'hardware.Design|None' = None) -> 'BuiltinFunction':
+    ''' Registers a builtin function on design (the current Design if None). See BuiltinFunction for a
+    description of the other arguments. '''
+    builtin = BuiltinFunction(name, numArgs, evaluate, outputType, usesTargetType)
+    (design or hardware.currentDesign()).builtinFunctions[name] = builtin
+    return builtin
+
+def lookupBuiltinValue(name: 'str') -> 'Callable[[list[int|mtypes.MType]], MValue]|None':
+    ''' Returns the lookup of the builtin value with the given name in the current Design, if any. '''
+    lookup = hardware.currentDesign().builtinValues.get(name)
+    return lookup if lookup != None else defaultBuiltinValues.get(name)
+
+def getBuiltinFunction(functionName: 'str') -> 'BuiltinFunction|None':
+    ''' Returns the builtin function with the given component name (eg 'zeroExtend' or 'f#(3)') in the current
+    Design, if any. '''
+    if '#(' in functionName:
+        functionName = functionName[:functionName.index('#(')]
+    builtin = hardware.currentDesign().builtinFunctions.get(functionName)
+    return builtin if builtin != None else defaultBuiltinFunctions.get(functionName)
+
+def _noParameters(name: 'str', value: 'Callable[[], Any]'):
+    ''' Returns a lookup for a builtin which takes no parameters. '''
+    def lookup(parameters):
+        assert len(parameters) == 0, f"{name} takes no parameters"
+        return MValue(value())
+    return lookup
+
+def _lookupBit(parameters):
+    assert len(parameters) == 1, "bit takes exactly one parameter"
+    return MValue(mtypes.Bit(parameters[0]))
+
+def _lookupVector(parameters):
+    assert len(parameters) == 2, "vector takes exactly two parameters"
+    k, typeValue = parameters
+    return MValue(mtypes.Vector(k, typeValue))
+
+def _lookupMaybe(parameters):
+    assert len(parameters) == 1, "A maybe type has exactly one parameter"
+    return MValue(mtypes.Maybe(parameters[0]))
+
+def _lookupRegister(parameters):
+    # TODO make RegU read as RegU in output diagrams. Update relevant tests as well.
+    assert len(parameters) == 1, "A register takes exactly one parameter"
+    return MValue(BuiltinRegisterCtx(parameters[0]))
+
+def _lookupUnsynthesizable(parameters):
+    return MValue(UnsynthesizableComponent())
+
+_defaultBuiltinValue('Integer', _noParameters('Integer', lambda: mtypes.IntegerLiteral))
+_defaultBuiltinValue('Bit', _lookupBit)
+_defaultBuiltinValue('Vector', _lookupVector)
+_defaultBuiltinValue('Bool', lambda parameters: MValue(mtypes.Bool))
+_defaultBuiltinValue('Reg', _lookupRegister)
+_defaultBuiltinValue('RegU', _lookupRegister)
+_defaultBuiltinValue('True', _noParameters('A boolean literal', lambda: mtypes.Bool(True)))
+_defaultBuiltinValue('False', _noParameters('A boolean literal', lambda: mtypes.Bool(False)))
+_defaultBuiltinValue('Invalid', _noParameters('An invalid literal', lambda: mtypes.Invalid(mtypes.Any)))
+_defaultBuiltinValue('Maybe', _lookupMaybe)
+for _name in ['$format', '$write', '$finish', '$display']:
+    _defaultBuiltinValue(_name, _lookupUnsynthesizable)
+
+def _isNumeric(value: 'mtypes.MLiteral') -> 'bool':
+    return value.__class__ == mtypes.IntegerLiteral or value.isBitLiteral()
+
+def _valid(value: 'mtypes.MLiteral'):
+    return mtypes.Maybe(value.__class__)(value)
+def _validType(inputTypes: 'list[mtypes.MType]'):
+    if inputTypes[0] == mtypes.Any:
+        return None
+    return mtypes.Maybe(inputTypes[0])
+
+def _fromMaybe(default: 'mtypes.MLiteral', value: 'mtypes.MLiteral'):
+    if value.__class__.untypedef()._constructor != mtypes.Maybe:
+        return None
+    if value.isValid:
+        return value.value
+    return default
+def _fromMaybeType(inputTypes: 'list[mtypes.MType]'):
+    if inputTypes[0] != mtypes.Any and inputTypes[0] != mtypes.DontCareLiteral:
+        return inputTypes[0]
+    maybeType = inputTypes[1].untypedef()
+    if maybeType._constructor == mtypes.Maybe and maybeType._mtype != mtypes.Any:
+        return maybeType._mtype
+    return None
+
+def _isValid(value: 'mtypes.MLiteral'):
+    if value.__class__.untypedef()._constructor != mtypes.Maybe:
+        return None
+    return mtypes.Bool(value.isValid)
+
+def _log2(n: 'mtypes.MLiteral'):
+    assert n.__class__ == mtypes.IntegerLiteral, "Can only take log of integer"
+    return mtypes.IntegerLiteral(n.value.bit_length())
+
+def _extendedWidth(targetType: 'mtypes.MType|None', value: 'mtypes.MLiteral') -> 'int|None':
+    ''' The width value is extended to, or None if it is not known from context. The result of an extension has
+    to be a Bit#(n) of the right width: folding to an Integer would compare and shift differently. '''
+    if targetType == None or not value.isBitLiteral():
+        return None
+    n = mtypes.bitWidthOf(targetType)
+    if n == None or n < value.width:
+        return None
+    return n
+
+def _zeroExtend(targetType: 'mtypes.MType|None', value: 'mtypes.MLiteral'):
+    n = _extendedWidth(targetType, value)
+    if n == None:
+        return None
+    return mtypes.Bit(mtypes.IntegerLiteral(n))(value.value, value.unknown)
+
+def _signExtend(targetType: 'mtypes.MType|None', value: 'mtypes.MLiteral'):
+    n = _extendedWidth(targetType, value)
+    if n == None:
+        return None
+    if value.width == 0:
+        return mtypes.Bit(mtypes.IntegerLiteral(n))(0)
+    extension = ((1 << n) - 1) ^ ((1 << value.width) - 1)
+    signBit = value.width - 1
+    return mtypes.Bit(mtypes.IntegerLiteral(n))(value.value | (extension if (value.value >> signBit) & 1 else 0),
+                                                 value.unknown | (extension if (value.unknown >> signBit) & 1 else 0))  # an unknown sign extends to unknown bits
+
+def _truncate(targetType: 'mtypes.MType|None', value: 'mtypes.MLiteral'):
+    if targetType == None or not value.isBitLiteral():
+        return None
+    n = mtypes.bitWidthOf(targetType)
+    if n == None or n > value.width:
+        return None
+    return mtypes.Bit(mtypes.IntegerLiteral(n))(value.value, value.unknown)
+
+def _unpack(targetType: 'mtypes.MType|None', value: 'mtypes.MLiteral'):
+    ''' Unpacks the bits of value into a Bit#(n), a Bool or a Vector of Bit#(m) (element 0 in the least
+    significant bits). Other types are left to the hardware. '''
+    if targetType == None or not value.isBitLiteral():
+        return None
+    targetType = targetType.untypedef() if targetType.__class__ == mtypes.MType else targetType
+    if targetType == mtypes.Bool:
+        if value.width != 1 or value.unknown:
+            return None
+        return mtypes.Bool(value.value == 1)
+    if mtypes.bitWidthOf(targetType) == value.width:
+        return mtypes.Bit(mtypes.IntegerLiteral(value.width))(value.value, value.unknown)
+    if targetType.__class__ == mtypes.MType and targetType._constructor == mtypes.Vector:
+        m, k = mtypes.bitWidthOf(targetType._typeValue), targetType._k
+        k = k.value if k.__class__ == mtypes.IntegerLiteral else k
+        if m == None or m * k != value.width:
+            return None
+        element = mtypes.Bit(mtypes.IntegerLiteral(m))
+        return targetType([element(value.value >> (i * m), value.unknown >> (i * m)) for i in range(k)])
+    return None
+
+def _pack(value: 'mtypes.MLiteral'):
+    if value.isBitLiteral():
+        return value
+    if value.__class__ == mtypes.Bool:
+        return mtypes.Bit(mtypes.IntegerLiteral(1))(1 if value.value else 0)
+    return None
+def _packType(inputTypes: 'list[mtypes.MType]'):
+    if inputTypes[0] == mtypes.Bool:
+        return mtypes.Bit(mtypes.IntegerLiteral(1))
+    if mtypes.bitWidthOf(inputTypes[0]) != None:
+        return inputTypes[0]
+    packedWidth = inputTypes[0].packedWidth()
+    if packedWidth != None:
+        return mtypes.Bit(mtypes.IntegerLiteral(packedWidth))
+    return None
+
+def _reverseBits(value: 'mtypes.MLiteral'):
+    if not value.isBitLiteral():
+        return None
+    n = value.width
+    return value.__class__(int(format(value.value, f'0{n}b')[::-1], 2) if n > 0 else 0)
+def _sameAsInputType(inputTypes: 'list[mtypes.MType]'):
+    if mtypes.bitWidthOf(inputTypes[0]) != None:
+        return inputTypes[0]
+    return None
+
+def _countOnes(value: 'mtypes.MLiteral'):
+    if not value.isBitLiteral():
+        return None
+    n = value.width
+    return mtypes.Bit(mtypes.IntegerLiteral(n.bit_length()))(bin(value.value).count('1'))
+def _countOnesType(inputTypes: 'list[mtypes.MType]'):
+    n = mtypes.bitWidthOf(inputTypes[0])
+    if n == None:
+        return None
+    return mtypes.Bit(mtypes.IntegerLiteral(n.bit_length()))
+
+def _minOrMax(takeMax: 'bool'):
+    def evaluate(a: 'mtypes.MLiteral', b: 'mtypes.MLiteral'):
+        if not _isNumeric(a) or not _isNumeric(b):
+            return None
+        if a.isBitLiteral() and b.isBitLiteral() and a.width != b.width:
+            return None
+        # unsigned comparison, as for Bit#(n). Integers are coerced to the width of the other argument.
+        resultClass = a.__class__ if a.isBitLiteral() else b.__class__
+        larger = a.value if a.value >= b.value else b.value
+        smaller = b.value if a.value >= b.value else a.value
+        return resultClass(larger if takeMax else smaller)
+    return evaluate
+def _minOrMaxType(inputTypes: 'list[mtypes.MType]'):
+    for mtype in inputTypes:
+        if mtypes.bitWidthOf(mtype) != None:
+            return mtype
+    if all(mtype == mtypes.Integer for mtype in inputTypes):
+        return mtypes.Integer
+    return None
+
+_defaultBuiltinFunction('Valid', 1, _valid, _validType)
+_defaultBuiltinFunction('fromMaybe', 2, _fromMaybe, _fromMaybeType)
+_defaultBuiltinFunction('isValid', 1, _isValid, lambda inputTypes: mtypes.Bool)
+_defaultBuiltinFunction('log2', 1, _log2, lambda inputTypes: mtypes.Integer)
+_defaultBuiltinFunction('zeroExtend', 1, _zeroExtend, usesTargetType=True)
+_defaultBuiltinFunction('signExtend', 1, _signExtend, usesTargetType=True)
+_defaultBuiltinFunction('truncate', 1, _truncate, usesTargetType=True)
+_defaultBuiltinFunction('pack', 1, _pack, _packType)
+_defaultBuiltinFunction('unpack', 1, _unpack, usesTargetType=True)
+_defaultBuiltinFunction('reverseBits', 1, _reverseBits, _sameAsInputType)
+_defaultBuiltinFunction('countOnes', 1, _countOnes, _countOnesType)
+_defaultBuiltinFunction('min', 2, _minOrMax(False), _minOrMaxType)
+_defaultBuiltinFunction('max', 2, _minOrMax(True), _minOrMaxType)
+
 class BuiltInScope(Scope):
     '''The minispec built-ins. Behaves slightly differently from other scopes.'''
     def __init__(self, globalsHandler: 'GlobalsHandler', name: 'str', parents: 'list[Scope]'):
@@ -467,59 +836,13 @@ class BuiltInScope(Scope):
         if parameters == None:
             parameters = []
         visitor.globalsHandler.lastParameterLookup = parameters
-        if varName == 'Integer':
-            assert len(parameters) == 0, "integer takes no parameters"
-            return MValue(mtypes.IntegerLiteral)
-        if varName == 'Bit':
-            assert len(parameters) == 1, "bit takes exactly one parameter"
-            n = parameters[0]
-            return MValue(mtypes.Bit(n))
-        if varName == 'Vector':
-            assert len(parameters) == 2, "vector takes exactly two parameters"
-            k, typeValue = parameters
-            return MValue(mtypes.Vector(k, typeValue))
-        if varName == 'Bool':
-            return MValue(mtypes.Bool)
-        if varName == 'Reg' or varName == 'RegU':
-            # TODO make RegU read as RegU in output diagrams. Update relevant tests as well.
-            assert len(parameters) == 1, "A register takes exactly one parameter"
-            return MValue(BuiltinRegisterCtx(parameters[0]))
-        if varName == 'True':
-            assert len(parameters) == 0, "A boolean literal has no parameters"
-            return MValue(mtypes.Bool(True))
-        if varName == 'False':
-            assert len(parameters) == 0, "A boolean literal has no parameters"
-            return MValue(mtypes.Bool(False))
-        if varName == 'Invalid':
-            assert len(parameters) == 0, "An invalid literal has no parameters"
-            return MValue(mtypes.Invalid(mtypes.Any))
-        if varName == 'Valid':
-            assert len(parameters) == 0, "An valid literal has no parameters"
-            functionComp = hardware.Function('Valid', [hardware.Node()])
-            def valid(mliteral: 'mtypes.MLiteral'):
-                return mtypes.Maybe(mliteral.__class__)(mliteral)
-            raise BluespecBuiltinFunction(functionComp, valid)
-        if varName == 'fromMaybe':
-            assert len(parameters) == 0, "fromMaybe has no parameters"
-            functionComp = hardware.Function('fromMaybe', [hardware.Node(), hardware.Node()])
-            def fromMaybe(default: 'mtypes.MLiteral', mliteral: 'mtypes.MLiteral'):
-                if mliteral.isValid:
-                    return mliteral.value
-                return default
-            raise BluespecBuiltinFunction(functionComp, fromMaybe)
-        if varName == 'Maybe':
-            assert len(parameters) == 1, "A maybe type has exactly one parameter"
-            mtype = parameters[0]
-            return MValue(mtypes.Maybe(mtype))
-        if varName == 'log2':
-            assert len(parameters) == 0, "log base 2 has no parameters"
-            functionComp = hardware.Function('log2', [hardware.Node()])
-            def log2(n: 'mtypes.MLiteral'):
-                assert n.__class__ == mtypes.IntegerLiteral, "Can only take log of integer"
-                return mtypes.IntegerLiteral(n.value.bit_length())
-            raise BluespecBuiltinFunction(functionComp, log2)
-        if varName == '$format' or varName == "$write" or varName == "$finish" or varName == "$display":
-            return MValue(UnsynthesizableComponent())
+        lookup = lookupBuiltinValue(varName)
+        if lookup != None:
+            return lookup(parameters)
+        builtin = getBuiltinFunction(varName)
+        if builtin != None:
+            raise BluespecBuiltinFunction(builtin, parameters)
+        assumedBuiltinOrImport = hardware.currentDesign().assumedBuiltinOrImport  # the set of function names for which we have issued warning messages
         if varName not in assumedBuiltinOrImport:
             print(f"Warning: assuming {varName} is a Bluespec built-in or import")
             assumedBuiltinOrImport.add(varName)
@@ -735,6 +1058,53 @@ class UnsynthesizableComponent:
     def accept(self, visitor):
         return MValue(self)
 
+class LiteralCaseTable:
+    ''' A case expression or statement whose selectors are all literals written in the source (integer literals or
+    enum tags), precompiled into a dict from selector value to the arm to run. Built once per case ctx (see
+    SynthesizerVisitor.getLiteralCaseTable), so a case with a literal scrutinee looks up its arm in constant time
+    and only the selected arm is visited.
+    literalClass: the class of every selector. The table only applies to scrutinees of this class, and to Bit
+        scrutinees if the selectors are Integers (eg `case (op) 0: ... 1: ...` with op a Bit#(2)).
+    arms: maps the value of each selector to the ctx of its arm (the first arm, if a selector is repeated).
+    default: the ctx of the default arm, or None. '''
+    __slots__ = 'literalClass', 'arms', 'default', '_bitArms'
+    def __init__(self, literalClass: 'mtypes.MType', arms: 'dict[Any, Any]', default):
+        self.literalClass = literalClass
+        self.arms = arms
+        self.default = default
+        self._bitArms: 'dict[int, dict[int, Any]]' = {}  # the arms of Integer selectors coerced to Bit#(n), by n
+    def applies(self, value: 'mtypes.MLiteral') -> 'bool':
+        ''' Returns whether the table can select the arm for the scrutinee value. '''
+        if not mtypes.isKnownLiteral(value):
+            return False
+        return value.__class__ == self.literalClass or (self.literalClass == mtypes.Integer and value.isBitLiteral())
+    def select(self, value: 'mtypes.MLiteral'):
+        ''' Returns the ctx of the arm selected by value, or the default (which may be None). '''
+        if value.__class__ != self.literalClass:
+            return self.bitArms(value.width).get(value.value, self.default)
+        return self.arms.get(value.value, self.default)
+    def bitArms(self, width: 'int') -> 'dict[int, Any]':
+        ''' Returns the arms with the Integer selectors coerced to Bit#(width), which keeps the low width bits of
+        each selector. The first arm still wins when two selectors coerce to the same value. '''
+        if width not in self._bitArms:
+            mask = (1 << width) - 1
+            arms = {}
+            for selector, arm in self.arms.items():
+                arms.setdefault(selector & mask, arm)
+            self._bitArms[width] = arms
+        return self._bitArms[width]
+
+def isSourceLiteral(ctx) -> 'bool':
+    ''' Returns whether the expression ctx is just an integer literal or an enum tag, so has the same value wherever
+    it is evaluated. '''
+    while not isinstance(ctx, (build.MinispecPythonParser.MinispecPythonParser.IntLiteralContext, build.MinispecPythonParser.MinispecPythonParser.VarExprContext)):
+        if ctx.getChildCount() != 1 or not isinstance(ctx.getChild(0), antlr4.ParserRuleContext):
+            return False
+        ctx = ctx.getChild(0)
+    if isinstance(ctx, build.MinispecPythonParser.MinispecPythonParser.VarExprContext):
+        return ctx.var.getText()[0].isupper() and not ctx.params()  # variables are lowercase, enum tags uppercase
+    return True
+
 '''
 Functions/modules/components will have nodes. Wires will be attached to nodes.
 This is convenient during synthesis because we can map variables to the node
@@ -742,7 +1112,7 @@ with the corresponding value and pass the nodes around, attaching wires as neede
 '''
 
 class GlobalsHandler:
-    def __init__(self):
+    def __init__(self, debug: 'bool' = False):
         self.currentComponent: 'hardware.Function|hardware.Module' = None  # a function/module component. used during synthesis.
         self.parameterBindings = {}
         '''self.parameterBindings is a dictionary str -> int telling functions which parameters
@@ -752,7 +1122,8 @@ class GlobalsHandler:
         a function call. Should be set whenever calling a function. Used to determine how to name
         the function in the corresponding component.'''
 
-        self.allScopes: 'list[Scope]' = []
+        self.debug = debug
+        self.allScopes: 'list[Scope]' = []  # only populated in debug mode, since keeping every scope alive is expensive
         self.currentScope: 'Scope' = None
 
         self.scopeStack = []
@@ -778,6 +1149,40 @@ class GlobalsHandler:
         self.popScope()
 
 
+class ElaborationBudget:
+    ''' Limits on how much work a single synthesis may do. Any limit may be None, meaning unlimited.
+    maxComponents/maxNodes: the number of hardware Components/Nodes created during synthesis.
+    maxDepth: the number of nested function/module instances being elaborated at once.
+    maxSeconds: wall-clock time spent in synthesis.
+    keepPartial: if True, a BudgetExceededException carries the partially synthesized hardware. '''
+    __slots__ = 'maxComponents', 'maxNodes', 'maxDepth', 'maxSeconds', 'keepPartial'
+    def __init__(self, maxComponents: 'int|None' = None, maxNodes: 'int|None' = None, maxDepth: 'int|None' = None, maxSeconds: 'float|None' = None, keepPartial: 'bool' = False):
+        self.maxComponents = maxComponents
+        self.maxNodes = maxNodes
+        self.maxDepth = maxDepth
+        self.maxSeconds = maxSeconds
+        self.keepPartial = keepPartial
+
+class BudgetExceededException(Exception):
+    ''' Thrown by the SynthesizerVisitor when an ElaborationBudget is exceeded.
+    limitName is the name of the budget field which was exceeded, eg 'maxNodes'.
+    instanceName is the name of the innermost function/module being elaborated, eg 'f#(4)',
+    and instanceStack lists the names of all function/module instances being elaborated, outermost first.
+    numComponents, numNodes, and seconds record how much had been produced so far.
+    partial is the root of the partially synthesized hardware if the budget has keepPartial set, otherwise None. '''
+    def __init__(self, limitName: 'str', limit, instanceStack: 'list[str]', numComponents: 'int', numNodes: 'int', seconds: 'float', partial: 'hardware.Component|None'):
+        self.limitName = limitName
+        self.limit = limit
+        self.instanceStack = instanceStack
+        self.instanceName = instanceStack[-1] if len(instanceStack) > 0 else None
+        self.numComponents = numComponents
+        self.numNodes = numNodes
+        self.seconds = seconds
+        self.partial = partial
+        where = f"while elaborating {self.instanceName} (via {' -> '.join(instanceStack)})" if len(instanceStack) > 0 else "before elaborating the top level"
+        Exception.__init__(self, f"Exceeded elaboration budget {limitName}={limit} {where} after producing {numComponents} components and {numNodes} nodes in {seconds:.2f} seconds")
+
+
 class StaticTypeListener(build.MinispecPythonListener.MinispecPythonListener):
     def __init__(self, globalsHandler: 'GlobalsHandler') -> None:
         self.globalsHandler = globalsHandler
@@ -911,9 +1316,12 @@ class StaticTypeListener(build.MinispecPythonListener.MinispecPythonListener):
         ''' Evaluate the typedef and log the appropriate variables. '''
         enumName = ctx.upperCaseIdentifier().getText()
         enumNames = []
+        tagValues = {}
         for element in ctx.typeDefEnumElement():
             enumNames.append(element.tag.getText())
-        enumType = mtypes.Enum(enumName, set(enumNames))
+            if element.tagval:
+                tagValues[element.tag.getText()] = parseIntLiteral(element.tagval.text).value
+        enumType = mtypes.Enum(enumName, enumNames, tagValues)
         self.globalsHandler.currentScope.setPermanent(MValue(enumType), enumName)
         for name in enumNames:
             self.globalsHandler.currentScope.setPermanent(MValue(enumType(name)), name)
@@ -1030,14 +1438,91 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
     nodes of type exprPrimary return the node corresponding to their value.
     stmt do not return anything; they mutate the current scope and the current hardware.'''
 
-    def __init__(self, globalsHandler: 'GlobalsHandler') -> None:
+    def __init__(self, globalsHandler: 'GlobalsHandler', budget: 'ElaborationBudget|None' = None) -> None:
         self.globalsHandler = globalsHandler
         self.args = None
         self.kwargs = None
+        # elaboration budget bookkeeping
+        self.budget = budget
+        self.instanceStack: 'list[str]' = []  # names of the function/module instances currently being elaborated
+        self.instanceComponents: 'list[hardware.Component]' = []  # the corresponding components
+        self.targetTypes: 'dict[build.MinispecPythonParser.MinispecPythonParser.CallExprContext, mtypes.MType]' = {}  # the declared types of calls being visited, see BuiltinFunction
+        design = hardware.currentDesign()
+        self.startTime = time.monotonic()
+        self.startComponents = design.numComponentsCreated
+        self.startNodes = design.numNodesCreated
+
+    def visitWithTargetType(self, ctx: 'build.MinispecPythonParser.MinispecPythonParser.ExpressionContext', targetType: 'mtypes.MType') -> 'MValue':
+        ''' Visits the expression ctx, whose value has type targetType. If ctx is a call, the call may use
+        targetType to fold (see BuiltinFunction). '''
+        call = ctx
+        while call.__class__ in (build.MinispecPythonParser.MinispecPythonParser.OperatorExprContext, build.MinispecPythonParser.MinispecPythonParser.BinopExprContext, build.MinispecPythonParser.MinispecPythonParser.UnopExprContext):
+            if call.__class__ == build.MinispecPythonParser.MinispecPythonParser.OperatorExprContext:
+                call = call.binopExpr()
+            elif call.__class__ == build.MinispecPythonParser.MinispecPythonParser.BinopExprContext and call.unopExpr():
+                call = call.unopExpr()
+            elif call.__class__ == build.MinispecPythonParser.MinispecPythonParser.UnopExprContext and not call.op:
+                call = call.exprPrimary()
+            else:
+                break
+        if call.__class__ != build.MinispecPythonParser.MinispecPythonParser.CallExprContext or targetType == mtypes.Any:
+            return self.visit(ctx)
+        previous = self.targetTypes.get(call)  # the same call may be visited again inside a recursive function
+        self.targetTypes[call] = targetType
+        try:
+            return self.visit(ctx)
+        finally:
+            if previous == None:
+                del self.targetTypes[call]
+            else:
+                self.targetTypes[call] = previous
+
+    def enterInstance(self, name: 'str', component: 'hardware.Component'):
+        ''' Records that we are elaborating the given function/module instance. '''
+        self.instanceStack.append(name)
+        self.instanceComponents.append(component)
+        if self.budget != None:
+            self.checkBudget()
+
+    def exitInstance(self):
+        ''' Records that we have finished elaborating the innermost function/module instance. '''
+        self.instanceStack.pop()
+        self.instanceComponents.pop()
+
+    def checkBudget(self):
+        ''' Throws a BudgetExceededException if the budget has been exceeded. '''
+        budget = self.budget
+        design = hardware.currentDesign()
+        numComponents = design.numComponentsCreated - self.startComponents
+        numNodes = design.numNodesCreated - self.startNodes
+        seconds = time.monotonic() - self.startTime
+        limitName = None
+        if budget.maxComponents != None and numComponents > budget.maxComponents:
+            limitName, limit = 'maxComponents', budget.maxComponents
+        elif budget.maxNodes != None and numNodes > budget.maxNodes:
+            limitName, limit = 'maxNodes', budget.maxNodes
+        elif budget.maxDepth != None and len(self.instanceStack) > budget.maxDepth:
+            limitName, limit = 'maxDepth', budget.maxDepth
+        elif budget.maxSeconds != None and seconds > budget.maxSeconds:
+            limitName, limit = 'maxSeconds', budget.maxSeconds
+        if limitName == None:
+            return
+        partial = None
+        if budget.keepPartial and len(self.instanceComponents) > 0:
+            # instances still being elaborated have not been added to their parents yet, so attach them.
+            for i in range(1, len(self.instanceComponents)):
+                child = self.instanceComponents[i]
+                if child.parent == None:
+                    self.instanceComponents[i-1].addChild(child)
+            partial = self.instanceComponents[0]
+            partial._persistent = True
+        raise BudgetExceededException(limitName, limit, self.instanceStack.copy(), numComponents, numNodes, seconds, partial)
 
     # @decorateForErrorCatching
     def visit(self, ctx, *args, **kwargs) -> 'MValue':
         # args and kwargs can be accessed from inside ctx
+        if self.budget != None:
+            self.checkBudget()
         oldArgs = self.args
         oldKwargs = self.kwargs
         self.args = args
@@ -1278,7 +1763,11 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
             varName = varInit.var.getText()
             if (varInit.rhs):
                 lhsSource = [(getSourceFilename(ctx), varInit.var.getSourceInterval()[0])]
-                value = self.visit(varInit.rhs).withSourceTokens(lhsSource)
+                value = self.visitWithTargetType(varInit.rhs, typeValue).withSourceTokens(lhsSource)
+            elif typeValue.__class__ == mtypes.MType and typeValue.untypedef()._constructor == mtypes.Vector and mtypes.isValueType(typeValue):
+                # vectors may be initialized element-by-element, so we start with a vector literal with no
+                # elements assigned and fold element assignments into it while they are constant.
+                value = MValue(typeValue())
             else:
                 value = MValue(None)
             if value.value.__class__ == hardware.Node:
@@ -1349,6 +1838,7 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
 
         moduleComponent = hardware.Module(moduleName)
         moduleComponent.addSourceTokens([(getSourceFilename(ctx), ctx.moduleId().getSourceInterval()[0])])
+        self.enterInstance(moduleName, moduleComponent)
         # log the current component
         previousComponent = self.globalsHandler.currentComponent
         self.globalsHandler.currentComponent = moduleComponent
@@ -1423,6 +1913,7 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
         self.globalsHandler.currentComponent = previousComponent #reset the current component/scope
         self.globalsHandler.exitScope()
         moduleCtxScope.parents = previousCtxParent
+        self.exitInstance()
 
         moduleWithMetadata: ModuleWithMetadata = ModuleWithMetadata(self, moduleComponent, moduleInputsWithDefaults, moduleMethodsWithArguments)
         moduleComponent.metadata = moduleWithMetadata
@@ -1553,7 +2044,7 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
             previousCtxParent = moduleCtxScope.parents
             moduleCtxScope.parents = [parentScope]
         self.globalsHandler.enterScope(methodScope)
-        self.globalsHandler.currentScope.setPermanent(None, '-return')
+        self.globalsHandler.currentScope.declare('-return')
 
         if ctx.argFormals():
             # we have a method with args. We create a component for it which we return at the end.
@@ -1564,7 +2055,7 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
                 argType = self.visit(arg.typeName()).value # typeName parse tree node
                 argName = arg.argName.getText() # name of the variable
                 argNode = hardware.Node(argName, argType)
-                methodScope.setPermanent(None, argName) # TODO consider should this line be done in the walker before synthesis?
+                methodScope.declare(argName) # TODO consider should this line be done in the walker before synthesis?
                 methodScope.set(MValue(argNode), argName)
                 inputNodes.append(argNode)
             # set up and log the method component
@@ -1606,20 +2097,20 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
         # bind register outputs
         for registerName in registers:
             register = registers[registerName].module
-            ruleScope.setPermanent(None, registerName)
+            ruleScope.declare(registerName)
             ruleScope.set(MValue(register.value), registerName)
         # bind any default inputs, including registers (which default to their own value)
         for submoduleName in submodules:
             for inputName in submodules[submoduleName].getAllInputs():
                 fullInputName = submoduleName + '.' + inputName
                 value = submodules[submoduleName].getInput(inputName)
-                ruleScope.setPermanent(None, fullInputName)
+                ruleScope.declare(fullInputName)
                 ruleScope.set(value, fullInputName)
         for submoduleName in sharedSubmodules:
             for inputName in sharedSubmodules[submoduleName].getAllInputs():
                 fullInputName = submoduleName + '.' + inputName
                 value = sharedSubmodules[submoduleName].getInput(inputName)
-                ruleScope.setPermanent(None, fullInputName)
+                ruleScope.declare(fullInputName)
                 ruleScope.set(value, fullInputName)
         for stmt in ctx.stmt():
             self.visit(stmt)
@@ -1673,7 +2164,7 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
                     argValue = functionArgs[i]
                     assert argValue.isLiteralValue(), "Must constant fold integer parameters"
                     functionScope.set(argValue, argName)
-        # if folding_constants_through_function_defs:
+        # if hardware.currentDesign().foldingConstantsThroughFunctionDefs:
         #     if 'functionArgs' in self.kwargs:
         #         # constant-fold constants through the function
         #         functionArgs: 'list[MValue]' = self.kwargs['functionArgs']
@@ -1687,7 +2178,8 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
         funcComponent = hardware.Function(functionName, inputNodes, outputNode)
         funcComponent.inputNames = inputNames
         funcComponent.addSourceTokens([(getSourceFilename(ctx), ctx.functionId().getSourceInterval()[0])])
-        self.globalsHandler.currentScope.setPermanent(None, '-return')
+        self.enterInstance(functionName, funcComponent)
+        self.globalsHandler.currentScope.declare('-return')
         # log the current component
         previousComponent = self.globalsHandler.currentComponent
         self.globalsHandler.currentComponent = funcComponent
@@ -1704,6 +2196,7 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
 
         self.globalsHandler.exitScope()
         self.globalsHandler.currentComponent = previousComponent #reset the current component
+        self.exitInstance()
         return MValue(funcComponent)
 
     @decorateForErrorCatching
@@ -1739,6 +2232,19 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
             varName = ctx.var.getText()
             self.globalsHandler.currentScope.set(value.withSourceTokens(lhsSource), varName)
             return
+        insertComponent: 'hardware.Inserter|None' = None
+        if lvalue.__class__ == build.MinispecPythonParser.MinispecPythonParser.IndexLvalueContext and lvalue.lvalue().__class__ == build.MinispecPythonParser.MinispecPythonParser.SimpleLvalueContext:
+            # assigning an element of a vector literal with a constant index and value is folded
+            vector = self.globalsHandler.currentScope.get(self, lvalue.lvalue().getText())
+            if value.isLiteralValue() and mtypes.isMLiteral(vector.value) and mtypes.isVectorLiteral(vector.value):
+                index = self.visit(lvalue.index).resolveToNodeOrMLiteral(self)
+                if index.isLiteralValue():
+                    lhsSource = [(getSourceFilename(ctx), lvalue.lvalue().getSourceInterval()[0])]
+                    newVector = MValue(vector.value.withElement(index.value.value, value.value), vector._tokensSourcedFrom)
+                    self.globalsHandler.currentScope.set(newVector.mergeSourceTokens(value._tokensSourcedFrom + [lhsSource]), lvalue.lvalue().getText())
+                    return
+                # the index has already been visited, so we build the inserter here instead of visiting lvalue
+                insertComponent = self.indexInserter(self.visit(lvalue.lvalue()).value, index, lvalue)
         # Otherwise, we convert to hardware.
         value = value.resolveToNode(self)
         # insert the field/slice/index
@@ -1850,7 +2356,8 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
                     pass  # not a module, move on
             except MissingVariableException:
                 pass  # not a module, move on
-        insertComponent: 'hardware.Inserter' = self.visit(lvalue).value
+        if insertComponent == None:
+            insertComponent = self.visit(lvalue).value
         hardware.Wire(value, insertComponent.setValue())
         self.globalsHandler.currentComponent.addChild(insertComponent)
         self.globalsHandler.currentScope.set(MValue(insertComponent.output), insertComponent.varName)
@@ -1872,6 +2379,10 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
         and the last str is varName, the name of the variable being updated. '''
         inserter: 'hardware.Inserter' = self.visit(ctx.lvalue()).value
         index = self.visit(ctx.index).resolveToNodeOrMLiteral(self)
+        return MValue(self.indexInserter(inserter, index, ctx))
+
+    def indexInserter(self, inserter: 'hardware.Inserter', index: 'MValue', ctx: build.MinispecPythonParser.MinispecPythonParser.IndexLvalueContext) -> 'hardware.Inserter':
+        ''' Adds the (already visited) index of the index lvalue ctx to the inserter and returns the inserter. '''
         if index.isLiteralValue():
             inserter.addText('[' + str(index.value) + ']')
         else:
@@ -1881,7 +2392,7 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
             (getSourceFilename(ctx), ctx.indexLBracket.tokenIndex),
             (getSourceFilename(ctx), ctx.indexRBracket.tokenIndex)
         ])
-        return MValue(inserter)
+        return inserter
 
     @decorateForErrorCatching
     def visitSimpleLvalue(self, ctx: build.MinispecPythonParser.MinispecPythonParser.SimpleLvalueContext):
@@ -1889,6 +2400,8 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
         tuple[Node] is the tuple of nodes corresponding to variable input (including the variable being updated),
         and the last str is varName, the name of the variable being updated. '''
         valueFound = self.globalsHandler.currentScope.get(self, ctx.getText())
+        if mtypes.isMLiteral(valueFound.value) and mtypes.isVectorLiteral(valueFound.value) and not valueFound.value.hasDefinedElements():
+            valueFound = MValue(None)  # a vector with no elements assigned yet is uninitialized
         if valueFound.value != None:
             valueFound = valueFound.resolveToNode(self)
         inserter = hardware.Inserter(valueFound.value != None, ctx.getText())
@@ -1938,7 +2451,7 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
         condition = self.visit(ctx.expression(0))
         if condition.value.__class__ == UnsynthesizableComponent:
             return UnsynthesizableComponent()
-        condition = condition.resolveToNodeOrMLiteral(self)
+        condition = condition.resolveToNodeOrMLiteral(self).resolveUnknownToNode(self)
         if condition.isLiteralValue():
             # we select the appropriate branch
             if condition.value == mtypes.BooleanLiteral(True):
@@ -1954,6 +2467,11 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
                 return MValue(UnsynthesizableComponent())
             if value2.value.__class__ == UnsynthesizableComponent:
                 return MValue(UnsynthesizableComponent())
+            value1 = value1.resolveToNodeOrMLiteral(self)
+            value2 = value2.resolveToNodeOrMLiteral(self)
+            merged = self.mergeLiteralValues([value1, value2])
+            if merged != None:
+                return merged
             # since the control signal is hardware, we convert the values to hardware as well (if needed)
             value1 = value1.resolveToNode(self)
             value2 = value2.resolveToNode(self)
@@ -1985,7 +2503,14 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
           is wire in to several muxes, we instantiate it into hardware several times, one for each mux.
         '''
         #TODO in caseExpr and caseStmt, if a default is included but all possible inputs are already present (as literals), skip the default input.
-        expr = self.visit(ctx.expression())
+        expr = self.visit(ctx.expression()).resolveUnknownToNode(self)
+        if expr.isLiteralValue():
+            # case 1, when the selection expressions are written as literals: look up the selected output directly
+            table = self.getLiteralCaseTable(ctx)
+            if table != None and table.applies(expr.value):
+                output = table.select(expr.value)
+                assert output != None, "all branches must be covered"
+                return self.visit(output).resolveToNodeOrMLiteral(self)
         expri: 'list[tuple[MValue, MValue]]' = [] # pairs (comparisonStmt, valueToOutput)
         hasDefault = False
         for caseExprItem in ctx.caseExprItem():
@@ -1996,7 +2521,7 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
                 break
             correspondingOutput = self.visit(caseExprItem.expression()).resolveToNodeOrMLiteral(self)
             for comparisonStmt in caseExprItem.exprPrimary():
-                expri.append((self.visit(comparisonStmt).resolveToNodeOrMLiteral(self), correspondingOutput))
+                expri.append((self.visit(comparisonStmt).resolveToNodeOrMLiteral(self).resolveUnknownToNode(self), correspondingOutput))
         if expr.isLiteralValue() and all([pair[0].isLiteralValue() for pair in expri]):
             # case 1
             for pair in expri:
@@ -2004,6 +2529,12 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
                     return pair[1]
             assert hasDefault, "all branches must be covered"
             return defaultValue
+        if hasDefault:
+            defaultValue = defaultValue.resolveToNodeOrMLiteral(self)
+        merged = self.mergeLiteralValues([pair[1] for pair in expri] + ([defaultValue] if hasDefault else []))
+        if merged != None:
+            # every output is the same literal (up to don't-care bits), whichever case is selected
+            return merged
         if all([pair[0].isLiteralValue() for pair in expri]):
             # case 2
             assert not mtypes.isMLiteral(expr.value), "We assume expr is not a literal here, so we do not have to eliminate any extra values."
@@ -2164,11 +2695,19 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
 
     @decorateForErrorCatching
     def visitBitConcat(self, ctx: build.MinispecPythonParser.MinispecPythonParser.BitConcatContext):
-        ''' Bit concatenation is just a function. Returns the function output. '''
-        toConcat = []
-        for expr in ctx.expression():
-            value = self.visit(expr).resolveToNode(self)
-            toConcat.append(value)
+        ''' Bit concatenation is just a function. Returns the function output, or the concatenated literal if
+        every part is a bit literal. '''
+        values = [self.visit(expr).resolveToNodeOrMLiteral(self) for expr in ctx.expression()]
+        if all(mtypes.isMLiteral(value.value) and value.value.isBitLiteral() for value in values):
+            concatenated = values[0].value
+            for value in values[1:]:
+                concatenated = concatenated.concat(value.value)
+            result = MValue(concatenated)
+            for value in values:
+                result = result.appendSourceTokens(value)
+            tokens = [ctx.bitConcatOpen.tokenIndex] + [bitConcatComma.tokenIndex for bitConcatComma in ctx.bitConcatComma] + [ctx.bitConcatClose.tokenIndex]
+            return result.withSourceTokens([(getSourceFilename(ctx), token) for token in tokens])
+        toConcat = [value.resolveToNode(self) for value in values]
         inputs = []
         wires: 'list[tuple[MValue, hardware.Node]]' = []
         for node in toConcat:
@@ -2196,34 +2735,7 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
         Note that integer literals may be either integers or bit values. '''
         text = ctx.getText()
         tokensSourcedFrom = [(getSourceFilename(ctx), ctx.getSourceInterval()[0])]
-        if text[0] == "'":
-            # unsized literal, integer type
-            # must check for hex values first since b and d are legitimate hex digits
-            if 'h' in text: #hex value
-                i = mtypes.IntegerLiteral(int("0x"+text[2:], 0))
-            elif 'b' in text: #binary
-                i = mtypes.IntegerLiteral(int("0b"+text[2:], 0))
-            elif 'd' in text: #decimal value
-                i = mtypes.IntegerLiteral(int(text[2:]))
-            else:
-                raise Exception("Error: literal missing base indicator.")
-        # must check for hex values first since b and d are legitimate hex digits
-        elif 'h' in text: #hex value
-            # TODO test this branch
-            width, binValue = text.split("'h")
-            assert len(width) > 0 and len(binValue) > 0, f"something went wrong with parsing {text} into width {width} and value {binValue}"
-            i = mtypes.Bit(mtypes.IntegerLiteral(int(width)))(int("0x"+binValue, 0))
-        elif 'b' in text: #binary
-            width, binValue = text.split("'b")
-            assert len(width) > 0 and len(binValue) > 0, f"something went wrong with parsing {text} into width {width} and value {binValue}"
-            i = mtypes.Bit(mtypes.IntegerLiteral(int(width)))(int("0b"+binValue, 0))
-        elif 'd' in text: #decimal value
-            width, decValue = text.split("'d")
-            assert len(width) > 0 and len(decValue) > 0, f"something went wrong with parsing {text} into width {width} and value {decValue}"
-            i = mtypes.Bit(mtypes.IntegerLiteral(int(width)))(int(decValue))
-        else:
-            # else we have an ordinary decimal integer
-            i = mtypes.IntegerLiteral(int(text))
+        i = parseIntLiteral(text)
         iValue = MValue(i)
         return iValue.withSourceTokens(tokensSourcedFrom)
 
@@ -2232,7 +2744,11 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
         '''This is the return expression in a function. We keep track of return values
         by assigning them to `-return`. The `-` character was chosen because it cannot
         be used in minispec variable names.'''
-        rhs = self.visit(ctx.expression())  # the value to return
+        function = self.globalsHandler.currentComponent
+        if function.__class__ == hardware.Function:
+            rhs = self.visitWithTargetType(ctx.expression(), function.output._mtype)  # the value to return
+        else:
+            rhs = self.visit(ctx.expression())
         self.globalsHandler.currentScope.set(rhs, '-return')
 
     @decorateForErrorCatching
@@ -2372,10 +2888,16 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
                     functionName += "#(" + ",".join(str(i) for i in params) + ")"
                 funcComponent = hardware.Function(functionName, [hardware.Node() for i in range(len(ctx.expression()))])
             except BluespecBuiltinFunction as e:
-                functionComponent, evaluate = e.functionComponent, e.evalute
-                if allLiterals:
-                    return MValue(evaluate(*[mvalue.value for mvalue in functionArgs]))
-                funcComponent = functionComponent
+                builtin: 'BuiltinFunction' = e.builtin
+                assert len(functionArgs) == builtin.numArgs, f"{builtin.name} takes {builtin.numArgs} arguments, not {len(functionArgs)}"
+                if allLiterals and builtin.evaluate != None:
+                    literals = [mvalue.value for mvalue in functionArgs]
+                    if builtin.usesTargetType:
+                        literals.insert(0, self.targetTypes.get(ctx))
+                    result = builtin.evaluate(*literals)
+                    if result != None:
+                        return MValue(result)
+                funcComponent = builtin.createComponent(e.parameters)
             funcComponent.addSourceTokens([(getSourceFilename(ctx), ctx.getSourceInterval()[0])])
             # hook up the funcComponent to the arguments passed in.
             for i in range(len(functionArgs)):
@@ -2446,11 +2968,13 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
     @decorateForErrorCatching
     def visitBeginEndBlock(self, ctx: build.MinispecPythonParser.MinispecPythonParser.BeginEndBlockContext):
         beginendScope = ctx.scope
+        previousParents = beginendScope.parents
         beginendScope.parents = [self.globalsHandler.currentScope] # in case we are in a fleeting if/case statement scope
         self.globalsHandler.enterScope(beginendScope)
         for stmt in ctx.stmt():
             self.visit(stmt)
         self.globalsHandler.exitScope()
+        beginendScope.parents = previousParents # so that we do not hold on to the fleeting scope
 
     @decorateForErrorCatching
     def visitRegWrite(self, ctx: build.MinispecPythonParser.MinispecPythonParser.RegWriteContext):
@@ -2552,8 +3076,8 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
         Use in visitIfStmt and visitCaseStmt. '''
         # we run both branches in separate scopes, then combine
 
-        ifScope = Scope(self.globalsHandler, "ifScope", [self.globalsHandler.currentScope], fleeting=True)
-        elseScope = Scope(self.globalsHandler, "elseScope", [self.globalsHandler.currentScope], fleeting=True)
+        ifScope = FleetingScope("ifScope", self.globalsHandler.currentScope)
+        elseScope = FleetingScope("elseScope", self.globalsHandler.currentScope)
         originalScope = self.globalsHandler.currentScope
 
         self.globalsHandler.currentScope = ifScope
@@ -2566,17 +3090,23 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
         # TODO source for 'else' token
         self.copyBackIfStmt(originalScope, condition, [ifScope, elseScope], [mtypes.BooleanLiteral(True), mtypes.BooleanLiteral(False)], tokensSourcedFrom)
 
-    def copyBackIfStmt(self, originalScope: 'Scope', condition: 'MValue', childScopes: 'list[Scope]', conditionLiterals: 'list[mtypes.MLiteral]', tokensSourcedFrom = None):
+    def copyBackIfStmt(self, originalScope: 'Scope', condition: 'MValue', childScopes: 'list[FleetingScope]', conditionLiterals: 'list[mtypes.MLiteral]', tokensSourcedFrom = None):
         ''' Given a collection of child scopes, the original scope, and a condition node, copies the variables set in the 
         child scopes back into the original scope with muxes controlled by the condition node.
-        conditionLiterals is the list of MLiterals which indicate which child scope would be selected. '''
+        conditionLiterals is the list of MLiterals which indicate which child scope would be selected.
+        Releases the child scopes afterwards. '''
         self.globalsHandler.currentScope = originalScope
         varsToBind = set()
         for scope in childScopes:
-            for var in scope.temporaryScope.temporaryValues:
+            for var in scope.temporaryValues:
                 varsToBind.add(var)
         for var in varsToBind:
-            values: 'list[MValue]' = [ scope.get(self, var) for scope in childScopes ]  # if var doesn't appear in one of these scopes, the lookup will find its original value
+            values: 'list[MValue]' = [ scope.get(self, var).resolveToNodeOrMLiteral(self) for scope in childScopes ]  # if var doesn't appear in one of these scopes, the lookup will find its original value
+            merged = self.mergeLiteralValues(values)
+            if merged != None:
+                # the variable has the same literal value (up to don't-care bits) whichever scope is selected
+                originalScope.set(merged, var)
+                continue
             # since the control signal is hardware, we convert the values to hardware as well (if needed)
             muxComponent = hardware.Mux([ hardware.Node('v'+str(i)) for i in range(len(values)) ], hardware.Node('c'))
             muxComponent.inputNames = [str(value) for value in conditionLiterals]
@@ -2587,10 +3117,64 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
             hardware.Wire(condition, muxComponent.control)
             self.globalsHandler.currentComponent.addChild(muxComponent)
             originalScope.set(MValue(muxComponent.output), var)
+        for scope in childScopes:
+            scope.release()
+
+    def getLiteralCaseTable(self, ctx) -> 'LiteralCaseTable|None':
+        ''' Returns the LiteralCaseTable of the case expression or statement ctx, or None if not all of its selection
+        expressions are integer literals or enum tags (of the same type). The table is cached on ctx. '''
+        if not hasattr(ctx, 'literalCaseTable'):
+            ctx.literalCaseTable = self.buildLiteralCaseTable(ctx)
+        return ctx.literalCaseTable
+
+    def buildLiteralCaseTable(self, ctx) -> 'LiteralCaseTable|None':
+        items = []  # pairs (selection expression ctxs, arm ctx) in order
+        default = None
+        if ctx.__class__ == build.MinispecPythonParser.MinispecPythonParser.CaseExprContext:
+            for caseExprItem in ctx.caseExprItem():
+                if not caseExprItem.exprPrimary():
+                    default = caseExprItem.expression()
+                    break
+                items.append((caseExprItem.exprPrimary(), caseExprItem.expression()))
+        else:
+            for caseStmtItem in ctx.caseStmtItem():
+                items.append((caseStmtItem.expression(), caseStmtItem.stmt()))
+            if ctx.caseStmtDefaultItem():
+                default = ctx.caseStmtDefaultItem().stmt()
+        literalClass = None
+        arms = {}
+        for selectors, arm in items:
+            for selector in selectors:
+                if not isSourceLiteral(selector):
+                    return None
+                value = self.visit(selector).value
+                if not (mtypes.isMLiteral(value) and (value.__class__ == mtypes.Integer or value.isBitLiteral()
+                        or value.__class__ == mtypes.Bool or value.__class__.untypedef()._constructor == mtypes.Enum)):
+                    return None
+                if literalClass != None and value.__class__ != literalClass:
+                    return None
+                literalClass = value.__class__
+                arms.setdefault(value.value, arm)  # the first arm with a given selector is the one which runs
+        if literalClass == None:
+            return None
+        return LiteralCaseTable(literalClass, arms, default)
+
+    def mergeLiteralValues(self, values: 'list[MValue]') -> 'MValue|None':
+        ''' If every value is a literal and some literal is a possible value of all of them (see mtypes.mergeLiterals),
+        returns the merged literal, which can replace a mux selecting between the values. Otherwise returns None. '''
+        if not all(value.isLiteralValue() for value in values):
+            return None
+        merged = mtypes.mergeLiterals([value.value for value in values])
+        if merged is None:
+            return None
+        mergedValue = MValue(merged)
+        for value in values:
+            mergedValue = mergedValue.appendSourceTokens(value)
+        return mergedValue
 
     @decorateForErrorCatching
     def visitIfStmt(self, ctx: build.MinispecPythonParser.MinispecPythonParser.IfStmtContext):
-        condition = self.visit(ctx.expression()).resolveToNodeOrMLiteral(self)
+        condition = self.visit(ctx.expression()).resolveToNodeOrMLiteral(self).resolveUnknownToNode(self)
         if mtypes.isMLiteral(condition.value):
             # we select the appropriate branch
             if condition.value == mtypes.BooleanLiteral(True):
@@ -2602,8 +3186,6 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
             self.runIfStmt(condition, ctx.stmt(0), ctx.stmt(1), ctx)
 
     def doCaseStmtStep(self, expr: 'MValue', expri: 'list', index: 'int', defaultItem: 'None|build.MinispecPythonParser.MinispecPythonParser.CaseStmtDefaultItemContext') -> None:
-        ifScope = Scope(self.globalsHandler, "ifScope", [self.globalsHandler.currentScope], fleeting=True)
-        elseScope = Scope(self.globalsHandler, "elseScope", [self.globalsHandler.currentScope], fleeting=True)
         originalScope = self.globalsHandler.currentScope
 
         expr = expr.resolveToNodeOrMLiteral(self)
@@ -2639,6 +3221,9 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
             self.globalsHandler.currentComponent.addChild(eqComp)
             condition = MValue(eqComp.output)
 
+        ifScope = FleetingScope("ifScope", originalScope)
+        elseScope = FleetingScope("elseScope", originalScope)
+
         self.globalsHandler.currentScope = ifScope
         self.visit(ifStmt)
 
@@ -2675,14 +3260,22 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
         If all expri evaluate to literals and all possibilities are covered, we run each branch in parallel
         and use multi-input muxes.
         '''
-        expr = self.visit(ctx.expression())
+        expr = self.visit(ctx.expression()).resolveUnknownToNode(self)
+        if expr.isLiteralValue():
+            # when the selection expressions are written as literals, look up the statement to run directly
+            table = self.getLiteralCaseTable(ctx)
+            if table != None and table.applies(expr.value):
+                stmt = table.select(expr.value)
+                if stmt != None:
+                    self.visit(stmt)
+                return
         allExprLiteral = expr.isLiteralValue()
         allExpriLiteral = True
         expri: 'list[tuple[MValue, Any]]' = []  # list of pairs [self.visit(exprCtx), stmtCtx] in order that they should be considered, excluding the default case and skipping repeat literals.
         expriLiterals: 'list[mtypes.MLiteral]' = [] # list of literals found when visiting each expri
         for caseStmtItem in ctx.caseStmtItem():
             for expression in caseStmtItem.expression():
-                currentExpr = self.visit(expression).resolveToNodeOrMLiteral(self)
+                currentExpr = self.visit(expression).resolveToNodeOrMLiteral(self).resolveUnknownToNode(self)
                 if currentExpr.isLiteralValue():
                     duplicate = False
                     for otherLiteral in expriLiterals:
@@ -2730,7 +3323,7 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
                 coversAllCases = False
             scopes = []
             for i in range(len(expri) + (0 if coversAllCases else 1)):
-                childScope = Scope(self.globalsHandler, "childScope"+str(i), [self.globalsHandler.currentScope], fleeting=True)
+                childScope = FleetingScope("childScope"+str(i), self.globalsHandler.currentScope)
                 scopes.append(childScope)
             originalScope = self.globalsHandler.currentScope
 
@@ -2772,6 +3365,8 @@ class SynthesizerVisitor(build.MinispecPythonVisitor.MinispecPythonVisitor):
             self.visit(ctx.stmt())
             nextIterVal = self.visit(ctx.expression(2)).resolveMValue(self)
             assert nextIterVal.isLiteralValue(), "For loops must be unrolled before synthesis"
+            # the sources of the loop variable repeat each iteration, so they are deduplicated to keep the unrolling linear
+            nextIterVal = MValue(nextIterVal.value).mergeSourceTokens(nextIterVal._tokensSourcedFrom)
             self.globalsHandler.currentScope.set(nextIterVal, iterVarName)
             checkDone = self.visit(ctx.expression(1)).value
             assert mtypes.isMLiteral(checkDone) and checkDone.__class__ == mtypes.BooleanLiteral, "For loops must be unrolled before synthesis"
@@ -2799,15 +3394,48 @@ def getSourceFilename(node: 'ctxType') -> 'str':
     return "unknown_filename"
 
 from typing import Callable # for annotation function calls
-def parseAndSynth(text: 'str', topLevel: 'str', filename: 'str' ='', pullTextFromImport: 'Callable[[int],int]' = lambda x: 1/0, sourceFilesCollect: 'list[tuple[str, str]]' = []) -> 'hardware.Component':
+def parseAndSynth(text: 'str', topLevel: 'str', filename: 'str' ='', pullTextFromImport: 'Callable[[int],int]' = lambda x: 1/0, sourceFilesCollect: 'list[tuple[str, str]]' = None, design: 'hardware.Design' = None, budget: 'ElaborationBudget' = None, detach: 'bool' = True) -> 'hardware.Component':
     ''' text is the text to parse and synthesize.
     topLevel is the name (including parametrics) of the function/module to synthesize.
     filename is the name of the file that text is from (no .ms).
     pullTextFromImport is a function that takes in the name of a minispec file to parse (no .ms)
     and returns the text of the given file.
     sourceFilesCollect is a mutable list that will be appended with tuples (filename, text) for all
-    files imported, including the original source file.'''
-
+    files imported, including the original source file.
+    design is the hardware.Design to synthesize under. If None, a fresh Design is used, so that
+    separate calls (possibly on separate threads) share no state.
+    budget is an optional ElaborationBudget. If it is exceeded, a BudgetExceededException is thrown.
+    If detach is True, the returned hardware holds no references to parse trees or scopes (see detachElaborationState).'''
+    if sourceFilesCollect == None:
+        sourceFilesCollect = []
+    if design == None:
+        design = hardware.Design()
+    with design:
+        try:
+            output = _parseAndSynth(text, topLevel, filename, pullTextFromImport, sourceFilesCollect, budget)
+        except BudgetExceededException as e:
+            if detach and e.partial != None:
+                detachElaborationState(e.partial)
+            raise e
+    if detach:
+        detachElaborationState(output)
+    return output
+
+def detachElaborationState(root: 'hardware.Component'):
+    ''' Drops all references from the given hardware into parse or elaboration state, so that the
+    ANTLR parse trees, token streams, and scopes may be garbage collected once synthesis is finished.
+    The only such references are the ModuleWithMetadata/BluespecModuleWithMetadata objects attached to
+    modules, which hold scopes, parse tree contexts (eg methods with arguments), and MValues.
+    After detaching, the hardware can no longer be used as a submodule in further synthesis. '''
+    toVisit: 'list[hardware.Component]' = [root]
+    while len(toVisit) > 0:
+        component = toVisit.pop()
+        if isinstance(component, hardware.Module):
+            component.metadata = None
+        toVisit.extend(component._children)
+
+def _parseAndSynth(text: 'str', topLevel: 'str', filename: 'str', pullTextFromImport: 'Callable[[int],int]', sourceFilesCollect: 'list[tuple[str, str]]', budget: 'ElaborationBudget|None') -> 'hardware.Component':
+    ''' Does the work of parseAndSynth under the current hardware.Design. '''
     tree = getParseTree(text)
 
     globalsHandler = GlobalsHandler()
@@ -2846,7 +3474,7 @@ def parseAndSynth(text: 'str', topLevel: 'str', filename: 'str' ='', pullTextFro
     # for scope in globalsHandler.allScopes:
     #     print(scope)
 
-    synthesizer = SynthesizerVisitor(globalsHandler)
+    synthesizer = SynthesizerVisitor(globalsHandler, budget)
 
     topLevel = f'''
 function Bool _();
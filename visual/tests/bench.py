@@ -0,0 +1,660 @@
+'''
+Microbenchmarks for the minispec interpreter and hardware representation.
+
+To run the benchmarks, call `python3 bench.py`. To run only some of them, pass part of the
+benchmark names, eg `python3 bench.py bit`.
+
+Each benchmark times a reference implementation (usually the implementation which was
+replaced) against the current one and prints both times and the speedup. The reference
+implementations are kept in this file so that the comparison stays reproducible.
+'''
+
+# needed to import synth.py and hardware.py since they are in a different folder
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hardware import *
+from mtypes import *
+import synth
+
+import timeit
+import pathlib
+
+# Setup to run the benchmarks in order
+benchmarks = []  # Array[(benchmarkName: str, benchmarkFunc: ()=>{}) | categoryName: str]
+def benchmark(name: 'str'):
+    ''' Decorator for a benchmark. The decorated function is called with no arguments and should call compare. '''
+    def decorator(func):
+        benchmarks.append((name, func))
+        return func
+    return decorator
+def describe(name: 'str'):
+    benchmarks.append(name)
+
+def timeCall(func: 'Callable[[], Any]', number: 'int') -> 'float':
+    ''' Returns the best time, in seconds, of three runs of number calls to func. '''
+    return min(timeit.repeat(func, number=number, repeat=3))
+
+def compare(label: 'str', reference: 'Callable[[], Any]', current: 'Callable[[], Any]', number: 'int' = 10000):
+    ''' Times reference and current and prints the result. '''
+    referenceTime, currentTime = timeCall(reference, number), timeCall(current, number)
+    print(f"      {label:<40} reference {referenceTime*1000:9.2f}ms   current {currentTime*1000:9.2f}ms   speedup {referenceTime/currentTime:6.2f}x")
+
+
+describe('''Bit Literals''')
+
+def LegacyBit(n: 'IntegerLiteral'):
+    ''' The Bit#(n) literal class before bit literals were int-backed with cached masks. '''
+    class LegacyBitLiteral:
+        def __init__(self, value: 'int'):
+            self.n = n
+            assert value.__class__ == int, f"Expected int, not {value} which is {value.__class__}"
+            self.value = value % (2**n.value)
+        def __str__(self):
+            output = ""
+            val = self.value
+            for i in range(self.n.value):
+                output = str(val % 2) + output
+                val //= 2
+            return str(self.n) + "'b" + output
+        def add(self, other):
+            return LegacyBit(self.n)((self.value + other.value) % (2**self.n.value))
+        def inv(self):
+            return LegacyBit(self.n)(~self.value)
+        def slice(self, msb, lsb):
+            width = msb.value - lsb.value + 1
+            return LegacyBit(IntegerLiteral(width))((self.value >> lsb.value) % 2**(width))
+    return LegacyBitLiteral
+
+@benchmark('''Creating, operating on and printing Bit#(32) literals''')
+def _():
+    n = IntegerLiteral(32)
+    legacy, current = LegacyBit(n)(0xdeadbeef), Bit(n)(0xdeadbeef)
+    compare('construct', lambda: LegacyBit(n)(0xdeadbeef), lambda: Bit(n)(0xdeadbeef))
+    compare('add', lambda: legacy.add(legacy), lambda: binaryOperation(current, current, '+'))
+    compare('inv', legacy.inv, current.inv)
+    msb, lsb = IntegerLiteral(15), IntegerLiteral(4)
+    compare('slice', lambda: legacy.slice(msb, lsb), lambda: current.slice(msb, lsb))
+    compare('str', legacy.__str__, current.__str__)
+    print(f"      {'instance size (bytes)':<40} reference {sys.getsizeof(legacy) + sys.getsizeof(legacy.__dict__):9d}     current {sys.getsizeof(current):9d}")
+
+
+describe('''Vector Literals''')
+
+@benchmark('''Element-wise operations on a Vector#(256, Bit#(32))''')
+def _():
+    import mtypes
+    print(f"      (numpy {'is' if mtypes.numpy != None else 'is not'} available)")
+    b32 = Bit(IntegerLiteral(32))
+    v256 = Vector(IntegerLiteral(256), b32)
+    left, right = v256([Integer(i * 7919) for i in range(256)]), v256([Integer(i * 104729) for i in range(256)])
+    leftElements, rightElements = left.elements(), right.elements()
+    def referenceAdd():
+        return [binaryOperation(leftElements[i], rightElements[i], '+') for i in range(256)]
+    compare('add', referenceAdd, lambda: binaryOperation(left, right, '+'), number=200)
+    def referenceReduce():
+        result = leftElements[0]
+        for element in leftElements[1:]:
+            result = binaryOperation(result, element, '^')
+        return result
+    compare('xor reduction', referenceReduce, lambda: left.reduceLanes('^'), number=200)
+
+@benchmark('''Unrolling a loop which fills a ROM of 256 and 512 entries''')
+def _():
+    # each write folds into the vector literal in place, so unrolling takes time linear in the number of entries
+    def rom(n: 'int') -> 'str':
+        return f'''function Bit#(16) rom(Bit#({(n-1).bit_length()}) i);
+    Vector#({n}, Bit#(16)) table;
+    for (Integer j = 0; j < {n}; j = j + 1) table[j] = j * 3;
+    return table[i];
+endfunction'''
+    times = {}
+    for n in (256, 512):
+        text = rom(n)
+        times[n] = timeCall(lambda: synth.parseAndSynth(text, 'rom'), number=1)
+        print(f"      {f'rom of {n} entries':<40} current {times[n]*1000:9.2f}ms")
+    print(f"      {'512 entries / 256 entries':<40} ratio   {times[512]/times[256]:6.2f}x (about 2x if unrolling is linear)")
+
+
+describe('''Type Inference''')
+
+def legacyMergeEqualTypes(type1: 'MType', type2: 'MType') -> 'MType':
+    ''' mergeEqualTypes before types were joined in a lattice (without the handling of strangely different types). '''
+    if type1 == DontCareLiteral:
+        return type2
+    if type2 == DontCareLiteral:
+        return type1
+    if type1 == Any:
+        return type2
+    if type2 == Any:
+        return type1
+    if type1 == Integer and type2.isBitLiteral(None):
+        return type2
+    if type2 == Integer and type1.isBitLiteral(None):
+        return type1
+    return type1
+
+def legacyUpdateTypes(comp: 'Component') -> 'set[Node]':
+    ''' Mux.updateTypes before type inference used a union-find. '''
+    nodesUpdated = set()
+    if comp.__class__ != Mux:
+        return nodesUpdated
+    nodesThatShouldMatch = set(comp.inputs + [comp.output])
+    typeToUse = Any
+    for node in nodesThatShouldMatch:
+        typeToUse = legacyMergeEqualTypes(node._mtype, typeToUse)
+    for node in nodesThatShouldMatch:
+        if node._mtype != typeToUse:
+            node._mtype = typeToUse
+            nodesUpdated.add(node)
+    return nodesUpdated
+
+def legacySetWireTypes(comp: 'Component'):
+    ''' setWireTypes before type inference used a union-find: sweeps of the nodes whose types changed. '''
+    nodesToUpdate: 'set[Node]' = set()
+    components = [comp]
+    while len(components) > 0:
+        component = components.pop()
+        nodesToUpdate.update(component._inputs.values())
+        nodesToUpdate.update(component._outputs.values())
+        components.extend(component.children)
+    nextNodes: 'set[Node]' = set()
+    while len(nodesToUpdate) != 0:
+        for node in nodesToUpdate:
+            sharedType = node._mtype
+            for wire in node.inWires:
+                sharedType = legacyMergeEqualTypes(wire._mtype, sharedType)
+            for wire in node.outWires:
+                sharedType = legacyMergeEqualTypes(wire._mtype, sharedType)
+            node._mtype = sharedType
+            for wire in node.inWires:
+                if wire._mtype != sharedType:
+                    wire._mtype = sharedType
+                    nextNodes.add(wire.src)
+            for wire in node.outWires:
+                if wire._mtype != sharedType:
+                    wire._mtype = sharedType
+                    nextNodes.add(wire.dst)
+            nextNodes.update(legacyUpdateTypes(node.parent))
+        nodesToUpdate = nextNodes
+        nextNodes = set()
+
+@benchmark('''Typing a chain of muxes with 100k nodes''')
+def _():
+    with Design():
+        # each mux selects between the previous mux and an Integer constant, so the Bit#(8) type of the
+        # first constant has to travel down the whole chain.
+        first = Constant(Bit(IntegerLiteral(8))(1))
+        top = Function('top', [], Node(), {first})
+        previous = first.output
+        for i in range(25000):
+            c, m = Constant(Integer(i)), Mux([Node(), Node()])
+            top.addChild(c), top.addChild(m)
+            Wire(previous, m.inputs[0]), Wire(c.output, m.inputs[1])
+            previous = m.output
+        Wire(previous, top.output)
+        nodes = [node for child in top.children for node in list(child._inputs.values()) + list(child._outputs.values())] + [top.output]
+        print(f"      ({len(nodes)} nodes)")
+        untyped = [(node, node._mtype) for node in nodes]
+        wires = [wire for node in nodes for wire in node.outWires]
+        def reset():
+            for node, mtype in untyped:
+                node._mtype = mtype
+            for wire in wires:
+                wire._mtype = Any
+        def reference():
+            reset()
+            legacySetWireTypes(top)
+        def current():
+            reset()
+            setWireTypes(top)
+        compare('setWireTypes', reference, current, number=1)
+        assert top.output._mtype == Bit(IntegerLiteral(8))
+
+
+
+describe('''Subtree Statistics''')
+
+def legacyWeight(self) -> 'int':
+    ''' Component.weight before subtree statistics were cached. '''
+    return 1 + sum([c.weight() for c in self._children])
+
+def legacyGetAllWires(self) -> 'set[Wire]':
+    ''' Component.getAllWires before it was iterative. '''
+    wires = set()
+    for child in self._children:
+        for wire in child.getAllWires():
+            wires.add(wire)
+    for nodeKey in self._inputs:
+        for wire in self._inputs[nodeKey].outWires:
+            wires.add(wire)
+    for nodeKey in self._outputs:
+        for wire in self._outputs[nodeKey].outWires:
+            wires.add(wire)
+    return wires
+
+@benchmark('''Exporting a hierarchy of nested functions 400 deep to ELK''')
+def _():
+    with Design():
+        # each level holds the next level and an adder, chained together
+        inner = Function('leaf', [Node()], Node())
+        Wire(inner.inputs[0], inner.output)
+        for i in range(400):
+            add = Function('+', [Node(), Node()])
+            outer = Function(f'level{i}', [Node()], Node(), {inner, add})
+            Wire(outer.inputs[0], inner.inputs[0]), Wire(inner.output, add.inputs[0]), Wire(outer.inputs[0], add.inputs[1]), Wire(add.output, outer.output)
+            inner = outer
+    def withLegacyStatistics(func):
+        def reference():
+            weight, getAllWires = Component.weight, Component.getAllWires
+            Component.weight, Component.getAllWires = legacyWeight, legacyGetAllWires
+            try:
+                return func()
+            finally:
+                Component.weight, Component.getAllWires = weight, getAllWires
+        return reference
+    compare('weight of every component', withLegacyStatistics(lambda: [c.weight() for c in hardwareComponents(inner)]), lambda: [c.weight() for c in hardwareComponents(inner)], number=3)
+    compare('getELK', withLegacyStatistics(lambda: getELK(inner)), lambda: getELK(inner), number=3)
+
+def hardwareComponents(root: 'Component') -> 'list[Component]':
+    ''' Returns the Components in the tree of root. '''
+    components, toVisit = [], [root]
+    while len(toVisit) > 0:
+        component = toVisit.pop()
+        components.append(component)
+        toVisit.extend(component._children)
+    return components
+
+
+describe('''Garbage Collection''')
+
+@benchmark('''Collecting 2000 unused chains of 20 functions''')
+def _():
+    def build() -> 'Component':
+        f = Function('f', [Node()], Node())
+        for i in range(2000):
+            previous = f.inputs[0]
+            for j in range(20):
+                inv = Function('~', [Node()])
+                f.addChild(inv)
+                Wire(previous, inv.inputs[0])
+                previous = inv.output
+        return f
+    # each run builds the hardware, since collecting it is destructive
+    with Design():
+        compare('build only', build, build, number=1)
+        compare('build and collect', lambda: garbageCollection1(build()), lambda: garbageCollection2(build()), number=1)
+
+
+describe('''Vector Vacuum''')
+
+def legacyVacuumIntoVectors(comp: 'Component'):
+    ''' vacuumIntoVectors before vacuuming used a worklist. '''
+    if comp.__class__ == VectorModule:
+        legacyVacuumIntoVectorModule(comp)
+    for child in comp.children.copy():
+        legacyVacuumIntoVectors(child)
+
+def legacyVacuumIntoVectorModule(vector: 'VectorModule'):
+    progress = True
+    while progress:
+        progress = False
+        for child in vector.children.copy():
+            if len(child.outputs) == 1:
+                output = child.output
+                for wire in output.outWires:
+                    dstComp: 'Component' = wire.dst.parent
+                    if dstComp.parent == vector:
+                        continue
+                    if len(dstComp.outputs) == 1:
+                        output2 = dstComp.output
+                        if len(output2.outWires) == 1:
+                            wire2 = list(output2.outWires)[0]
+                            dstComp2 = wire2.dst.parent
+                            if dstComp2.parent == vector:
+                                dstComp.parent.removeChild(dstComp)
+                                vector.addChild(dstComp)
+                                progress = True
+            for inputKey, input in child._inputs.items():
+                for wire in input.inWires:
+                    src = wire.src
+                    if len(src.outWires) == 1:
+                        dstComp = src.parent
+                        if dstComp.parent != vector:
+                            dstComp.parent.removeChild(dstComp)
+                            vector.addChild(dstComp)
+                            progress = True
+
+vectorSource = '''
+module Shifter;
+    Vector#(256, Reg#(Bit#(8))) regs(0);
+    input Bit#(8) data;
+    input Bit#(8) sel;
+    method Bit#(8) out = regs[sel];
+    rule tick;
+        regs[0] <= data;
+        for (Integer i = 1; i < 256; i = i + 1)
+            regs[i] <= regs[i-1] + data;
+    endrule
+endmodule
+
+module Chains;
+    Vector#(64, Reg#(Bit#(8))) regs(0);
+    input Bit#(8) data;
+    method Bit#(8) out = regs[63];
+    rule tick;
+        for (Integer i = 0; i < 64; i = i + 1) begin
+            Bit#(8) x = regs[i];
+            for (Integer j = 0; j < 16; j = j + 1)
+                x = x + data;
+            regs[i] <= x;
+        end
+    endrule
+endmodule
+'''
+
+@benchmark('''Vacuuming a shift register and adder chains into their vectors''')
+def _():
+    import netlist
+    for name in ['Shifter', 'Chains']:
+        synthesized = synth.parseAndSynth(vectorSource, name)
+        store = netlist.Netlist.fromComponent(synthesized)
+        def fresh() -> 'Component':
+            with Design():
+                return store.toComponent()
+        def placement(root: 'Component') -> 'list[tuple[int, int]]':
+            ''' The number of components in each vector, in a deterministic order. '''
+            return sorted((component.weight(), component.numNodes()) for component in hardwareComponents(root) if component.__class__ == VectorModule)
+        legacy, current = fresh(), fresh()
+        legacyVacuumIntoVectors(legacy)
+        vacuumIntoVectors(current)
+        assert placement(legacy) == placement(current), f"Expected the same placement, not {placement(legacy)} and {placement(current)}"
+        print(f"      ({name}: {synthesized.weight()} components, vectors {placement(current)} after vacuuming)")
+        # vacuuming moves components, so each run gets its own copy
+        legacyCopies, currentCopies = iter([fresh() for i in range(3)]), iter([fresh() for i in range(3)])
+        compare(f'{name}: vacuum', lambda: legacyVacuumIntoVectors(next(legacyCopies)), lambda: vacuumIntoVectors(next(currentCopies)), number=1)
+
+
+describe('''Common Ancestors''')
+
+class LegacyCommonAncestors:
+    ''' The edge placement in getELK before common ancestors were indexed, which walks up from both ends. '''
+    def __init__(self, root: 'Component'):
+        pass
+    def lowestCommonAncestor(self, first: 'Component', second: 'Component') -> 'Component':
+        currentELK: 'Component' = first
+        sourceParents: 'list[Component]' = [currentELK]
+        while currentELK.parent != None:
+            currentELK = currentELK.parent
+            sourceParents.append(currentELK)
+        currentELK = second
+        while currentELK not in sourceParents:
+            currentELK = currentELK.parent
+        return currentELK
+
+@benchmark('''Placing the edges of nested functions 100 to 400 deep in ELK''')
+def _():
+    import hardware
+    def withLegacyAncestors(func):
+        def reference():
+            hardware.CommonAncestors = LegacyCommonAncestors
+            try:
+                return func()
+            finally:
+                hardware.CommonAncestors = CommonAncestors
+        return reference
+    for depth in [100, 200, 400]:
+        with Design():
+            # each level holds the next level and an adder, and every level is wired to the leaf
+            leaf = Function('leaf', [Node()], Node())
+            inner = leaf
+            for i in range(depth):
+                add = Function('+', [Node(), Node()])
+                outer = Function(f'level{i}', [Node()], Node(), {inner, add})
+                Wire(outer.inputs[0], inner.inputs[0]), Wire(inner.output, add.inputs[0]), Wire(leaf.output, add.inputs[1]), Wire(add.output, outer.output)
+                inner = outer
+        assert withLegacyAncestors(lambda: getELK(inner))() == getELK(inner)
+        compare(f'getELK, {depth} deep', withLegacyAncestors(lambda: getELK(inner)), lambda: getELK(inner), number=1)
+
+
+describe('''Hardware Index''')
+
+@benchmark('''Querying a synthesized rca#(512)''')
+def _():
+    import hwindex
+    text = pathlib.Path(__file__).with_name('assortedtests.ms').read_text()
+    design = synth.parseAndSynth(text, 'rca#(512)')
+    index = hwindex.HardwareIndex(design)
+    token = design.getSourceTokens()[0]
+    print(f"      ({index})")
+    def traverse(predicate) -> 'set[Component]':
+        return {component for component in hardwareComponents(design) if predicate(component)}
+    def fanout(component: 'Component') -> 'int':
+        return sum(len(node.outWires) for node in component._outputs.values())
+    assert traverse(lambda component: component.name == '^') == index.named('^')
+    compare('components named ^', lambda: traverse(lambda component: component.name == '^'), lambda: index.named('^'), number=10)
+    compare('components of a class', lambda: traverse(lambda component: component.__class__ == Constant), lambda: index.ofClass(Constant), number=10)
+    compare('components from a source token', lambda: traverse(lambda component: token in component.getSourceTokens()), lambda: index.sourcedFrom(*token), number=10)
+    compare('components with fanout at least 3', lambda: traverse(lambda component: fanout(component) >= 3), lambda: index.withFanoutAtLeast(3), number=10)
+    # building the index costs a few queries by traversal, after which each query is almost free
+    compare('one source query vs building the index', lambda: traverse(lambda component: token in component.getSourceTokens()), lambda: hwindex.HardwareIndex(design), number=1)
+
+
+describe('''Hardware Diffs''')
+
+@benchmark('''Diffing two syntheses of rca#(128)''')
+def _():
+    import hwdiff
+    text = pathlib.Path(__file__).with_name('assortedtests.ms').read_text()
+    first, second = synth.parseAndSynth(text, 'rca#(128)'), synth.parseAndSynth('// edited\n' + text, 'rca#(128)')
+    result = hwdiff.diff(first, second)
+    assert result.isEmpty() and canonicalForm(first).digest == canonicalForm(second).digest
+    print(f"      ({len(result.matched)} components matched)")
+    # the canonical forms only tell whether anything changed, the diff also matches the two trees
+    compare('canonical forms vs diff', lambda: canonicalForm(first).digest == canonicalForm(second).digest, lambda: hwdiff.diff(first, second), number=1)
+    compare('synthesis vs diff', lambda: synth.parseAndSynth(text, 'rca#(128)'), lambda: hwdiff.diff(first, second), number=1)
+
+
+describe('''Combinational Levels''')
+
+def relaxedLevels(root: 'Component') -> 'dict[Component, int]':
+    ''' Levels of the combinational leaves by relaxation: raises the level of every leaf above its drivers
+    until nothing changes, which takes one pass over the design per level. '''
+    leaves = [component for component in hardwareComponents(root) if isCombinationalLeaf(component)]
+    drivers: 'dict[Component, list[Component]]' = {}
+    for leaf in leaves:
+        drivers[leaf] = []
+        for node in leaf._inputs.values():
+            while len(node._inWires) > 0:
+                node = next(iter(node._inWires))._src
+                if not node._isInput and len(node._parent._children) == 0:
+                    if not isinstance(node._parent, Module):
+                        drivers[leaf].append(node._parent)
+                    break
+    levels = {leaf: 0 for leaf in leaves}
+    progress = True
+    while progress:
+        progress = False
+        for leaf in leaves:
+            level = 1 + max((levels[driver] for driver in drivers[leaf]), default=-1)
+            if level != levels[leaf]:
+                levels[leaf] = level
+                progress = True
+    return levels
+
+@benchmark('''Levelizing a synthesized rca#(128)''')
+def _():
+    text = pathlib.Path(__file__).with_name('assortedtests.ms').read_text()
+    design = synth.parseAndSynth(text, 'rca#(128)')
+    levelization = levelize(design)
+    assert relaxedLevels(design) == levelization.levels
+    print(f"      ({len(levelization.levels)} combinational leaves in {levelization.depth()} levels)")
+    compare('levels', lambda: relaxedLevels(design), lambda: levelize(design), number=1)
+
+
+describe('''Timing''')
+
+@benchmark('''Estimating the critical path of a synthesized rca#(128)''')
+def _():
+    import timing
+    text = pathlib.Path(__file__).with_name('assortedtests.ms').read_text()
+    design = synth.parseAndSynth(text, 'rca#(128)')
+    setWireTypes(design)
+    inferWidths(design)
+    model = timing.LibertyDelayModel()
+    print(f"      ({timing.criticalPath(design, model).delay:.0f}ps through {len(timing.criticalPath(design, model).components)} components)")
+    # the synthesis flow takes seconds to minutes on top of synthesizing the hardware representation
+    compare('synthesis vs critical path', lambda: synth.parseAndSynth(text, 'rca#(128)'), lambda: timing.criticalPath(design, model), number=1)
+
+
+describe('''Area''')
+
+@benchmark('''Estimating the area of a synthesized rca#(128)''')
+def _():
+    import area
+    text = pathlib.Path(__file__).with_name('assortedtests.ms').read_text()
+    design = synth.parseAndSynth(text, 'rca#(128)')
+    setWireTypes(design)
+    inferWidths(design)
+    model = area.LibertyAreaModel()
+    print(f"      (area {area.estimateArea(design, model).total:.0f})")
+    # the synthesis flow takes seconds to minutes on top of synthesizing the hardware representation
+    compare('synthesis vs area', lambda: synth.parseAndSynth(text, 'rca#(128)'), lambda: area.estimateArea(design, model), number=1)
+    compare('synthesis vs area by line', lambda: synth.parseAndSynth(text, 'rca#(128)'), lambda: area.estimateArea(design, model, {'': text}), number=1)
+
+
+describe('''Canonical Forms''')
+
+@benchmark('''Matching two syntheses of the test designs''')
+def _():
+    text = pathlib.Path(__file__).with_name('assortedtests.ms').read_text()
+    for name in ['fullAdder', 'rca#(8)', 'barrelRShift']:
+        first, second = synth.parseAndSynth(text, name), synth.parseAndSynth(text, name)
+        assert first.matchBySearch(second) and first.match(second)
+        compare(name, lambda: first.matchBySearch(second), lambda: first.match(second), number=3)
+
+
+describe('''Netlists''')
+
+def retainedBytes(build: 'Callable[[], Any]') -> 'int':
+    ''' Returns the number of bytes allocated by build which are still in use after it returns. '''
+    import tracemalloc, gc
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return after - before
+
+def hardwareFanin(root: 'Component') -> 'int':
+    ''' Counts the Nodes in the fan-in cone of the outputs of root, following Wires and passing through Components. '''
+    seen = set()
+    toVisit = list(root._outputs.values())
+    while len(toVisit) > 0:
+        node = toVisit.pop()
+        if node in seen:
+            continue
+        seen.add(node)
+        for wire in node.inWires:
+            toVisit.append(wire.src)
+        if not node._isInput and node.parent != root:
+            toVisit.extend(node.parent._inputs.values())
+    return len(seen)
+
+def netlistFanin(store: 'netlist.Netlist') -> 'int':
+    ''' hardwareFanin over the columns of a Netlist. '''
+    nodeInWire, wireSrc, nodeIsInput, nodeParent = store.nodeInWire, store.wireSrc, store.nodeIsInput, store.nodeParent
+    seen = bytearray(store.numNodes())
+    toVisit = [node for node in store.ports(0) if not nodeIsInput[node]]
+    count = 0
+    while len(toVisit) > 0:
+        node = toVisit.pop()
+        if seen[node]:
+            continue
+        seen[node] = 1
+        count += 1
+        wire = nodeInWire[node]
+        if wire != -1:
+            toVisit.append(wireSrc[wire])
+        if not nodeIsInput[node] and nodeParent[node] != 0:
+            toVisit.extend(port for port in store.ports(nodeParent[node]) if nodeIsInput[port])
+    return count
+
+@benchmark('''Building and traversing a synthesized rca#(512)''')
+def _():
+    import netlist
+    text = pathlib.Path(__file__).with_name('assortedtests.ms').read_text()
+    design = synth.parseAndSynth(text, 'rca#(512)')
+    store = netlist.Netlist.fromComponent(design)
+    print(f"      ({store})")
+    def buildHardware():
+        with Design():
+            return store.toComponent()
+    compare('build from the columns', buildHardware, lambda: rebuildNetlist(store), number=3)
+    hardwareBytes, netlistBytes = retainedBytes(buildHardware), retainedBytes(lambda: rebuildNetlist(store))
+    print(f"      {'retained size (bytes)':<40} reference {hardwareBytes:9d}     current {netlistBytes:9d}   ratio   {hardwareBytes/netlistBytes:6.2f}x")
+    assert hardwareFanin(design) == netlistFanin(store)
+    compare('fan-in cone of the outputs', lambda: hardwareFanin(design), lambda: netlistFanin(store), number=10)
+    compare('wire count', lambda: len(design.getAllWires()), store.numWires, number=10)
+    compare('fanouts', lambda: [len(node.outWires) for node in hardwareNodes(design)], store.fanouts, number=10)
+
+def rebuildNetlist(store: 'netlist.Netlist') -> 'netlist.Netlist':
+    ''' Builds a copy of store with addComponent/addNode/addWire, the counterpart of store.toComponent. '''
+    import netlist
+    copy = netlist.Netlist()
+    for component in range(store.numComponents()):
+        copy.addComponent(netlist.componentClasses[store.componentClass[component]], store.atoms[store.componentName[component]], store.componentParent[component])
+        for node in store.ports(component):
+            copy.addNode(component, store.nodeIsInput[node], store.atoms[store.nodeLabel[node]], store.types[store.nodeType[node]], store.nodeNames.get(node, ""))
+    for wire, src in enumerate(store.wireSrc):
+        copy.addWire(src, store.wireDst[wire], store.types[store.wireType[wire]])
+    return copy
+
+def hardwareNodes(root: 'Component') -> 'list[Node]':
+    ''' Returns the Nodes of every Component in the tree of root. '''
+    nodes = []
+    toVisit = [root]
+    while len(toVisit) > 0:
+        component = toVisit.pop()
+        nodes.extend(component._inputs.values())
+        nodes.extend(component._outputs.values())
+        toVisit.extend(component._children)
+    return nodes
+
+
+@benchmark('''Saving and loading a synthesized rca#(512)''')
+def _():
+    import netlist, netlistio, tempfile, json
+    text = pathlib.Path(__file__).with_name('assortedtests.ms').read_text()
+    design = synth.parseAndSynth(text, 'rca#(512)')
+    store = netlist.Netlist.fromComponent(design)
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(pathlib.Path(directory).joinpath('rca.msn'))
+        netlistio.save(store, path)
+        elkBytes, netlistBytes = len(json.dumps(getELK(design), separators=(',', ':'))), pathlib.Path(path).stat().st_size
+        print(f"      {'file size (bytes)':<40} ELK JSON  {elkBytes:9d}     netlist {netlistBytes:9d}   ratio   {elkBytes/netlistBytes:6.2f}x")
+        def rebuild(store: 'netlist.Netlist') -> 'Component':
+            with Design():
+                return store.toComponent()
+        compare('synthesize vs load (mmap)', lambda: synth.parseAndSynth(text, 'rca#(512)'), lambda: netlistio.load(path), number=1)
+        compare('synthesize vs load (read)', lambda: synth.parseAndSynth(text, 'rca#(512)'), lambda: netlistio.load(path, useMmap=False), number=1)
+        compare('synthesize vs load and rebuild', lambda: synth.parseAndSynth(text, 'rca#(512)'), lambda: rebuild(netlistio.load(path)), number=1)
+        compare('fanouts of a loaded netlist', store.fanouts, netlistio.load(path).fanouts, number=10)
+
+
+#run all the benchmarks
+if __name__ == '__main__':
+    filters = [arg.lower() for arg in sys.argv[1:]]
+    for item in benchmarks:
+        if item.__class__ == str:
+            print(f"\n  {item}")
+            continue
+        name, func = item
+        if filters and not any(f in name.lower() for f in filters):
+            continue
+        print(f"    {name}")
+        func()
+    print()
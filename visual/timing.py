@@ -0,0 +1,175 @@
+import hardware
+import liberty
+from structures import composedCells, structureOf
+
+''' Timing estimates.
+The synthesis flow in ../synth reports the critical-path delay of a design after yosys and ABC have mapped it onto
+a Liberty library, which takes seconds to minutes. criticalPath estimates the same number from the hardware
+representation in milliseconds, by static timing analysis over the levelized graph (see levelize):
+    - A path starts at the value of a Register, after its clock-to-q delay, and ends at the input of a Register,
+      which must arrive a setup time before the clock. Designs without Registers (functions) are timed from their
+      inputs to their outputs instead.
+    - The combinational leaves are visited level by level. The arrival time at the outputs of a leaf is the
+      latest arrival time at its inputs plus the delay the model gives the leaf. Constants do not start paths.
+    - The latest end is the critical path, which is traced back through the leaf which set each arrival time.
+A DelayModel gives the delay of each combinational leaf, in ps. LibertyDelayModel adds up the delays of the gates on
+the critical path of the structure of each leaf (see structures.py, which area.py uses too), with gate delays from a
+Liberty library: each gate is timed as one stage of a chain of its own kind, with every stage driving `fanout`
+copies of the next, at the input transition the chain settles at. Select lines are buffered by a tree of BUFs to
+reach every bit. Since the delays and areas come from the same structures, `**` is timed as a multiplier, each of
+the width steps of a divider (`/` or `%`) is a subtraction followed by the mux which keeps or discards it, and a
+boolean not `!` is an INV. The structures are close to what ABC finds for small operators; the estimate is meant to rank
+designs and find their critical paths, not to match the synthesis flow to the picosecond.
+'''
+
+class DelayModel:
+    ''' Gives the delay of each combinational leaf, in ps. The default model is unit delay: every leaf other than a
+    Constant takes 1, so the length of a path is its number of leaves. '''
+    __slots__ = ()
+    def delay(self, component: 'hardware.Component') -> 'float':
+        return 0.0 if component.__class__ == hardware.Constant else 1.0
+    def clockToQ(self, register: 'hardware.Register') -> 'float':
+        return 0.0
+    def setup(self, register: 'hardware.Register') -> 'float':
+        return 0.0
+
+class LibertyDelayModel(DelayModel):
+    ''' Delays of leaves costed with the gates of a Liberty library, see the note above. '''
+    __slots__ = 'gates', 'fanout', 'registerDelay', 'registerSetup'
+    def __init__(self, library: 'liberty.Library|None' = None, fanout: 'int' = 4):
+        if library == None:
+            library = liberty.bundledLibrary()
+        self.fanout: 'int' = fanout
+        scale = library.timeUnit * 1e12  # to ps
+        self.gates: 'dict[str, float]' = {}  # the delay of each gate in a chain of its kind
+        for cell in library.cells.values():
+            if not cell.sequential and len(cell.delayArcs()) > 0:
+                self.gates[cell.name] = chainDelay(cell, fanout) * scale
+        gates = self.gates
+        for name, parts, path in composedCells:
+            if name not in gates:
+                gates[name] = sum(gates[part] for part in path)
+        registers = [cell for cell in library.cells.values() if cell.sequential]
+        assert len(registers) > 0, f"Library {library.name} has no sequential cell"
+        register = min(registers, key=lambda cell: cell.area)
+        slew = settledTransition(register, fanout * register.inputCapacitance())
+        self.registerDelay: 'float' = register.delay(slew, fanout * register.inputCapacitance()) * scale
+        self.registerSetup: 'float' = register.setup(slew, slew) * scale
+    def clockToQ(self, register: 'hardware.Register') -> 'float':
+        return self.registerDelay
+    def setup(self, register: 'hardware.Register') -> 'float':
+        return self.registerSetup
+    def buffers(self, loads: 'int') -> 'float':
+        ''' The delay of a tree of BUFs driving loads gate inputs. '''
+        levels = 0
+        while loads > self.fanout:
+            loads = -(-loads // self.fanout)
+            levels += 1
+        return levels * self.gates['BUF']
+    def delay(self, component: 'hardware.Component') -> 'float':
+        structure = structureOf(component)
+        return sum(count * self.gates[gate] for gate, count in structure.path.items()) + self.buffers(structure.loads)
+
+def settledTransition(cell: 'liberty.Cell', load: 'float') -> 'float':
+    ''' The input transition of a stage of a chain of cells, each driving load. '''
+    transition = 0.0
+    for i in range(8):
+        transition = cell.transition(transition, load)
+    return transition
+
+def chainDelay(cell: 'liberty.Cell', fanout: 'int') -> 'float':
+    ''' The delay of a stage of a chain of cells, each driving fanout copies of the next. '''
+    load = fanout * cell.inputCapacitance()
+    return cell.delay(settledTransition(cell, load), load)
+
+class TimingPath:
+    ''' A path through the combinational leaves of a design, from a start Node (a Register value or an input) to
+    an end Node (a Register input or an output). delay includes the clock-to-q and setup times of the Registers. '''
+    __slots__ = 'delay', 'start', 'end', 'components', 'wires', 'arrivals'
+    def __init__(self, delay: 'float', start: 'hardware.Node', end: 'hardware.Node', components: 'list[hardware.Component]', wires: 'list[hardware.Wire]', arrivals: 'list[float]'):
+        self.delay: 'float' = delay
+        self.start: 'hardware.Node' = start
+        self.end: 'hardware.Node' = end
+        self.components: 'list[hardware.Component]' = components  # the leaves on the path, in order
+        self.wires: 'list[hardware.Wire]' = wires
+        self.arrivals: 'list[float]' = arrivals  # the arrival time at the output of each leaf
+    def isRegisterToRegister(self) -> 'bool':
+        return self.start._parent.__class__ == hardware.Register and self.end._parent.__class__ == hardware.Register
+    def getSourceTokens(self) -> 'list[tuple[str, int]]':
+        ''' Returns the source tokens of the Components and Wires on the path, without duplicates. '''
+        tokens = []
+        for item in self.components + self.wires:
+            tokens.extend(token for token in item.getSourceTokens() if token not in tokens)
+        return tokens
+    def __str__(self):
+        return f"critical path of {self.delay:.1f}ps from {self.start._parent._name} through " + \
+            ", ".join(component._name for component in self.components) + f" to {self.end._parent._name}" + \
+            " (source tokens " + ", ".join(f"{filename or '<unknown>'}:{token}" for filename, token in self.getSourceTokens()) + ")"
+
+def driverOf(node: 'hardware.Node') -> 'tuple[hardware.Node, list[hardware.Wire]]':
+    ''' Follows the Wires into node back to the Node driving it (the output of a leaf or an input of root) and
+    returns the driver and the Wires followed, in order. A Node with several Wires into it follows the first. '''
+    wires = []
+    while len(node._inWires) > 0:
+        wire = next(iter(node._inWires))
+        wires.append(wire)
+        node = wire._src
+        if not node._isInput and len(node._parent._children) == 0:
+            break
+    wires.reverse()
+    return node, wires
+
+def criticalPath(root: 'hardware.Component', model: 'DelayModel|None' = None) -> 'TimingPath|None':
+    ''' The critical path of the design root, see the note above. Returns None if there is no timed path. '''
+    if model == None:
+        model = LibertyDelayModel()
+    components = [root]
+    for component in components:  # grows as we go
+        components.extend(component._children)
+    registers = [component for component in components if component.__class__ == hardware.Register]
+    arrival: 'dict[hardware.Node, float]' = {}
+    previous: 'dict[hardware.Node, hardware.Node]' = {}  # the input of the leaf of each output which set its arrival
+    if len(registers) > 0:
+        for register in registers:
+            arrival[register.value] = model.clockToQ(register)
+    else:
+        for node in root._inputs.values():
+            arrival[node] = 0.0
+    for leaves in hardware.levelize(root).schedule():
+        for leaf in leaves:
+            latest = None
+            for node in leaf._inputs.values():
+                driver, wires = driverOf(node)
+                if driver in arrival and (latest == None or arrival[driver] > arrival[latest[1]]):
+                    latest = (node, driver)
+            if latest == None:
+                continue  # only driven by constants
+            for node in leaf._outputs.values():
+                arrival[node] = arrival[latest[1]] + model.delay(leaf)
+                previous[node] = latest[0]
+    if len(registers) > 0:
+        ends = [(register.input, model.setup(register)) for register in registers]
+    else:
+        ends = [(node, 0.0) for node in root._outputs.values()]
+    worst = None
+    for end, setup in ends:
+        driver, wires = driverOf(end)
+        if driver in arrival and (worst == None or arrival[driver] + setup > worst[0]):
+            worst = (arrival[driver] + setup, end)
+    if worst == None:
+        return None
+    # trace the path back to its start
+    delay, end = worst
+    pathComponents, pathWires, arrivals = [], [], []
+    node = end
+    while True:
+        driver, wires = driverOf(node)
+        pathWires[:0] = wires
+        if driver not in previous:
+            break
+        pathComponents.append(driver._parent)
+        arrivals.append(arrival[driver])
+        node = previous[driver]
+    pathComponents.reverse()
+    arrivals.reverse()
+    return TimingPath(delay, driver, end, pathComponents, pathWires, arrivals)